@@ -4,8 +4,8 @@ import requests
 import sys
 
 from base.module import ModuleBase, ModuleAdminCommand
-from lib.twitch_oauth import twitch_login, save_oauth, User
-from lib.common import get_all_acccounts, get_broadcaster, get_user_by_twitch_id
+from lib.twitch_oauth import twitch_login, save_oauth
+from lib.common import get_all_acccounts, get_broadcaster, get_user, get_user_by_twitch_id
 import config
 
 class GetTwitchLogin(threading.Thread):
@@ -106,7 +106,7 @@ class Account(ModuleBase):
 				self.print('Invalid selection')
 				return False
 
-			selected_user = User(account_list[selection-1])
+			selected_user = get_user(account_list[selection-1])
 
 			def confirm(prompt):
 				prompt = prompt.lower().strip()
@@ -148,7 +148,7 @@ class Account(ModuleBase):
 				self.print('Invalid selection')
 				return False
 
-			selected_user = User(account_list[selection-1])
+			selected_user = get_user(account_list[selection-1])
 
 			def confirm(prompt):
 				prompt = prompt.lower().strip()
@@ -188,7 +188,7 @@ class Account(ModuleBase):
 				self.print('Invalid selection')
 				return False
 
-			selected_user = User(account_list[selection-1])
+			selected_user = get_user(account_list[selection-1])
 
 			def confirm(prompt):
 				prompt = prompt.lower().strip()
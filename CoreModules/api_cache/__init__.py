@@ -0,0 +1 @@
+from .api_cache import ApiCacheModule as VoltronModule
@@ -0,0 +1,81 @@
+from base.module import ModuleBase, ModuleAdminCommand
+from lib.apifetch import api_fetcher
+
+import re
+
+class ApiCacheModule(ModuleBase):
+	module_name = 'api'
+	def setup(self):
+		self._api_data = self.get_module_data()
+
+		if not 'ttls' in self._api_data:
+			self._api_data['ttls'] = {}
+
+		api_fetcher.set_ttls(self._api_data['ttls'])
+
+		self.register_admin_command(ModuleAdminCommand(
+			'ttl',
+			self._set_ttl,
+			usage = f'{self.module_name} ttl <url> <seconds>',
+			description = 'Reuse responses from <url> in {api:<url>} for <seconds>. 0 fetches every time'
+		))
+
+		self.register_admin_command(ModuleAdminCommand(
+			'list',
+			self._list_ttls,
+			usage = f'{self.module_name} list',
+			description = 'List URLs with a cache time'
+		))
+
+		self.register_admin_command(ModuleAdminCommand(
+			'stats',
+			self._stats,
+			usage = f'{self.module_name} stats',
+			description = 'Show {api} cache statistics'
+		))
+
+		self.register_admin_command(ModuleAdminCommand(
+			'clear',
+			self._clear,
+			usage = f'{self.module_name} clear',
+			description = 'Forget all cached {api} responses'
+		))
+
+	def _set_ttl(self, input, command):
+		match = re.search(r'^([^ ]+) ([\d]+)$', input.strip())
+		if not match:
+			self.print(f'Usage: {command.usage}')
+			return
+
+		url = match.group(1)
+		ttl = int(match.group(2))
+
+		if ttl:
+			self._api_data['ttls'][url] = ttl
+		else:
+			self._api_data['ttls'].pop(url, None)
+		self.save_module_data(self._api_data)
+		api_fetcher.set_ttl(url, ttl)
+
+		self.print(f'Cache time for {url} set to {ttl} seconds')
+
+	def _list_ttls(self, input, command):
+		self.print('URL cache times:')
+		for url, ttl in self._api_data['ttls'].items():
+			self.print(f'  {url}: {ttl} seconds')
+
+	def _stats(self, input, command):
+		stats = api_fetcher.stats()
+
+		self.print('')
+		self.print('{api} Cache:')
+		self.print(f"  Cached URLs: {stats['entries']}")
+		self.print(f"  Hits: {stats['hits']}")
+		self.print(f"  Revalidated (304): {stats['revalidated']}")
+		self.print(f"  Fetched: {stats['misses']}")
+		self.print(f"  Errors: {stats['errors']}")
+		self.print('')
+
+	def _clear(self, input, command):
+		api_fetcher.clear()
+		self.print('{api} cache cleared')
@@ -83,7 +83,14 @@ class BasicCommands(ModuleBase):
 			description = 'Set value of a counter'
 		))
 
-		self.event_listen(EVT_CHATCOMMAND, self.command)
+		self.event_listen(EVT_CHATCOMMAND, self.command, {'commands': self._command_names()})
+
+	def _command_names(self):
+		return set(self._static_commands) | set(self._commands)
+
+	def _commands_changed(self):
+		## Only receive the commands we actually handle
+		self.update_command_filter(self.command, self._command_names())
 
 	def command(self, event):
 		## Chat command received
@@ -99,8 +106,6 @@ class BasicCommands(ModuleBase):
 			for response in self._commands[event.command]['response']:
 				self.send_chat_message(response, twitch_id=twitch_id, event=event)
 
-			self.save_module_data(self._commands)
-
 			return True
 
 	def _list_commands(self, event):
@@ -125,6 +130,7 @@ class BasicCommands(ModuleBase):
 				self._commands[command] = { 'response': [response] }
 
 			self.save_module_data(self._commands)
+			self._commands_changed()
 			self.send_chat_message(f'Command !{command} successfully added!')
 
 	def _add_command_admin(self, input, command):
@@ -142,6 +148,7 @@ class BasicCommands(ModuleBase):
 			self._commands[new_command] = { 'response': [response] }
 
 		self.save_module_data(self._commands)
+		self._commands_changed()
 		self.print(f'Command !{new_command} successfully added!')
 
 	def _append_command(self, event):
@@ -196,6 +203,7 @@ class BasicCommands(ModuleBase):
 
 		del self._commands[command]
 		self.save_module_data(self._commands)
+		self._commands_changed()
 		self.send_chat_message(f'Command !{command} successfully deleted!')
 
 	def _delete_command_admin(self, input, command):
@@ -211,6 +219,7 @@ class BasicCommands(ModuleBase):
 
 		del self._commands[new_command]
 		self.save_module_data(self._commands)
+		self._commands_changed()
 		self.print(f'Command !{new_command} successfully deleted!')
 
 	def _toggle_command(self, input, command):
@@ -3,7 +3,6 @@ from base.events import EVT_CHATCOMMAND
 
 import re
 import time
-import threading
 
 class CooldownModule(ModuleBase):
 	module_name = 'cooldown'
@@ -86,7 +85,9 @@ class CooldownModule(ModuleBase):
 		runtimes['user'] = user_runtimes
 		self._cooldown_data['runtimes'][event.command] = runtimes
 
-		self.save_module_data(self._cooldown_data)
+		## Runtimes only matter for commands with a cooldown
+		if event.command in self._cooldown_data['commands'] or self.default_cooldown:
+			self.save_module_data(self._cooldown_data)
 
 	def event_on_cooldown(self, event):
 		if event.bypass_cooldowns:
@@ -133,8 +134,7 @@ class CooldownModule(ModuleBase):
 
 				self.save_module_data(self._cooldown_data)
 
-				thread = threading.Thread(target=self._queue_command, args=(event, cd))
-				thread.start()
+				self.schedule_after(cd, self._queue_command, event)
 
 				return True
 			else:
@@ -142,8 +142,7 @@ class CooldownModule(ModuleBase):
 
 		return False
 
-	def _queue_command(self, event, delay):
-		time.sleep(delay)
+	def _queue_command(self, event):
 		event.bypass_cooldowns = True
 		self.event_loop.event_queue.put(event)
 
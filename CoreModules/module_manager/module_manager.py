@@ -1,6 +1,8 @@
 from base.module import ModuleBase, ModuleAdminCommand
 import re
 from lib.common import get_db
+from lib.TwitchAPIHelper import helix_cache, get_rate_limit_states
+from lib.audiocache import audio_cache
 
 class ModuleManager(ModuleBase):
 	module_name = "module"
@@ -19,6 +21,34 @@ class ModuleManager(ModuleBase):
 			description = 'List all modules'
 		))
 
+		self.register_admin_command(ModuleAdminCommand(
+			'flush',
+			self.flush_data,
+			usage = f'{self.module_name} flush',
+			description = 'Write all pending module data to the database now'
+		))
+
+		self.register_admin_command(ModuleAdminCommand(
+			'chatqueue',
+			self.chat_queue,
+			usage = f'{self.module_name} chatqueue',
+			description = 'Show chat message queue statistics'
+		))
+
+		self.register_admin_command(ModuleAdminCommand(
+			'audiocache',
+			self.audio_cache,
+			usage = f'{self.module_name} audiocache [clear]',
+			description = 'Show decoded audio cache statistics or clear the cache'
+		))
+
+		self.register_admin_command(ModuleAdminCommand(
+			'apicache',
+			self.api_cache,
+			usage = f'{self.module_name} apicache [clear]',
+			description = 'Show Twitch API cache and rate limit statistics or clear the cache'
+		))
+
 	def toggle_module(self, input, command):
 		match = re.search(r'^([^ ]+)$', input.strip())
 		if not match:
@@ -51,6 +81,85 @@ class ModuleManager(ModuleBase):
 		con.close()
 
 
+	def flush_data(self, input, command):
+		self.flush_module_data()
+		self.print('Module data saved')
+
+	def chat_queue(self, input, command):
+		stats = self.voltron.chat_sender.stats()
+
+		self.print('')
+		self.print('Chat Message Queue:')
+		self.print(f"  Waiting: {stats['queued']}")
+		self.print(f"  Sent: {stats['sent']}")
+		self.print(f"  Dropped: {stats['dropped']}")
+		self.print(f"  Merged: {stats['merged']}")
+		self.print(f"  Failed: {stats['failed']}")
+		self.print(f"  Average queue wait: {stats['avg_wait'] * 1000:.1f}ms")
+		self.print(f"  Max queue wait: {stats['max_wait'] * 1000:.1f}ms")
+		self.print('')
+
+	def audio_cache(self, input, command):
+		if input.strip() == 'clear':
+			audio_cache.clear()
+			self.print('Audio cache cleared')
+			return
+		elif input.strip():
+			self.print(f'Usage: {command.usage}')
+			return
+
+		stats = audio_cache.stats()
+		lookups = stats['hits'] + stats['misses']
+		hit_rate = 0
+		if lookups:
+			hit_rate = 100 * stats['hits'] / lookups
+
+		self.print('')
+		self.print('Audio Cache:')
+		self.print(f"  Sounds: {stats['entries']}")
+		self.print(f"  Memory: {stats['bytes'] / 1048576:.1f}MB of {stats['max_bytes'] / 1048576:.0f}MB")
+		self.print(f"  Hits: {stats['hits']}")
+		self.print(f"  Misses: {stats['misses']}")
+		self.print(f'  Hit rate: {hit_rate:.1f}%')
+		self.print('')
+
+	def api_cache(self, input, command):
+		if input.strip() == 'clear':
+			helix_cache.invalidate()
+			self.print('Twitch API cache cleared')
+			return
+		elif input.strip():
+			self.print(f'Usage: {command.usage}')
+			return
+
+		stats = helix_cache.stats()
+		lookups = stats['hits'] + stats['negative_hits'] + stats['misses']
+		hit_rate = 0
+		if lookups:
+			hit_rate = 100 * (lookups - stats['misses']) / lookups
+
+		self.print('')
+		self.print('Twitch API Cache:')
+		self.print(f"  Entries: {stats['entries']}")
+		self.print(f"  Hits: {stats['hits']}")
+		self.print(f"  Negative hits: {stats['negative_hits']}")
+		self.print(f"  Shared in-flight: {stats['shared']}")
+		self.print(f"  Misses: {stats['misses']}")
+		self.print(f'  Hit rate: {hit_rate:.1f}%')
+
+		for account, state in get_rate_limit_states().items():
+			self.print('')
+			self.print(f'Rate Limit (account {account}):')
+			if state['remaining'] is None:
+				self.print('  No requests made yet')
+			else:
+				self.print(f"  Remaining: {state['remaining']}/{state['limit']} (resets in {state['reset_in']:.0f}s)")
+			self.print(f"  Waiting: {state['waiting']}")
+			self.print(f"  Throttled: {state['throttled']}")
+			self.print(f"  Timed out: {state['rejected']}")
+			self.print(f"  429 responses: {state['rate_limited']}")
+		self.print('')
+
 	def list_modules(self, input, command):
 		con, cur = get_db()
 
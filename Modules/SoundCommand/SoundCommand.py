@@ -1,5 +1,6 @@
 from base.module import ModuleBase, ModuleAdminCommand
 from base.events import EVT_CHATCOMMAND
+from lib.mixer import POLICY_STACK
 
 import sounddevice
 import re
@@ -60,6 +61,13 @@ class SoundCommand(ModuleBase):
 			description = 'Set volume for sound in %. Default is 100.'
 		))
 
+		self.register_admin_command(ModuleAdminCommand(
+			'policy',
+			self._set_policy,
+			usage = f'{self.module_name} policy <!command> <stack/replace>',
+			description = 'Set whether the sound plays over itself (stack) or restarts (replace). Default is stack.'
+		))
+
 		self.register_admin_command(ModuleAdminCommand(
 			'dir',
 			self._show_directory,
@@ -67,7 +75,12 @@ class SoundCommand(ModuleBase):
 			description = 'Show media directory for audio files'
 		))
 
-		self.event_listen(EVT_CHATCOMMAND, self.command)
+		self.event_listen(EVT_CHATCOMMAND, self.command, {'commands': set(self._commands['commands'])})
+
+		for command in self._commands['commands'].values():
+			sound_path = f"{self.media_directory}\\{command['sound_file']}"
+			if os.path.isfile(sound_path):
+				self.prewarm_audio(sound_path, device=self.audio_device)
 
 	def command(self, event):
 		command = self._commands['commands'].get(event.command, None)
@@ -81,7 +94,13 @@ class SoundCommand(ModuleBase):
 			self.buffer_print('ERR', f'{sound_path} does not exist')
 			return True
 
-		self.play_audio(sound_path, device=self.audio_device, volume=volume)
+		self.play_audio(
+			sound_path,
+			device=self.audio_device,
+			volume=volume,
+			key=f'{self.module_name}:{event.command}',
+			policy=command.get('policy', POLICY_STACK)
+		)
 
 		return True
 
@@ -151,6 +170,23 @@ class SoundCommand(ModuleBase):
 		self.save_module_data(self._commands)
 		self.print(f"Volume for !{command} set to {volume}%")
 
+	def _set_policy(self, input, command):
+		match = re.search(r'^!([^ ]+) (stack|replace)$', input.strip())
+		if not match:
+			self.print(f'Usage: {command.usage}')
+			return
+
+		command = match.group(1).lower()
+		policy = match.group(2)
+
+		if not command in self._commands['commands']:
+			self.print(f'Command not found: !{command}')
+			return
+
+		self._commands['commands'][command]['policy'] = policy
+		self.save_module_data(self._commands)
+		self.print(f"Policy for !{command} set to {policy}")
+
 	def _add_command(self, input, command):
 		match = re.search(r'^!([^ ]+) ([^ ]+)', input)
 		if not match:
@@ -166,6 +202,7 @@ class SoundCommand(ModuleBase):
 			self._commands['commands'][command] = { 'sound_file': sound_file }
 
 		self.save_module_data(self._commands)
+		self.update_command_filter(self.command, set(self._commands['commands']))
 		self.print(f'Sound Command !{command} successfully added!')
 
 	def _list_commands(self, input, command):
@@ -201,6 +238,8 @@ class SoundCommand(ModuleBase):
 
 		self.print(f'Details for !{command}:')
 		self.print(f'  File: {media_file}')
+		self.print(f"  Volume: {self._commands['commands'][command].get('volume', 100)}%")
+		self.print(f"  Policy: {self._commands['commands'][command].get('policy', POLICY_STACK)}")
 
 
 	def _delete_command(self, input, command):
@@ -216,6 +255,7 @@ class SoundCommand(ModuleBase):
 
 		del self._commands['commands'][selected_command]
 		self.save_module_data(self._commands)
+		self.update_command_filter(self.command, set(self._commands['commands']))
 		self.print(f'Command !{selected_command} deleted')
 
 	def _show_directory(self, input, command):
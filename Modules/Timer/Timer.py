@@ -1,5 +1,6 @@
 from base.module import ModuleBase, ModuleAdminCommand
-from base.events import EVT_TIMER, EVT_CHATCOMMAND
+from base.events import EVT_CHATCOMMAND
+from lib.TwitchIRC import PRIORITY_LOW
 import time
 import re
 
@@ -15,6 +16,12 @@ class Timer(ModuleBase):
 		if not 'timers' in self._timer_data:
 			self._timer_data['timers'] = []
 
+		## key -> (timer, scheduled job) for each active timer. Keys are
+		## never reused so a stale job can't find a newer timer
+		self._timer_jobs = {}
+		self._timer_key = 0
+		self._schedule_timers()
+
 		self.register_admin_command(ModuleAdminCommand(
 			'list',
 			self._list_timers,
@@ -29,8 +36,7 @@ class Timer(ModuleBase):
 			description = 'Clear all timers'
 		))
 
-		self.event_listen(EVT_CHATCOMMAND, self.command)
-		self.event_listen(EVT_TIMER, self.timer_check)
+		self.event_listen(EVT_CHATCOMMAND, self.command, {'commands': {'timer'}})
 
 	def command(self, event):
 		if event.command != 'timer':
@@ -68,8 +74,9 @@ class Timer(ModuleBase):
 			## Add time to the existing timer, create a new entry
 			## and delete the old one
 			new_time = timer[0] + (minutes * 60)
-			self._timer_data['timers'].remove(timer)
-			self._timer_data['timers'].append((new_time, message))
+			self._remove_timer(timer)
+			self._add_timer((new_time, message))
+			self.save_module_data(self._timer_data)
 			minutes = int((new_time - time.time()) / 60)
 			self.send_chat_message(f"@{event.display_name} timer increased to {minutes} minutes")
 			return True
@@ -79,7 +86,7 @@ class Timer(ModuleBase):
 
 		exp_time = time.time() + (minutes * 60)
 
-		self._timer_data['timers'].append((exp_time, message))
+		self._add_timer((exp_time, message))
 		self.save_module_data(self._timer_data)
 
 		self.send_chat_message(f'@{event.display_name} timer set for {minutes} minute(s)')
@@ -98,6 +105,9 @@ class Timer(ModuleBase):
 	def _clear_timers(self, input, command):
 		def confirm(prompt):
 			if prompt.lower() == 'y':
+				for timer, job in self._timer_jobs.values():
+					self.cancel_scheduled(job)
+				self._timer_jobs = {}
 				self._timer_data['timers'] = []
 				self.save_module_data(self._timer_data)
 				self.print('Timers cleared.')
@@ -112,7 +122,25 @@ class Timer(ModuleBase):
 		self.update_status_text('Are you sure you want to clear all active timers?')
 		self.prompt_ident = self.get_prompt('[Y]es/[N]o > ', confirm)
 
-	def timer_check(self, event):
+	def _add_timer(self, timer):
+		self._timer_data['timers'].append(timer)
+		self._schedule_timer(timer)
+
+	def _schedule_timer(self, timer):
+		self._timer_key += 1
+		key = self._timer_key
+		self._timer_jobs[key] = (timer, self.schedule_at(timer[0], self._timer_expired, key))
+
+	def _remove_timer(self, timer):
+		self._timer_data['timers'].remove(timer)
+		for key, (active_timer, job) in self._timer_jobs.items():
+			if active_timer is timer:
+				self.cancel_scheduled(job)
+				del self._timer_jobs[key]
+				break
+
+	def _schedule_timers(self):
+		## Schedule timers saved by a previous session
 		to_remove = []
 		for timer in self._timer_data['timers']:
 			## In case old timers are hanging around with ridiculous times
@@ -120,21 +148,25 @@ class Timer(ModuleBase):
 			## timers were gettings set. Clean them up here!
 			if (timer[0] - time.time()) > self.max_timer_len*60:
 				to_remove.append(timer)
-			## Check if it's time to send a message
-			if time.time() > timer[0]:
-				self.send_chat_message(timer[1])
-				## Can't modify the list while iterating through it.
-				## do it later
-				to_remove.append(timer)
+				continue
+			self._schedule_timer(timer)
 
-		## Remove all timers that have elapsed
 		for remove in to_remove:
 			self._timer_data['timers'].remove(remove)
 
-		## Only hit the db if we modified stuff
 		if to_remove:
 			self.save_module_data(self._timer_data)
 
+	def _timer_expired(self, key):
+		## The timer may have been replaced or cleared since it was scheduled
+		entry = self._timer_jobs.pop(key, None)
+		if entry is None:
+			return
+		timer = entry[0]
+
+		self.send_chat_message(timer[1], priority=PRIORITY_LOW)
+		self._timer_data['timers'].remove(timer)
+		self.save_module_data(self._timer_data)
 
 	def shutdown(self):
 		self.save_module_data(self._timer_data)
@@ -2,8 +2,6 @@ from base.module import ModuleBase, ModuleAdminCommand
 from base.events import EVT_CHATCOMMAND, ChatCommandEvent
 
 import re
-import threading
-import time
 
 class AliasModule(ModuleBase):
 	module_name = 'alias'
@@ -40,7 +38,7 @@ class AliasModule(ModuleBase):
 			description = 'Delete one or all entries for !<alias>',
 		))
 
-		self.event_listen(EVT_CHATCOMMAND, self.command)
+		self.event_listen(EVT_CHATCOMMAND, self.command, {'commands': set(self._module_data['commands'])})
 
 	def command(self, event):
 		if not event.command in self._module_data['commands']:
@@ -67,18 +65,7 @@ class AliasModule(ModuleBase):
 				self.event_loop.event_queue.put(command_event)
 			else:
 				delay = seq['delay'] / 1000
-				t = threading.Thread(
-					target=self._delayed_event_queue,
-					args=(
-						command_event,
-						delay
-					)
-				)
-				t.start()
-
-	def _delayed_event_queue(self, event, delay):
-		time.sleep(delay)
-		self.event_loop.event_queue.put(event)
+				self.schedule_after(delay, self.event_loop.event_queue.put, command_event)
 
 	def _new_alias(self, input, command):
 		match = re.search(r'^!([^ ]+)$', input)
@@ -94,6 +81,7 @@ class AliasModule(ModuleBase):
 		self._module_data['commands'][command] = {'sequence': []}
 		self.print(f'!{command} is now registered as an alias')
 		self.save_module_data(self._module_data)
+		self.update_command_filter(self.command, set(self._module_data['commands']))
 
 	def _add_alias_command(self, input, command):
 		match = re.search(r'^!([^ ]+)$', input)
@@ -196,6 +184,7 @@ class AliasModule(ModuleBase):
 			if entry.lower() == 'all':
 				del self._module_data['commands'][alias]
 				self.save_module_data(self._module_data)
+				self.update_command_filter(self.command, set(self._module_data['commands']))
 				self.print(f'Alias !{alias} has been deleted')
 				self.update_status_text()
 				return True
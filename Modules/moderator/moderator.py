@@ -12,7 +12,7 @@ class ModeratorModule(ModuleBase):
 			'setgame': self._set_game
 		}
 
-		self.event_listen(EVT_CHATCOMMAND, self.command)
+		self.event_listen(EVT_CHATCOMMAND, self.command, {'commands': set(self._command_map)})
 
 	def command(self, event):
 		if not event.command in self._command_map:
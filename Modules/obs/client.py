@@ -0,0 +1,271 @@
+import json
+import base64
+import hashlib
+import socket
+import threading
+import time
+from concurrent.futures import Future
+
+from websocket import WebSocket, WebSocketException, WebSocketTimeoutException
+
+## Seconds OBS has to answer a request
+DEFAULT_REQUEST_TIMEOUT = 5
+## Seconds to wait for the connection and login to finish
+CONNECT_TIMEOUT = 5
+## How often the reader wakes up to expire requests while OBS is quiet
+READ_POLL_INTERVAL = 0.5
+## Seconds between reconnect attempts. Doubles up to the max
+RECONNECT_DELAY = 1
+RECONNECT_MAX_DELAY = 30
+
+class OBSClient(threading.Thread):
+	"""
+	Persistent connection to obs-websocket.
+
+	One reader thread owns the socket. Requests can be sent from any thread
+	and return a Future that gets the response with the same message-id,
+	or fails with TimeoutError or ConnectionError. Events from OBS go to
+	listeners added with add_event_listener. If the connection drops it's
+	reopened with exponential backoff.
+
+	Future callbacks and event listeners run on the reader thread so they
+	must not wait on other requests.
+
+	Args:
+		buffer_queue (Queue): Queue for UI output
+		host (string): obs-websocket host
+		port (int): obs-websocket port
+		password (string): obs-websocket password. None if not set
+	"""
+	def __init__(self, buffer_queue, host, port, password):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.buffer_queue = buffer_queue
+		self.host = host
+		self.port = port
+		self.password = password
+
+		self._ws = None
+		self._connected = threading.Event()
+		self._keep_running = True
+		self._wakeup = threading.Event()
+
+		self._lock = threading.Lock()
+		self._send_lock = threading.Lock()
+		self._call_id = 0
+		## message-id -> (Future, deadline)
+		self._pending = {}
+		## update-type -> list of callbacks
+		self._listeners = {}
+
+	@property
+	def connected(self):
+		return self._connected.is_set()
+
+	def add_event_listener(self, update_type, callback):
+		"""
+		Call callback with each OBS event of update_type
+
+		Args:
+			update_type (string): obs-websocket event name, e.g. SwitchScenes
+			callback (func): Called with the event dict
+		"""
+		with self._lock:
+			self._listeners.setdefault(update_type, []).append(callback)
+
+	def request(self, request_type, fields=None, timeout=DEFAULT_REQUEST_TIMEOUT):
+		"""
+		Send a request without waiting for the response
+
+		Args:
+			request_type (string): obs-websocket request name
+			fields (dict): Request fields
+			timeout (int): Seconds OBS has to respond
+
+		Returns:
+			Future resolved with the response dict. Responses with an error
+			status are results, not exceptions
+		"""
+		future = Future()
+		ws = self._ws
+		if ws is None or not self._connected.is_set():
+			future.set_exception(ConnectionError('Not connected to OBS'))
+			return future
+
+		req = dict(fields or {})
+		req['request-type'] = request_type
+		with self._lock:
+			self._call_id += 1
+			req['message-id'] = str(self._call_id)
+			self._pending[req['message-id']] = (future, time.monotonic() + timeout)
+
+		try:
+			with self._send_lock:
+				ws.send(json.dumps(req))
+		except (WebSocketException, OSError) as e:
+			self._resolve(req['message-id'], error=ConnectionError(f'Error sending to OBS: {e}'))
+			## Make the reader notice right away
+			ws.shutdown()
+
+		return future
+
+	def call(self, request_type, fields=None, timeout=DEFAULT_REQUEST_TIMEOUT):
+		"""
+		Send a request and wait for the response. Waits for the connection
+		first if it's being opened
+
+		Raises:
+			ConnectionError if OBS can't be reached
+			TimeoutError if OBS doesn't respond in time
+		"""
+		self._connected.wait(CONNECT_TIMEOUT)
+		future = self.request(request_type, fields, timeout)
+		## The reader expires the request, this is just a backstop
+		return future.result(timeout + CONNECT_TIMEOUT)
+
+	def run(self):
+		delay = RECONNECT_DELAY
+		reported = False
+		while self._keep_running:
+			try:
+				self._ws = self._connect()
+			except (WebSocketException, OSError, ValueError, KeyError) as e:
+				## Only report the first failure of an outage
+				if not reported and self._keep_running:
+					self.buffer_queue.put(('ERR', f'Error connecting to OBS: {e}'))
+					self.buffer_queue.put(('ERR', 'Check your settings and make sure OBS is running'))
+					reported = True
+				self._wakeup.wait(delay)
+				self._wakeup.clear()
+				self._expire()
+				delay = min(delay * 2, RECONNECT_MAX_DELAY)
+				continue
+
+			if reported:
+				self.buffer_queue.put(('DEBUG', 'Reconnected to OBS'))
+			reported = False
+			delay = RECONNECT_DELAY
+
+			self._connected.set()
+			self._read(self._ws)
+			self._connected.clear()
+
+			self._fail_pending(ConnectionError('Lost connection to OBS'))
+			try:
+				self._ws.close()
+			except Exception:
+				pass
+			self._ws = None
+
+	def _connect(self):
+		ws = WebSocket()
+		ws.connect(f'ws://{self.host}:{self.port}', timeout=CONNECT_TIMEOUT)
+		try:
+			res = self._handshake_call(ws, {
+				'request-type': 'GetAuthRequired',
+				'message-id': 'auth-1'
+			})
+			if res['status'] != 'ok':
+				raise ValueError(res['error'])
+
+			if res.get('authRequired'):
+				password = self.password or ''
+				sec = base64.b64encode(hashlib.sha256((password + res['salt']).encode('utf-8')).digest())
+				auth = base64.b64encode(hashlib.sha256(sec + res['challenge'].encode('utf-8')).digest()).decode('utf-8')
+				res = self._handshake_call(ws, {
+					'request-type': 'Authenticate',
+					'message-id': 'auth-2',
+					'auth': auth
+				})
+				if res['status'] != 'ok':
+					raise ValueError(res['error'])
+		except:
+			ws.close()
+			raise
+
+		ws.settimeout(READ_POLL_INTERVAL)
+		return ws
+
+	def _handshake_call(self, ws, req):
+		## Nothing else is using the socket yet so it's read directly
+		ws.send(json.dumps(req))
+		while True:
+			res = json.loads(ws.recv())
+			if res.get('message-id') == req['message-id']:
+				return res
+
+	def _read(self, ws):
+		while self._keep_running:
+			try:
+				raw = ws.recv()
+			except (WebSocketTimeoutException, socket.timeout):
+				raw = None
+			except (WebSocketException, OSError):
+				return
+
+			if raw:
+				self._dispatch(raw)
+			elif raw is not None and not ws.connected:
+				return
+
+			self._expire()
+
+	def _dispatch(self, raw):
+		try:
+			msg = json.loads(raw)
+		except ValueError:
+			return
+
+		if 'message-id' in msg:
+			self._resolve(msg['message-id'], result=msg)
+		elif 'update-type' in msg:
+			with self._lock:
+				listeners = list(self._listeners.get(msg['update-type'], ()))
+			for callback in listeners:
+				try:
+					callback(msg)
+				except Exception as e:
+					self.buffer_queue.put(('ERR', f"Error handling OBS event {msg['update-type']}: {e}"))
+
+	def _resolve(self, message_id, result=None, error=None):
+		with self._lock:
+			entry = self._pending.pop(message_id, None)
+		if entry is None:
+			return
+		if error is not None:
+			entry[0].set_exception(error)
+		else:
+			entry[0].set_result(result)
+
+	def _expire(self):
+		now = time.monotonic()
+		with self._lock:
+			if not self._pending:
+				return
+			expired = [message_id for message_id, (future, deadline) in self._pending.items() if deadline <= now]
+		for message_id in expired:
+			self._resolve(message_id, error=TimeoutError('OBS did not respond in time'))
+
+	def _fail_pending(self, error):
+		with self._lock:
+			pending = self._pending
+			self._pending = {}
+		for future, deadline in pending.values():
+			future.set_exception(error)
+
+	def shutdown(self):
+		"""
+		Close the connection and stop the reader. Waiting requests fail
+		with ConnectionError
+		"""
+		self._keep_running = False
+		self._wakeup.set()
+		ws = self._ws
+		if ws is not None:
+			try:
+				ws.shutdown()
+			except Exception:
+				pass
+		if self.is_alive():
+			self.join()
+		self._fail_pending(ConnectionError('OBS connection closed'))
@@ -1,68 +1,73 @@
 from base.module import ModuleBase, ModuleAdminCommand
-from websocket import WebSocket
-import socket
 from base.events import EVT_CHATCOMMAND
+from .client import OBSClient
 
 import re
-import json
-import base64
-import hashlib
 import time
+import heapq
+import itertools
 import threading
-from queue import Queue
-
-def obs_ws_connect(buffer_queue, host, port, password):
-	ws = WebSocket()
-	try:
-		ws.connect(f'ws://{host}:{port}')
-
-		ws.send(json.dumps({
-			"request-type": "GetAuthRequired",
-			"message-id": "1"
-		}))
-		res = json.loads(ws.recv())
-
-		if res['status'] != 'ok':
-			buffer_queue.put(('ERR', res['error']))
-			return None
-
-		if res.get('authRequired'):
-			sec = base64.b64encode(hashlib.sha256((password + res['salt']).encode('utf-8')).digest())
-			auth = base64.b64encode(hashlib.sha256(sec + res['challenge'].encode('utf-8')).digest()).decode('utf-8')
-			ws.send(json.dumps({"request-type": "Authenticate", "message-id": '2', "auth": auth}))
-
-			res = json.loads(ws.recv())
-			if res['status'] != 'ok':
-				self.buffer_queue.put(('ERR', res['error']))
-				return None
-
-		return ws
-
-	except socket.error as error:
-		buffer_queue.put(('ERR', error))
-		return None
+from collections import deque
+from functools import partial
+from queue import Queue, Empty
+
+class _RenderTarget:
+	"""
+	Visibility of one source or filter being shown or hidden for a while
+
+	Args:
+		render (func): Called with True or False to show or hide it in OBS
+	"""
+	__slots__ = ('render', 'state', 'deadline', 'windows', 'sent')
+
+	def __init__(self, render):
+		self.render = render
+		## State for the current window and when it ends
+		self.state = None
+		self.deadline = None
+		## Windows waiting for the current one to end as [state, seconds]
+		self.windows = deque()
+		## What OBS was last told
+		self.sent = None
+
+	def apply(self, state):
+		## Only changes are sent so OBS never gets redundant toggles
+		if state != self.sent:
+			self.sent = state
+			self.render(render=state)
 
 class OBSThread(threading.Thread):
-	def __init__(self, obs_queue, buffer_queue, host, port, password):
+	def __init__(self, obs_queue, buffer_queue, obs_client):
 		threading.Thread.__init__(self)
 		self.obs_queue = obs_queue
 		self.buffer_queue = buffer_queue
+		self.obs_client = obs_client
 		self._keep_running = True
-		self.errors = False
-
-		self.host = host
-		self.port = port
-		self.password = password
 
-		self._render_end_times = {}
+		## Timed sources and filters are driven from this thread by a heap of
+		## window deadlines instead of a sleeping thread per show and hide
+		## (kind, scene or source, source or filter) -> _RenderTarget
+		self._render_targets = {}
+		## (deadline, seq, key). Entries can be stale when a window is extended
+		self._deadlines = []
+		self._deadline_seq = itertools.count()
 
-		self._call_id = 1000
-
-		self._ws = None
+		## Scene changes waiting to be sent, in the order they were queued
+		self._scene_changes = deque()
+		## GetCurrentScene request for the change at the front
+		self._scene_future = None
 
 	def run(self):
 		while self._keep_running:
-			event = self.obs_queue.get()
+			self._render_due()
+
+			timeout = None
+			if self._deadlines:
+				timeout = max(0, self._deadlines[0][0] - time.monotonic())
+			try:
+				event = self.obs_queue.get(timeout=timeout)
+			except Empty:
+				continue
 
 			if isinstance(event, str) and event.lower() == 'shutdown':
 				self._keep_running = False
@@ -76,139 +81,162 @@ class OBSThread(threading.Thread):
 			elif command.get('action') == 'scenechange':
 				self.scene_change(command)
 
+			elif command.get('action') == 'currentscene':
+				self._current_scene_received(command['future'])
+
+		self._reset_renders()
+
 	def scene_change(self, command):
-		if 'source_scenes' in command:
-			if type(command['source_scenes']) == type(''):
-				source_scenes = command['source_scenes'].split()
-			else:
-				source_scenes = command['source_scenes']
-
-			req = {
-				'message-id': self.call_id,
-				'request-type': 'GetCurrentScene'
-			}
-
-			if self.send_obs_command(req):
-				res = {}
-				while res.get('message-id', -1) != req['message-id']:
-					res = json.loads(self.obs_ws.recv())
-				current_scene = res['name']
-				if not current_scene in source_scenes:
-					return
-			else:
-				return
+		## Scene changes are sent in the order they were queued. One that
+		## depends on the current scene holds back the changes after it until
+		## OBS answers, without holding up anything else on the queue
+		self._scene_changes.append(command)
+		if len(self._scene_changes) == 1:
+			self._next_scene_change()
+
+	def _next_scene_change(self):
+		while self._scene_changes:
+			command = self._scene_changes[0]
+			if 'source_scenes' not in command:
+				self._scene_changes.popleft()
+				self.send_obs_command('SetCurrentScene', {'scene-name': command['scene']})
+				continue
 
-		req = {
-			'message-id': self.call_id,
-			'request-type': 'SetCurrentScene',
-			'scene-name': command['scene']
-		}
+			## The response is handed back to this thread through the queue
+			self._scene_future = self.obs_client.request('GetCurrentScene')
+			self._scene_future.add_done_callback(lambda f: self.obs_queue.put({'action': 'currentscene', 'future': f}))
+			return
+
+	def _current_scene_received(self, future):
+		## Left over from a thread that was restarted
+		if future is not self._scene_future:
+			return
+		self._scene_future = None
+
+		command = self._scene_changes.popleft()
+		if type(command['source_scenes']) == type(''):
+			source_scenes = command['source_scenes'].split()
+		else:
+			source_scenes = command['source_scenes']
+
+		res = self._check_response('GetCurrentScene', future)
+		if res is not None and res['name'] in source_scenes:
+			self.send_obs_command('SetCurrentScene', {'scene-name': command['scene']})
 
-		self.send_obs_command(req)
+		self._next_scene_change()
 
 	def render_cycle(self, command):
-		ident = ""
-		args = None
-		kwargs = {}
-		func = None
 		action = command.get('action')
-		render_order = (True, False)
 		if action in ('timedfilter', 'hidetimedfilter'):
-			args = (command['source'], command['filter'])
-			kwargs = {}
-			func = self.render_filter
-			ident = f"timedfilter_{command['source']}_{command['filter']}"
-			if action == 'hidetimedfilter':
-				render_order = (False, True)
+			key = ('filter', command['source'], command['filter'])
+			render = partial(self.render_filter, command['source'], command['filter'])
 		elif action in ('timedsource', 'hidetimedsource'):
-			args = (command['scene'], command['source'])
-			kwargs = {}
-			func = self.render_source
-			ident = f"timedsource_{command['scene']}_{command['source']}"
-			if action == 'hidetimedsource':
-				render_order = (False, True)
-
-		if func is None:
+			key = ('source', command['scene'], command['source'])
+			render = partial(self.render_source, command['scene'], command['source'])
+		else:
 			return
 
-		render_time = 0
-		end_time = self._render_end_times.get(ident, 0)
-		if end_time > time.time():
-			render_time = (end_time - time.time()) + 0.5
-
-		for render in render_order:
-			kwargs_copy = kwargs.copy()
-			kwargs_copy['render'] = render
-			t = threading.Thread(
-				target=self._delayed_func_call,
-				args=(
-					render_time,
-					func,
-					args,
-					kwargs_copy
-				)
-			)
-			t.start()
-			render_time += int(command['time'])
+		state = action in ('timedsource', 'timedfilter')
+		seconds = int(command['time'])
 
-		self._render_end_times[ident] = time.time() + render_time - int(command['time'])
+		target = self._render_targets.get(key)
+		if target is None:
+			target = self._render_targets[key] = _RenderTarget(render)
 
-	def _delayed_func_call(self, delay, func, args, kwargs):
-		time.sleep(delay)
-		func(*args, **kwargs)
+		if target.state is None:
+			self._start_window(key, target, state, time.monotonic() + seconds)
+		elif target.windows:
+			## Queued behind the current window. Windows with the same state
+			## are merged so nothing is toggled between them
+			if target.windows[-1][0] == state:
+				target.windows[-1][1] += seconds
+			else:
+				target.windows.append([state, seconds])
+		elif target.state == state:
+			## Same as what's showing now so just make it last longer
+			target.deadline += seconds
+			heapq.heappush(self._deadlines, (target.deadline, next(self._deadline_seq), key))
+		else:
+			target.windows.append([state, seconds])
+
+	def _start_window(self, key, target, state, deadline):
+		target.state = state
+		target.deadline = deadline
+		heapq.heappush(self._deadlines, (deadline, next(self._deadline_seq), key))
+		target.apply(state)
+
+	def _render_due(self):
+		"""
+		End every window whose deadline has passed, starting the next
+		queued window or putting the target back to its resting state
+		"""
+		now = time.monotonic()
+		while self._deadlines and self._deadlines[0][0] <= now:
+			deadline, seq, key = heapq.heappop(self._deadlines)
+			target = self._render_targets.get(key)
+			## Windows that were extended leave stale entries behind
+			if target is None or target.deadline != deadline:
+				continue
+
+			if target.windows:
+				state, seconds = target.windows.popleft()
+				self._start_window(key, target, state, deadline + seconds)
+			else:
+				target.apply(not target.state)
+				del self._render_targets[key]
+
+	def _reset_renders(self):
+		"""
+		Put everything with an active window back to its resting state
+		"""
+		for target in self._render_targets.values():
+			if target.windows:
+				target.apply(not target.windows[-1][0])
+			else:
+				target.apply(not target.state)
+		self._render_targets = {}
+		self._deadlines = []
 
 	def render_filter(self, source, filter, render=True):
-		req = {
-			'message-id': self.call_id,
-			'request-type': 'SetSourceFilterVisibility',
+		self.send_obs_command('SetSourceFilterVisibility', {
 			'filterName': filter,
 			'sourceName': source,
 			'filterEnabled': render
-		}
-		self.send_obs_command(req)
+		})
 
 	def render_source(self, scene, source, render=True):
-		req = {
-			'message-id': self.call_id,
-			'request-type': 'SetSceneItemRender',
+		self.send_obs_command('SetSceneItemRender', {
 			'scene-name': scene,
 			'source': source,
 			'render': render
-		}
-		self.send_obs_command(req)
-
-	def send_obs_command(self, req):
+		})
+
+	def send_obs_command(self, request_type, fields=None):
+		"""
+		Send a request to OBS without waiting for it. Errors are reported
+		when the response comes in
+		"""
+		future = self.obs_client.request(request_type, fields)
+		future.add_done_callback(partial(self._check_response, request_type))
+		return future
+
+	def _check_response(self, request_type, future):
 		try:
-			self.obs_ws.send(json.dumps(req))
-			return True
-		except:
-			self.errors = True
-			self.buffer_queue.put(('ERR', 'Error connecting to OBS.'))
-			self.buffer_queue.put(('ERR', 'Check your settings and make sure OBS is running'))
-			return False
-
-	def shutdown(self):
-		self._keep_running = False
+			res = future.result()
+		except (ConnectionError, TimeoutError) as e:
+			self.buffer_queue.put(('ERR', f'OBS {request_type} failed: {e}'))
+			return None
 
-	def _ws_connect(self):
-		if self._ws:
-			self._ws.close()
+		if res.get('status') != 'ok':
+			self.buffer_queue.put(('ERR', f"OBS {request_type} failed: {res.get('error')}"))
+			return None
 
-		ws = obs_ws_connect(self.buffer_queue, self.host, self.port, self.password)
-		if ws is not None:
-			self._ws = ws
+		return res
 
-	@property
-	def obs_ws(self):
-		if not self._ws or self.errors:
-			self.errors = False
-			self._ws_connect()
-		return self._ws
-
-	@property
-	def call_id(self):
-		self._call_id += 1
-		return str(self._call_id)
+	def shutdown(self):
+		## Sent through the queue so it's handled after anything already
+		## queued and never left behind for the next thread
+		self.obs_queue.put('shutdown')
 
 class OBS(ModuleBase):
 	module_name = 'obs'
@@ -216,14 +244,11 @@ class OBS(ModuleBase):
 		self._obs_data = self.get_module_data()
 		self.obs_queue = Queue()
 		self.obs_thread = None
+		self.obs_client = None
 
 		if not 'commands' in self._obs_data:
 			self._obs_data['commands'] = {}
 
-		self._call_id = 0
-
-		self._ws = None
-
 		self.register_admin_command(ModuleAdminCommand(
 			'host',
 			self._set_host,
@@ -301,9 +326,12 @@ class OBS(ModuleBase):
 			description = 'Delete <!command>',
 		))
 
-		self.event_listen(EVT_CHATCOMMAND, self.command)
+		self.event_listen(EVT_CHATCOMMAND, self.command, {'commands': set(self._obs_data['commands'])})
 		self.restart_obs_thread()
 
+	def _commands_changed(self):
+		self.update_command_filter(self.command, set(self._obs_data['commands']))
+
 	def command(self, event):
 		if not event.command in self._obs_data['commands']:
 			return False
@@ -357,6 +385,7 @@ class OBS(ModuleBase):
 					}
 
 					self.save_module_data(self._obs_data)
+					self._commands_changed()
 					self.print(f'Command !{new_command} successfully added')
 					self.update_status_text()
 					return True
@@ -406,6 +435,7 @@ class OBS(ModuleBase):
 				}
 
 				self.save_module_data(self._obs_data)
+				self._commands_changed()
 				self.update_status_text()
 				self.print(f'Command !{new_command} successfully added')
 				return True
@@ -446,6 +476,7 @@ class OBS(ModuleBase):
 					self._obs_data['commands'][new_command]['source_scenes'] = source_scenes
 
 				self.save_module_data(self._obs_data)
+				self._commands_changed()
 
 				self.print(f'Command !{new_command} added')
 				self.print(f'  Target Scene: {scene_name}')
@@ -486,6 +517,7 @@ class OBS(ModuleBase):
 			self._obs_data['commands'][command]['source_scenes'] = from_scene
 
 		self.save_module_data(self._obs_data)
+		self._commands_changed()
 		self.print(f'Command !{command} successfully added')
 
 	def _delete_command(self, input, command):
@@ -501,6 +533,7 @@ class OBS(ModuleBase):
 
 		del self._obs_data['commands'][command]
 		self.save_module_data(self._obs_data)
+		self._commands_changed()
 		self.print(f'Command !{command} successfully deleted')
 
 	def _set_host(self, input, command):
@@ -575,28 +608,19 @@ class OBS(ModuleBase):
 			self.print(f"  {key}: {self._obs_data['commands'][command][key]}")
 
 	def select_source_filter(self, callback, source):
-		obs_ws = obs_ws_connect(self.voltron.buffer_queue, self.host, self.port, self.password)
-		req = {
-			'message-id': "15",
-			'request-type': 'GetSourceFilters',
-			'sourceName': source
-		}
-		filters = []
-		if self.send_obs_command(obs_ws, req):
-			res = json.loads(obs_ws.recv())
-			if res['status'] == 'error':
-				self.print(res['error'])
-				return None
-			if not res['filters']:
-				self.print(f'No filters exist for source "{source}"')
-				return None
-			self.print(f"Filters for {source}:")
-			for key in res['filters']:
-				filters.append(key['name'])
-				self.print(f"  {len(filters)}. {key['name']}")
-		else:
+		res = self.obs_call('GetSourceFilters', {'sourceName': source})
+		if res is None:
+			return None
+		if not res['filters']:
+			self.print(f'No filters exist for source "{source}"')
 			return None
 
+		filters = []
+		self.print(f"Filters for {source}:")
+		for key in res['filters']:
+			filters.append(key['name'])
+			self.print(f"  {len(filters)}. {key['name']}")
+
 		def filter_selected(filter):
 			if filter.lower() == 'c':
 				self.update_status_text()
@@ -616,24 +640,18 @@ class OBS(ModuleBase):
 		self.prompt_ident = self.get_prompt('Filter # > ', filter_selected)
 
 	def select_source(self, callback, scene=None):
-		obs_ws = obs_ws_connect(self.voltron.buffer_queue, self.host, self.port, self.password)
-		req = {
-			'message-id': "10",
-			'request-type': 'GetSceneItemList',
-			'sceneName': scene
-		}
+		res = self.obs_call('GetSceneItemList', {'sceneName': scene})
+		if res is None:
+			return None
+
 		count = 0
 		sources = []
-		if self.send_obs_command(obs_ws, req):
-			res = json.loads(obs_ws.recv())
-			scene_name = scene if scene is not None else 'current'
-			self.print(f'Sources for scene "{scene_name}"')
-			for key in res['sceneItems']:
-				sources.append(key['sourceName'])
-				count += 1
-				self.print(f"  {count}. {key['sourceName']}")
-		else:
-			return None
+		scene_name = scene if scene is not None else 'current'
+		self.print(f'Sources for scene "{scene_name}"')
+		for key in res['sceneItems']:
+			sources.append(key['sourceName'])
+			count += 1
+			self.print(f"  {count}. {key['sourceName']}")
 
 		def scene_selected(source):
 			if source.lower() == 'c':
@@ -656,24 +674,19 @@ class OBS(ModuleBase):
 		self.prompt_ident = self.get_prompt('Source # > ', scene_selected)
 
 	def select_scene(self, callback, multiple=False):
-		obs_ws = obs_ws_connect(self.voltron.buffer_queue, self.host, self.port, self.password)
-		req = {
-			'message-id': "10",
-			'request-type': 'GetSceneList'
-		}
+		res = self.obs_call('GetSceneList')
+		if res is None:
+			return None
+
 		count = 1
 		scenes = []
-		if self.send_obs_command(obs_ws, req):
-			res = json.loads(obs_ws.recv())
-			self.print('Scenes:')
-			for key in res['scenes']:
-				scenes.append(key['name'])
-				self.print(f"  {count}. {key['name']}")
-				count += 1
-			scenes.append(None)
-			self.print(f"  {count}. None")
-		else:
-			return None
+		self.print('Scenes:')
+		for key in res['scenes']:
+			scenes.append(key['name'])
+			self.print(f"  {count}. {key['name']}")
+			count += 1
+		scenes.append(None)
+		self.print(f"  {count}. None")
 
 		def scene_selected(scene):
 			if scene.lower() == 'c':
@@ -710,34 +723,51 @@ class OBS(ModuleBase):
 			self.update_status_text('Select a scene. c to cancel')
 		self.prompt_ident = self.get_prompt('Scene # > ', scene_selected)
 
-	def send_obs_command(self, ws, req):
+	def obs_call(self, request_type, fields=None):
+		"""
+		Make a request on the OBS connection and wait for the response.
+		Errors are printed and None is returned
+		"""
 		try:
-			ws.send(json.dumps(req))
-			return True
-		except:
+			res = self.obs_client.call(request_type, fields)
+		except (ConnectionError, TimeoutError):
 			self.buffer_print('ERR', 'Error connecting to OBS.')
 			self.buffer_print('ERR', 'Check your settings and make sure OBS is running')
-			return False
+			return None
+
+		if res.get('status') == 'error':
+			self.print(res['error'])
+			return None
+
+		return res
 
 	def restart_obs_thread(self):
-		if self.obs_thread:
-			self.obs_queue.put('shutdown')
-			self.obs_thread.shutdown()
-			self.obs_thread.join()
+		self._stop_obs_thread()
 
-		self.obs_thread = OBSThread(
-			self.obs_queue,
+		self.obs_client = OBSClient(
 			self.voltron.buffer_queue,
 			self.host,
 			self.port,
 			self.password
 		)
+		self.obs_client.start()
+
+		self.obs_thread = OBSThread(
+			self.obs_queue,
+			self.voltron.buffer_queue,
+			self.obs_client
+		)
 		self.obs_thread.start()
 
+	def _stop_obs_thread(self):
+		if self.obs_thread:
+			self.obs_thread.shutdown()
+			self.obs_thread.join()
+		if self.obs_client:
+			self.obs_client.shutdown()
+
 	def shutdown(self):
-		self.obs_queue.put('shutdown')
-		self.obs_thread.shutdown()
-		self.obs_thread.join()
+		self._stop_obs_thread()
 		self.save_module_data(self._obs_data)
 
 	@property
@@ -749,8 +779,3 @@ class OBS(ModuleBase):
 	@property
 	def password(self):
 		return self._obs_data.get('password', None)
-
-	@property
-	def call_id(self):
-		self._call_id += 1
-		return self._call_id
@@ -1,5 +1,5 @@
 from base.module import ModuleBase, ModuleAdminCommand
-from base.events import EVT_CHATCOMMAND, EVT_TIMER
+from base.events import EVT_CHATCOMMAND
 
 import re
 import time
@@ -26,6 +26,10 @@ class RaffleModule(ModuleBase):
 		if len(self._module_data.get('active_raffles', [])) > 0:
 			self._raffles_active = True
 
+		## Job for the next raffle alert or end, whichever comes first
+		self._timer_job = None
+		self._schedule_timer()
+
 		self.register_admin_command(ModuleAdminCommand(
 			'new',
 			self._new_raffle,
@@ -89,8 +93,17 @@ class RaffleModule(ModuleBase):
 			description = 'Turn confirmation messsage on or off when joining a raffle.'
 		))
 
-		self.event_listen(EVT_CHATCOMMAND, self.command)
-		self.event_listen(EVT_TIMER, self.timer)
+		self.event_listen(EVT_CHATCOMMAND, self.command, {'commands': self._command_names()})
+
+	def _command_names(self):
+		## !raffle and !redraw plus the join command of every running raffle
+		commands = {'raffle', 'redraw'}
+		for active in self._module_data.get('active_raffles', []):
+			commands.add(active['raffle'].get('command', self.DEFAULT_RAFFLE_COMMAND))
+		return commands
+
+	def _commands_changed(self):
+		self.update_command_filter(self.command, self._command_names())
 
 	def command(self, event):
 		if event.command == 'raffle':
@@ -116,7 +129,21 @@ class RaffleModule(ModuleBase):
 					self.send_chat_message(f'You have already joined, @{event.display_name}')
 
 
-	def timer(self, event):
+	def _schedule_timer(self):
+		self.cancel_scheduled(self._timer_job)
+		self._timer_job = None
+
+		next_due = None
+		for raffle in self._module_data.get('active_raffles', []):
+			due = min(raffle['end_time'], raffle['next_notif'])
+			if next_due is None or due < next_due:
+				next_due = due
+
+		if next_due is not None:
+			self._timer_job = self.schedule_at(next_due, self.timer)
+
+	def timer(self):
+		self._timer_job = None
 		if not self._raffles_active:
 			return
 
@@ -154,7 +181,11 @@ class RaffleModule(ModuleBase):
 		if not self._module_data.get('active_raffles', []):
 			self._raffles_active = False
 
+		if to_remove:
+			self._commands_changed()
+
 		self.save_module_data(self._module_data)
+		self._schedule_timer()
 
 	def redraw_raffle(self, event):
 		if len(event.args) < 1:
@@ -208,6 +239,8 @@ class RaffleModule(ModuleBase):
 		self._module_data['active_raffles'].append(active_raffle)
 		self.save_module_data(self._module_data)
 		self._raffles_active = True
+		self._commands_changed()
+		self._schedule_timer()
 		prize = raffle.get('prize')
 		enter_command = raffle.get('command', self.DEFAULT_RAFFLE_COMMAND)
 
@@ -267,6 +300,8 @@ class RaffleModule(ModuleBase):
 
 		self._module_data['active_raffles'].remove(active_raffle)
 		self.save_module_data(self._module_data)
+		self._commands_changed()
+		self._schedule_timer()
 		self.print(f'Raffle {raffle_name} has been stopped')
 
 
@@ -32,7 +32,7 @@ class RandomModule(ModuleBase):
 			description = 'List all random commands'
 		))
 
-		self.event_listen(EVT_CHATCOMMAND, self.command)
+		self.event_listen(EVT_CHATCOMMAND, self.command, {'commands': set(self._module_data['commands'])})
 
 	def command(self, event):
 		if event.command not in self._module_data['commands']:
@@ -70,6 +70,7 @@ class RandomModule(ModuleBase):
 
 		self._module_data['commands'][new_command] = command_list
 		self.save_module_data(self._module_data)
+		self.update_command_filter(self.command, set(self._module_data['commands']))
 		self.print(f'Command !{new_command} added!')
 
 	def _delete_random_command(self, input, command):
@@ -85,6 +86,7 @@ class RandomModule(ModuleBase):
 
 		del self._module_data['commands'][del_command]
 		self.save_module_data(self._module_data)
+		self.update_command_filter(self.command, set(self._module_data['commands']))
 		self.print(f'Command !{del_command} deleted')
 
 	def _list_commands(self, input, command):
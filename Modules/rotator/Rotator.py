@@ -1,5 +1,6 @@
 from base.module import ModuleBase, ModuleAdminCommand
-from base.events import EVT_TIMER, EVT_CHATMESSAGE
+from base.events import EVT_CHATMESSAGE
+from lib.TwitchIRC import PRIORITY_LOW
 import time
 
 class Rotator(ModuleBase):
@@ -12,6 +13,7 @@ class Rotator(ModuleBase):
 		self._message_count = 0
 		self._message_index = 0
 		self.prompt_ident = None
+		self._rotate_job = None
 
 		self.register_admin_command(ModuleAdminCommand(
 			'add',
@@ -62,29 +64,42 @@ class Rotator(ModuleBase):
 			description = 'If enabled will use /announce for rotator messages.',
 		))
 
-		self.event_listen(EVT_TIMER, self.timer)
 		self.event_listen(EVT_CHATMESSAGE, self.chat_message)
-
-	def timer(self, event):
+		self._schedule_rotate()
+
+	def _schedule_rotate(self, delay=None):
+		## Wake up once the time threshold passes, or after delay seconds.
+		## If the message threshold hasn't been met by then, chat_message()
+		## picks it up
+		self.cancel_scheduled(self._rotate_job)
+		if delay is None:
+			run_at = self._last_time + self.time_threshold
+		else:
+			run_at = time.time() + delay
+		self._rotate_job = self.schedule_at(run_at, self.rotate)
+
+	def rotate(self):
 		messages = self._rotator_data.get('messages', [])
-		if not messages:
-			return
-
-		paused = self._rotator_data.get('paused', [])
 
 		elapsed = time.time() - self._last_time
 
-		if elapsed >= self.time_threshold and self._message_count >= self.message_threshold:
+		if messages and elapsed >= self.time_threshold and self._message_count >= self.message_threshold:
 			message_index = self._next_index()
-			if message_index is None:
-				return
-
-			message = messages[message_index]
-			if self._rotator_data.get('announce', False):
-				message = f'/announce {message}'
-			self.send_chat_message(message)
-			self._message_count = 0
-			self._last_time = time.time()
+			if message_index is not None:
+				message = messages[message_index]
+				if self._rotator_data.get('announce', False):
+					message = f'/announce {message}'
+				## Replies to chat go out first
+				self.send_chat_message(message, priority=PRIORITY_LOW)
+				self._message_count = 0
+				self._last_time = time.time()
+
+		if time.time() - self._last_time >= self.time_threshold:
+			## Due but nothing could be sent. Check again after another
+			## interval. Adding or resuming a message reschedules sooner
+			self._schedule_rotate(self.time_threshold)
+		else:
+			self._schedule_rotate()
 
 	def _are_all_paused(self):
 		messages = self._rotator_data.get('messages', [])
@@ -126,6 +141,8 @@ class Rotator(ModuleBase):
 
 	def chat_message(self, event):
 		self._message_count += 1
+		if self._message_count >= self.message_threshold:
+			self.rotate()
 
 	def add_message(self, input, command):
 		if not input:
@@ -137,6 +154,7 @@ class Rotator(ModuleBase):
 
 		self._rotator_data['messages'].append(input)
 		self.save_module_data(self._rotator_data)
+		self._schedule_rotate()
 
 		self.print(f"Rotator message added: {input}")
 
@@ -170,6 +188,7 @@ class Rotator(ModuleBase):
 
 			self._rotator_data['paused'] = paused
 			self.save_module_data(self._rotator_data)
+			self._schedule_rotate()
 			self.update_status_text()
 			return True
 
@@ -248,6 +267,7 @@ class Rotator(ModuleBase):
 
 		self._rotator_data['time_threshold'] = new_time * 60
 		self.save_module_data(self._rotator_data)
+		self._schedule_rotate()
 		self.print(f'Time interval set to {new_time} minutes')
 
 	def set_message_threshold(self, input, command):
@@ -32,7 +32,7 @@ class ShoutOut(ModuleBase):
 			description = 'Set the account to use for shoutouts',
 		))
 
-		self.event_listen(EVT_CHATCOMMAND, self.command)
+		self.event_listen(EVT_CHATCOMMAND, self.command, {'commands': {self.so_command}})
 
 	def command(self, event):
 		if event.command == self.so_command:
@@ -65,6 +65,7 @@ class ShoutOut(ModuleBase):
 			command = match.group(1)
 			self._shoutout_data['command'] = command
 			self.save_module_data(self._shoutout_data)
+			self.update_command_filter(self.command, {self.so_command})
 
 			self.print(f"Shoutout command changed to !{command}")
 
@@ -40,7 +40,7 @@ class Trigger(ModuleBase):
 			description = 'Response account for triggers',
 		))
 
-		self.event_listen(EVT_CHATCOMMAND, self.command)
+		self.event_listen(EVT_CHATCOMMAND, self.command, {'commands': set(self._static_commands)})
 		self.event_listen(EVT_CHATMESSAGE, self.chat_message)
 
 	def chat_message(self, event):
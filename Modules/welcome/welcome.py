@@ -101,9 +101,17 @@ class Welcome(ModuleBase):
 		))
 
 		self.event_listen(EVT_FIRST_MESSAGE, self.send_first_message_command)
-		self.event_listen(EVT_CHATCOMMAND, self.command)
+		self.event_listen(EVT_CHATCOMMAND, self.command, {'commands': {self._sound_command}})
 		self.event_listen(EVT_STREAM_STATUS, self.status_change)
 
+		for data in self._sound_data['user_sounds'].values():
+			if data.get('sound_file', None):
+				sound_path = f"{self.media_directory}\\{data['sound_file']}"
+				if os.path.isfile(sound_path):
+					self.prewarm_audio(sound_path, device=self.entrance_sound_device)
+		if self.alert_sound and os.path.isfile(f"{self.media_directory}\\{self.alert_sound}"):
+			self.prewarm_audio(f"{self.media_directory}\\{self.alert_sound}", device=self.alert_sound_device)
+
 	def first_message(self, event, run_by_command=False, testing=False):
 		handled = False
 		if not self._stream_online and not testing:
@@ -143,18 +151,29 @@ class Welcome(ModuleBase):
 
 		if not run_by_command:
 			broadcaster = get_broadcaster()
-			follow_str = "Not Following"
-			try:
-				follow_time = broadcaster.twitch_api.get_follow_time(broadcaster.twitch_user_id, event.user_id)
-			except:
-				follow_time = None
-				follow_str = "Error retrieving follow time"
-			if follow_time is not None:
-				follow_str = f"Followed {humanize.naturaltime(follow_time)}"
-			self.print(f'First message: {event.display_name} ({follow_str})')
+			## Look up the follow time off the event loop so a rush of first
+			## chatters doesn't queue up behind sequential API calls
+			future = broadcaster.twitch_api.get_follow_time_async(broadcaster.twitch_user_id, event.user_id)
+			future.add_done_callback(
+				lambda f: self._print_follow_time(event.display_name, f)
+			)
 
 		return handled
 
+	def _print_follow_time(self, display_name, future):
+		follow_str = "Not Following"
+		try:
+			follow_time = future.result()
+		except:
+			follow_time = None
+			follow_str = "Error retrieving follow time"
+		if follow_time is False:
+			follow_time = None
+			follow_str = "Error retrieving follow time"
+		if follow_time is not None:
+			follow_str = f"Followed {humanize.naturaltime(follow_time)}"
+		self.print(f'First message: {display_name} ({follow_str})')
+
 	def status_change(self, event):
 		if event.is_live:
 			self._stream_online = True
@@ -198,6 +217,7 @@ class Welcome(ModuleBase):
 		self._sound_data['sound_command'] = match.group(1)
 		self.save_module_data(self._sound_data)
 		self._sound_command = self._sound_data['sound_command']
+		self.update_command_filter(self.command, {self._sound_command})
 		self.print(f'Entrance sound command set to !{self._sound_command}')
 
 	def _add_entrance_sound(self, input, command):
@@ -16,12 +16,15 @@ import re
 import requests
 import json
 
-from lib.TwitchIRC import BroadcasterIRC, BotIRC
+from lib.TwitchIRC import BroadcasterIRC, BotIRC, AsyncBroadcasterIRC, AsyncBotIRC, PRIORITY_NORMAL
 from VoltronUI import VoltronUI
 from CoreModules.account import VoltronModule as Account
 from lib.common import get_broadcaster, get_all_acccounts, get_db
 from lib.eventloop import EventLoop
 from lib.PubSub import PubSubThread
+from lib.datastore import ModuleDataStore
+from lib.chatsender import ChatSendQueue
+from lib.counters import get_counter_store
 from Version import VERSION
 
 THREADS = []
@@ -113,6 +116,13 @@ class VoltronBot:
 		self.pubsub_thread = None
 		self.default_account = None
 
+		## Module data is written to the DB in the background
+		self.module_data_store = ModuleDataStore(self.buffer_queue)
+		self.module_data_store.start()
+
+		## Templated chat messages are rendered and sent in the background
+		self.chat_sender = ChatSendQueue(self, self.buffer_queue)
+
 		if config.PRODUCTION:
 			version_check = VersionCheckThread(self.buffer_queue)
 			version_check.start()
@@ -145,14 +155,23 @@ class VoltronBot:
 			self.buffer_queue.put(('VOLTRON', "Or select an existing account using 'account broadcaster'"))
 			return
 		self.pubsub_thread = PubSubThread(self.buffer_queue, self.event_queue, broadcaster)
+
+		## Optionally run every IRC connection on the PubSub event loop
+		## instead of one thread per account
+		use_async = hasattr(config, 'ASYNC_IRC_TRANSPORT') and config.ASYNC_IRC_TRANSPORT
+		loop = self.pubsub_thread.bgloop
 		for user in users:
 			if user.is_default:
 				self.default_account = user
 
 			## Create a BroadcasterIRC instance for the broadcaster account
 			## This instance is responsible for events being added to event_queue
-			if user.id == broadcaster.id:
+			if user.id == broadcaster.id and use_async:
+				irc = AsyncBroadcasterIRC(self.event_queue, self.buffer_queue, user, broadcaster, loop)
+			elif user.id == broadcaster.id:
 				irc = BroadcasterIRC(self.event_queue, self.buffer_queue, user, broadcaster)
+			elif use_async:
+				irc = AsyncBotIRC(self.buffer_queue, user, broadcaster, loop)
 			else:
 				irc = BotIRC(self.buffer_queue, user, broadcaster)
 			self.irc_map[user.twitch_user_id] = irc
@@ -180,89 +199,51 @@ class VoltronBot:
 		Args:
 			module (instance): The instance of the module object
 		"""
-		con, cur = get_db()
-
-		sql = "SELECT data FROM module_data WHERE module_name = ?"
-		cur.execute(sql, (module.module_name, ))
-		res = cur.fetchone()
-
-		con.commit()
-		con.close()
-
-		if res:
-			return json.loads(res['data'])
-		else:
-			return {}
+		return self.module_data_store.load(module.module_name)
 
 	def get_counter(self, counter_name):
-		con, cur = get_db()
-
-		sql = "SELECT id, value FROM counters WHERE counter_name = ?"
-		cur.execute(sql, (counter_name, ))
-		res = cur.fetchone()
-
-		con.commit()
-		con.close()
-
-		if not res:
-			return None
-		else:
-			return res['value']
+		return get_counter_store().get(counter_name)
 
 	def get_all_counters(self):
-		con, cur = get_db()
-
-		sql = 'SELECT * FROM counters'
-		cur.execute(sql)
-		res = cur.fetchall()
-
-		con.commit()
-		con.close()
-
-		return res
+		return get_counter_store().get_all()
 
 	def set_counter(self, counter_name, value):
-		con, cur = get_db()
-
-		sql = "UPDATE counters SET value = ? WHERE counter_name = ?"
-		cur.execute(sql, (value, counter_name))
-
-		con.commit()
-		con.close()
+		get_counter_store().set(counter_name, value)
 
 	def save_module_data(self, module, data):
 		"""
 		Save data to the DB for the specified module.
+		The write happens in the background. Use flush_module_data()
+		if it must be on disk immediately.
 
 		Args:
 			module (instance): The instance of the module object
 			data (dict): Module data to be saved
 		"""
-		con, cur = get_db()
+		self.module_data_store.save(module.module_name, data)
 
-		data_str = json.dumps(data)
-
-		sql = "REPLACE INTO module_data (module_name, data) VALUES (?, ?)"
-		cur.execute(sql, (module.module_name, data_str))
-
-		con.commit()
-		con.close()
+	def flush_module_data(self):
+		"""
+		Write all pending module data to the DB now
+		"""
+		self.module_data_store.flush()
 
-	def send_chat_message(self, message, twitch_id=None):
+	def send_chat_message(self, message, twitch_id=None, priority=PRIORITY_NORMAL):
 		"""
 		Send a message to IRC using the default account
 		Args:
 			message (string): Message to be sent
+			priority (int): Priority on the IRC send queue. Lower values are sent first
 		"""
 		if twitch_id and twitch_id in self.irc_map:
-			self.irc_map[twitch_id].send_message(message)
+			self.irc_map[twitch_id].send_message(message, priority=priority)
 		else:
 			if not self.default_account:
 				self.buffer_queue.put(("ERR", "No default account set."))
 				self.buffer_queue.put(("ERR", "Set one using 'account default'"))
-				self.irc_map[get_broadcaster().twitch_user_id].send_message(message)
+				self.irc_map[get_broadcaster().twitch_user_id].send_message(message, priority=priority)
 			else:
-				self.irc_map[self.default_account.twitch_user_id].send_message(message)
+				self.irc_map[self.default_account.twitch_user_id].send_message(message, priority=priority)
 
 	def send_private_message(self, user_name, message, twitch_id=None):
 		## Make this work when we have a pubsub thread
@@ -282,6 +263,20 @@ class VoltronBot:
 			self.irc_map[twitch_id].join()
 		self.irc_map = {}
 
+		## Modules save their data on shutdown. Make sure it hits the disk
+		self.flush_module_data()
+		get_counter_store().flush()
+
+	def shutdown(self):
+		"""
+		Stop the bot along with everything that lives as long as the
+		process. Only called on exit since reset() uses stop()
+		"""
+		self.stop()
+		self.chat_sender.shutdown()
+		self.module_data_store.stop()
+		get_counter_store().stop()
+
 if __name__ == "__main__":
 	if not os.path.isdir(config.APP_DIRECTORY):
 		os.makedirs(config.APP_DIRECTORY)
@@ -292,7 +287,7 @@ if __name__ == "__main__":
 	vb.start()
 
 	def Exit(signal, frame):
-		vb.stop()
+		vb.shutdown()
 		sys.exit()
 
 	signal.signal(signal.SIGINT, Exit)
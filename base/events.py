@@ -12,6 +12,7 @@ EVT_BITS = 'BITS'
 EVT_POINT_REDEMPTION = 'POINT_REDEMPTION'
 EVT_HOST = 'HOST'
 EVT_RAID = 'RAID'
+EVT_SCHEDULED = 'SCHEDULED'
 
 class Event:
 	"""
@@ -86,6 +87,21 @@ class TimerEvent(Event):
 	def __init__(self):
 		pass
 
+class ScheduledEvent(Event):
+	"""
+	Posted by the scheduler when a scheduled job is due. The event loop
+	runs the job's callback instead of dispatching to listeners
+	"""
+	type = EVT_SCHEDULED
+
+	def __init__(self, job):
+		self.job = job
+
+	def run(self):
+		if self.job.cancelled:
+			return
+		self.job.callback(*self.job.args)
+
 class StreamStatusEvent(Event):
 	type = EVT_STREAM_STATUS
 	def __init__(self, stream_id=None, title=None, started_at=None, viewer_count=None):
@@ -1,10 +1,8 @@
 from lib.common import get_all_acccounts
-from lib.twitch_oauth import User
 from lib.TwitchAPIHelper import TwitchAPIHelper
-from lib.common import get_broadcaster, get_module_data_directory
-from lib.ChatMessageParser import ChatMessageParser
+from lib.TwitchIRC import PRIORITY_NORMAL
+from lib.common import get_broadcaster, get_user, get_module_data_directory
 
-import threading
 
 class ModuleAdminCommand:
 	"""
@@ -66,22 +64,29 @@ class ModuleBase:
 	def get_module_data(self):
 		return self.voltron.get_module_data(self)
 
+	def flush_module_data(self):
+		self.voltron.flush_module_data()
+
 	def event_listen(self, event_type, callback, event_params=None):
 		self.event_loop.register_event(event_type, callback, event_params)
 
-	def send_chat_message(self, message, twitch_id=None, event=None):
-		parser = ChatMessageParser(message, event)
-		if parser.has_vars():
-			thread = threading.Thread(target=self._thread_send_chat_message, args=(parser, twitch_id))
-			thread.start()
-		else:
-			self.voltron.send_chat_message(message, twitch_id)
-		#parsed = parser.parse()
-		#self.voltron.send_chat_message(parsed, twitch_id)
+	def update_command_filter(self, callback, commands):
+		self.event_loop.update_command_filter(callback, commands)
+
+	def schedule_at(self, timestamp, callback, *args, interval=None):
+		return self.event_loop.schedule_at(timestamp, callback, *args, interval=interval)
+
+	def schedule_after(self, delay, callback, *args, interval=None):
+		return self.event_loop.schedule_after(delay, callback, *args, interval=interval)
+
+	def schedule_every(self, interval, callback, *args):
+		return self.event_loop.schedule_every(interval, callback, *args)
 
-	def _thread_send_chat_message(self, parser, twitch_id):
-		parsed = parser.parse()
-		self.voltron.send_chat_message(parsed, twitch_id)
+	def cancel_scheduled(self, job):
+		self.event_loop.cancel(job)
+
+	def send_chat_message(self, message, twitch_id=None, event=None, priority=PRIORITY_NORMAL):
+		self.voltron.chat_sender.send(message, twitch_id, event, priority)
 
 	def send_private_message(self, user_name, message, twitch_id=None, event=None):
 		self.voltron.send_private_message(user_name, message, twitch_id)
@@ -125,6 +130,13 @@ class ModuleBase:
 	def play_audio(self, path, **kwargs):
 		self.event_loop.media_queue.put(('audio', path, kwargs))
 
+	def prewarm_audio(self, path, device=None):
+		"""
+		Decode an audio file ahead of time so the first play_audio() call
+		for it doesn't wait on decoding
+		"""
+		self.event_loop.media_queue.put(('prewarm', path, {'device': device}))
+
 	def get_commands(self, twitch_id, is_mod=False, is_broadcaster=False):
 		return []
 
@@ -145,7 +157,7 @@ class ModuleBase:
 				self.print('Invalid selection')
 				return False
 
-			selected_user = User(account_list[selection-1])
+			selected_user = get_user(account_list[selection-1])
 			callback(selected_user)
 			self.update_status_text()
 			return True
@@ -0,0 +1,99 @@
+"""
+Compare rendering chat templates with compiled, cached templates against
+the old parser that rescanned the string with regexes on every message.
+
+Run from the repository root with config.py in place:
+
+	python bench/chat_templates.py
+	python bench/chat_templates.py --count 100000
+
+Only variables that don't touch the network or the DB are used, so the
+numbers are the cost of the template handling itself.
+"""
+import os
+import re
+import sys
+import time
+import types
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.ChatMessageParser import ChatMessageParser
+
+TEMPLATES = [
+	'Join the discord at https://example.com today!',
+	'{sender} is lurking',
+	'Welcome {@}! Thanks for stopping by {sender}',
+	'{sender} rolled a {random:1:6}',
+	'{sender} hugs {@:1} and {@:2}',
+	'Go check out {arg:1} at https://twitch.tv/{arg:1}',
+	'{sender} {sender} {sender} {unknown}',
+	'{random:{arg:1}:{arg:2}} is the magic number',
+]
+
+class FixedVariables:
+	## Deterministic stand-in for {random} so both parsers can be compared
+	def random(self, event, *args):
+		return '|'.join(args)
+
+class NewParser(FixedVariables, ChatMessageParser):
+	pass
+
+class OldParser(FixedVariables, ChatMessageParser):
+	"""
+	The template handling ChatMessageParser had before templates were
+	compiled. Variables resolve through the same methods
+	"""
+	def has_vars(self):
+		return bool(re.search(r'\{[^ ]+\}', self.chat_string))
+
+	def recursive_parse(self, chat_string):
+		all_vars = re.findall(r'\{([^ ]+)\}', chat_string)
+		vars = []
+		[vars.append(x) for x in all_vars if x not in vars]
+		parsed_str = chat_string
+
+		for v in vars:
+			v_parsed = self.recursive_parse(v)
+			res = self._resolve_now(v_parsed)
+			if res != None:
+				parsed_str = parsed_str.replace(f'{{{v_parsed}}}', res)
+
+		return parsed_str
+
+def run(cls, event, count):
+	start = time.perf_counter()
+	for i in range(count):
+		parser = cls(TEMPLATES[i % len(TEMPLATES)], event)
+		if parser.has_vars():
+			parser.parse()
+	return time.perf_counter() - start
+
+def main():
+	arg_parser = argparse.ArgumentParser(description='Benchmark chat template rendering')
+	arg_parser.add_argument('--count', type=int, default=50000, help='Messages to render')
+	args = arg_parser.parse_args()
+
+	event = types.SimpleNamespace(
+		display_name = 'SomeViewer',
+		message = '!hug @friend @other 3 9',
+		user = 'someviewer'
+	)
+
+	for template in TEMPLATES:
+		old = OldParser(template, event).parse()
+		new = NewParser(template, event).parse()
+		if old != new:
+			print(f'Warning: output differs for {template!r}: {old!r} != {new!r}')
+
+	old_time = run(OldParser, event, args.count)
+	new_time = run(NewParser, event, args.count)
+
+	print(f'{args.count} messages over {len(TEMPLATES)} templates')
+	print(f'  old: {old_time / args.count * 1e6:.2f} us/message')
+	print(f'  new: {new_time / args.count * 1e6:.2f} us/message')
+	print(f'  speedup: {old_time / new_time:.1f}x')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,103 @@
+"""
+Compare CHATCOMMAND dispatch through EventLoop's command table with the
+old linear scan that called every CHATCOMMAND listener for every command.
+
+Run from the repository root with config.py in place:
+
+	python bench/command_dispatch.py
+	python bench/command_dispatch.py --modules 50 --commands 20
+
+Each fake module registers one listener for its own commands, the way
+SoundCommand or the obs module do. Listeners still check the command
+themselves like real modules, so both sides do the same work per call.
+Without --modules a few sizes are compared.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from queue import Queue
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from base.events import ChatCommandEvent, EVT_CHATCOMMAND
+from lib.eventloop import EventLoop
+
+def make_listener(commands):
+	def command(event):
+		if not event.command in commands:
+			return False
+		return True
+	return command
+
+def build(modules, commands):
+	event_loop = EventLoop(None, Queue(), Queue())
+	names = []
+	for m in range(modules):
+		module_commands = {f'mod{m}cmd{c}' for c in range(commands)}
+		names.extend(module_commands)
+		event_loop.register_event(EVT_CHATCOMMAND, make_listener(module_commands), {'commands': module_commands})
+
+	## A few unknown commands too, like typos in chat
+	names.extend(f'unknown{i}' for i in range(max(1, len(names) // 10)))
+	return event_loop, names
+
+def dispatch_old(event_loop, event):
+	handled = False
+	for callback in event_loop.registered_listeners.get(event.type, []):
+		if callback(event):
+			handled = True
+	return handled
+
+def dispatch_new(event_loop, event):
+	handled = False
+	for callback in event_loop._get_listeners(event):
+		if callback(event):
+			handled = True
+	return handled
+
+def run(dispatch, event_loop, events):
+	start = time.perf_counter()
+	for event in events:
+		dispatch(event_loop, event)
+	return time.perf_counter() - start
+
+def bench(modules, commands, count):
+	event_loop, names = build(modules, commands)
+	rand = random.Random(0)
+	events = [
+		ChatCommandEvent(rand.choice(names), '', 'viewer', 1, False, False, False)
+		for _ in range(count)
+	]
+
+	for event in events[:1000]:
+		if dispatch_old(event_loop, event) != dispatch_new(event_loop, event):
+			print('Warning: old and new dispatch disagree')
+			break
+
+	old_time = run(dispatch_old, event_loop, events)
+	new_time = run(dispatch_new, event_loop, events)
+	print(
+		f'{modules:>4} modules x {commands:>3} commands: '
+		f'old {old_time / count * 1e6:7.2f} us  '
+		f'new {new_time / count * 1e6:7.2f} us  '
+		f'{old_time / new_time:5.1f}x'
+	)
+
+def main():
+	arg_parser = argparse.ArgumentParser(description='Benchmark chat command dispatch')
+	arg_parser.add_argument('--modules', type=int, help='Modules listening for commands')
+	arg_parser.add_argument('--commands', type=int, default=10, help='Commands per module')
+	arg_parser.add_argument('--events', type=int, default=100000, help='Commands to dispatch')
+	args = arg_parser.parse_args()
+
+	if args.modules:
+		bench(args.modules, args.commands, args.events)
+		return
+
+	for modules, commands in ((5, 5), (20, 10), (50, 20), (100, 50)):
+		bench(modules, commands, args.events)
+
+if __name__ == '__main__':
+	main()
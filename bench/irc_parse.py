@@ -0,0 +1,188 @@
+"""
+Compare the old regex based IRC line handling with the single pass parser
+and command dispatch in lib/TwitchIRC.py.
+
+Run from the repository root with config.py in place:
+
+	python bench/irc_parse.py
+	python bench/irc_parse.py --lines recorded.log --repeat 50
+
+--lines takes a file with one raw IRC line per line, e.g. captured with
+IRCBase._log(). A built-in sample of typical chat traffic is used otherwise.
+"""
+import os
+import re
+import sys
+import time
+import types
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.TwitchIRC import IRCBase
+
+## Typical traffic for a busy channel. Mostly chat with the odd ping,
+## USERSTATE and raid mixed in
+SAMPLE_LINES = [
+	'@badge-info=subscriber/14;badges=subscriber/12,premium/1;color=#1E90FF;display-name=SomeViewer;emotes=;first-msg=0;flags=;id=6b7e8c1a-3f1c-4b7a-9d0e-5c4c8a1f2e3d;mod=0;returning-chatter=0;room-id=12345678;subscriber=1;tmi-sent-ts=1650000000000;turbo=0;user-id=87654321;user-type= :someviewer!someviewer@someviewer.tmi.twitch.tv PRIVMSG #streamer :that was a great play',
+	'@badge-info=;badges=moderator/1;color=#00FF7F;display-name=ModPerson;emotes=;first-msg=0;flags=;id=0a1b2c3d-4e5f-6789-abcd-ef0123456789;mod=1;room-id=12345678;subscriber=0;tmi-sent-ts=1650000000100;turbo=0;user-id=11223344;user-type=mod :modperson!modperson@modperson.tmi.twitch.tv PRIVMSG #streamer :!uptime',
+	'@badge-info=;badges=vip/1;color=;display-name=VipFriend;emotes=25:0-4;first-msg=0;flags=;id=11111111-2222-3333-4444-555555555555;mod=0;room-id=12345678;subscriber=0;tmi-sent-ts=1650000000200;turbo=0;user-id=99887766;user-type= :vipfriend!vipfriend@vipfriend.tmi.twitch.tv PRIVMSG #streamer :Kappa nice one',
+	'@badge-info=subscriber/3;badges=subscriber/3;color=#FF4500;display-name=Lurker\\sName;emotes=;first-msg=1;flags=;id=aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee;mod=0;room-id=12345678;subscriber=1;tmi-sent-ts=1650000000300;turbo=0;user-id=55555555;user-type= :lurkername!lurkername@lurkername.tmi.twitch.tv PRIVMSG #streamer :hello chat, first time here!',
+	'@badge-info=;badges=broadcaster/1;color=#9ACD32;display-name=Streamer;emotes=;first-msg=0;flags=;id=bbbbbbbb-cccc-dddd-eeee-ffffffffffff;mod=0;room-id=12345678;subscriber=0;tmi-sent-ts=1650000000400;turbo=0;user-id=12345678;user-type= :streamer!streamer@streamer.tmi.twitch.tv PRIVMSG #streamer :!so vipfriend',
+	'PING :tmi.twitch.tv',
+	'@badge-info=;badges=moderator/1;color=#0000FF;display-name=VoltronBot;emote-sets=0;mod=1;subscriber=0;user-type=mod :tmi.twitch.tv USERSTATE #streamer',
+	'@badge-info=;badges=;color=#8A2BE2;display-name=Raider;emotes=;flags=;id=cccccccc-dddd-eeee-ffff-000000000000;login=raider;mod=0;msg-id=raid;msg-param-displayName=Raider;msg-param-login=raider;msg-param-viewerCount=42;room-id=12345678;subscriber=0;system-msg=42\\sraiders\\sfrom\\sRaider\\shave\\sjoined!;tmi-sent-ts=1650000000500;user-id=44444444;user-type= :tmi.twitch.tv USERNOTICE #streamer',
+	':someviewer!someviewer@someviewer.tmi.twitch.tv JOIN #streamer',
+	'@badge-info=;badges=;color=;display-name=Another;emotes=;first-msg=0;flags=;id=dddddddd-eeee-ffff-0000-111111111111;mod=0;room-id=12345678;subscriber=0;tmi-sent-ts=1650000000600;turbo=0;user-id=33333333;user-type= :another!another@another.tmi.twitch.tv PRIVMSG #streamer :lol',
+]
+
+CONTROL_CHARS = {chr(char): None for char in range(1, 32)}
+
+class OldParser:
+	"""
+	The regex chain _handle_response used before lines were tokenized once,
+	trimmed to its parsing work. Callbacks are recorded instead of acted on
+	"""
+	def __init__(self, channel_map):
+		self.channel_map = channel_map
+		self.calls = []
+
+	def handle_line(self, resp):
+		if re.search(r"^PING", resp):
+			self.calls.append(('ping',))
+			return True
+
+		if re.search(r"^(:tmi\.twitch\.tv )?PONG", resp):
+			self.calls.append(('pong',))
+			return True
+
+		privmsg_regex = (r'^@([^ ]+) :([^ ]+) PRIVMSG #([^ ]+) :([^\r\n]*)')
+		match = re.search(privmsg_regex, resp)
+		if match:
+			twitch_shit = match.group(1)
+			channel = match.group(3)
+			message = match.group(4)
+
+			broadcaster_id = self.channel_map[channel]
+
+			display_match = re.search(r'display-name=([^; ]*)', twitch_shit)
+			display_name = display_match.group(1) if display_match else "Unknown"
+
+			id_match = re.search(r'user-id=([0-9]+)', twitch_shit)
+			user_id = id_match.group(1) if id_match else False
+
+			is_mod = True if re.search(r'user-type=mod', twitch_shit) else False
+
+			is_vip = False
+			badge_match = re.search(r'badges=([^;]+)', twitch_shit)
+			if badge_match and re.search(r'vip/\d+', badge_match.group(1)):
+				is_vip = True
+
+			is_broadcaster = int(broadcaster_id) == int(user_id)
+			if is_broadcaster:
+				is_mod = True
+
+			re.search(r'^!ping', message)
+
+			table = {}
+			for char in range(1, 32):
+				table[chr(char)] = None
+			m = message.translate(table)
+
+			self.calls.append(('message', user_id, is_vip, is_mod, is_broadcaster, m))
+
+		host_regex = r'^:[^ ]+ PRIVMSG [^ ]+ :([^ ]+) is now hosting you'
+		match = re.search(host_regex, resp)
+		if match:
+			self.calls.append(('host', match.group(1)))
+			return True
+
+		usernotice_regex = (r'^@([^ ]+) :([^ ]+) USERNOTICE #([^ ]+)')
+		match = re.search(usernotice_regex, resp)
+		if match:
+			twitch_shit = match.group(1)
+			if re.search(r'msg-id=raid', twitch_shit):
+				id_match = re.search(r'user-id=(\d+)', twitch_shit)
+				user_id = int(id_match.group(1)) if id_match else False
+				viewer_count_match = re.search(r'msg-param-viewerCount=(\d+)', twitch_shit)
+				viewer_count = int(viewer_count_match.group(1)) if viewer_count_match else 0
+				self.calls.append(('raid', user_id, viewer_count))
+				return True
+
+class NewParser(IRCBase):
+	"""
+	IRCBase with everything that touches the network or other threads
+	replaced by recorders
+	"""
+	def __init__(self, channel_map):
+		account = types.SimpleNamespace(id=1, user_name='streamer', twitch_user_id=12345678)
+		IRCBase.__init__(self, None, account, account)
+		self.irc.close()
+		self.channel_map = channel_map
+		self.calls = []
+
+	def handle_line(self, resp):
+		return self._handle_response(resp)
+
+	def _pong(self):
+		self.calls.append(('ping',))
+
+	def _handle_pong(self, msg):
+		self.calls.append(('pong',))
+		return True
+
+	def _handle_userstate(self, msg):
+		## The old code ignored USERSTATE
+		return True
+
+	def message_received(self, display_name, user_id, is_vip, is_mod, is_broadcaster, message):
+		self.calls.append(('message', user_id, is_vip, is_mod, is_broadcaster, message))
+
+	def handle_host(self, display_name):
+		self.calls.append(('host', display_name))
+
+	def handle_raid(self, display_name, user_id, viewer_count):
+		self.calls.append(('raid', user_id, viewer_count))
+
+def run(parser, lines, repeat):
+	start = time.perf_counter()
+	for _ in range(repeat):
+		for line in lines:
+			parser.handle_line(line)
+	return time.perf_counter() - start
+
+def main():
+	arg_parser = argparse.ArgumentParser(description='Benchmark IRC line parsing')
+	arg_parser.add_argument('--lines', help='File of recorded IRC lines')
+	arg_parser.add_argument('--repeat', type=int, default=2000, help='Passes over the lines')
+	args = arg_parser.parse_args()
+
+	lines = SAMPLE_LINES
+	if args.lines:
+		with open(args.lines, encoding='utf-8', errors='replace') as f:
+			lines = [line.rstrip('\r\n') for line in f if line.strip()]
+
+	channel_map = {'streamer': 12345678}
+	old = OldParser(channel_map)
+	new = NewParser(channel_map)
+
+	## Both have to see the same thing or the timings mean nothing
+	for line in lines:
+		old.handle_line(line)
+		new.handle_line(line)
+	if old.calls != new.calls:
+		print('Warning: old and new parsers disagree on this sample')
+	old.calls = []
+	new.calls = []
+
+	old_time = run(old, lines, args.repeat)
+	new_time = run(new, lines, args.repeat)
+	count = len(lines) * args.repeat
+
+	print(f'{count} lines')
+	print(f'  old: {old_time / count * 1e6:.2f} us/line')
+	print(f'  new: {new_time / count * 1e6:.2f} us/line')
+	print(f'  speedup: {old_time / new_time:.1f}x')
+
+if __name__ == '__main__':
+	main()
@@ -19,6 +19,35 @@ IRC_LOG_FILE = "irc.log"
 LOG_IRC_DATA = True
 
 DEFAULT_SOCKET_TIMEOUT = 60
+## Run all IRC connections as coroutines on a single asyncio loop
+## instead of one polling thread per account
+ASYNC_IRC_TRANSPORT = False
+
+## Seconds between background writes of module data to the database
+MODULE_DATA_FLUSH_INTERVAL = 5
+## Seconds between background writes of chat counters to the database
+COUNTER_FLUSH_INTERVAL = 1
+
+## Memory in MB used to keep decoded sounds ready to play
+AUDIO_CACHE_SIZE_MB = 128
+## Frames per audio block. Smaller starts sounds sooner but costs more CPU
+AUDIO_BLOCK_SIZE = 512
+## Sounds that can play at once on each audio device
+AUDIO_MAX_VOICES = 8
+## When too many sounds are playing: 'drop_oldest' or 'drop_new'
+AUDIO_OVERFLOW = 'drop_oldest'
+## Sound files bigger than this many MB are decoded while they play (needs ffmpeg)
+AUDIO_STREAM_THRESHOLD_MB = 2
+## Even out the loudness of sounds when they're loaded so they don't need
+## individual volumes
+AUDIO_NORMALIZE_LOUDNESS = False
+
+## Threads used to fill in {variables} in chat messages
+CHAT_SEND_WORKERS = 4
+## Messages allowed to wait per account before some are dropped
+CHAT_SEND_QUEUE_LIMIT = 50
+## Which message to drop when the queue is full: 'drop_oldest' or 'drop_newest'
+CHAT_SEND_OVERLOAD_POLICY = 'drop_oldest'
 OAUTH_HTTPD_PORT = 80
 
 ## Client ID for the twitch app.
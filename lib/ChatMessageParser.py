@@ -1,56 +1,211 @@
 import re
 import random
-import requests
 import Version
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import lru_cache
 from datetime import datetime, timezone, timedelta
 
-from lib.common import get_broadcaster, get_db
+from lib.common import get_broadcaster
+from lib.counters import get_counter_store
+from lib.apifetch import api_fetcher
+
+VARIABLE_RE = re.compile(r'\{([^ ]+)\}')
+## Number of compiled templates to keep
+TEMPLATE_CACHE_SIZE = 512
+
+## Threads for resolving network bound variables at the same time
+VARIABLE_WORKERS = 8
+## Seconds to wait for a network bound variable
+VARIABLE_TIMEOUT = 5
+## Used in place of a variable that timed out
+VARIABLE_TIMEOUT_TEXT = ''
+
+_variable_executor = None
+_variable_executor_lock = threading.Lock()
+
+def get_variable_executor():
+	"""
+	Get the shared ThreadPoolExecutor for resolving variables
+	"""
+	global _variable_executor
+	with _variable_executor_lock:
+		if _variable_executor is None:
+			_variable_executor = ThreadPoolExecutor(
+				max_workers = VARIABLE_WORKERS,
+				thread_name_prefix = 'chatvars'
+			)
+		return _variable_executor
+
+class CompiledTemplate:
+	"""
+	A chat string split into literal text and variables so it only has to
+	be scanned once. Use compile_template() to get one
+
+	Args:
+		template (string): Chat string to compile
+	"""
+	__slots__ = ('template', 'parts', 'names', 'inner', 'is_static')
+
+	def __init__(self, template):
+		self.template = template
+		## Literal strings, and ints indexing into self.names for variables
+		self.parts = []
+		## Unique variable names in the order they first appear
+		self.names = []
+		## Compiled templates for variable names that contain variables
+		self.inner = []
+
+		index = {}
+		last = 0
+		for match in VARIABLE_RE.finditer(template):
+			name = match.group(1)
+			if match.start() > last:
+				self.parts.append(template[last:match.start()])
+			if name not in index:
+				index[name] = len(self.names)
+				self.names.append(name)
+				inner = compile_template(name)
+				self.inner.append(None if inner.is_static else inner)
+			self.parts.append(index[name])
+			last = match.end()
+		if last < len(template):
+			self.parts.append(template[last:])
+
+		self.is_static = not self.names
+
+	def render(self, resolve, prefetch=None):
+		"""
+		Build the final string
+
+		Args:
+			resolve (function): Takes a variable name with its own variables
+				already rendered and returns the replacement or None to leave
+				the variable as it is
+			prefetch (function): Called with all rendered variable names
+				before any are resolved so slow ones can be started early
+		"""
+		if self.is_static:
+			return self.template
+
+		parsed_names = [
+			name if inner is None else inner.render(resolve, prefetch)
+			for name, inner in zip(self.names, self.inner)
+		]
+		if prefetch is not None:
+			prefetch(parsed_names)
+
+		values = []
+		for name, parsed_name in zip(self.names, parsed_names):
+			res = resolve(parsed_name)
+			## A nested variable is still resolved for its side effects but,
+			## as before, is only replaced if its name didn't change
+			if res is None or parsed_name != name:
+				res = f'{{{name}}}'
+			values.append(res)
+
+		return ''.join([part if type(part) is str else values[part] for part in self.parts])
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(template):
+	"""
+	Get the CompiledTemplate for template, compiling it on first use
+	"""
+	return CompiledTemplate(template)
 
 class ChatMessageParser:
-	def __init__(self, chat_string, event=None):
-		self.variables = {
-			'sender': self.sender,
-			'uptime': self.uptime,
-			'count': self.counter,
-			'lastplayed': self.last_played,
-			'arg': self.argument,
-			'@': self.at,
-			'random': self.random,
-			'api': self.api,
-		}
+	## Variable name -> method that resolves it
+	variables = {
+		'sender': 'sender',
+		'uptime': 'uptime',
+		'count': 'counter',
+		'lastplayed': 'last_played',
+		'arg': 'argument',
+		'@': 'at',
+		'random': 'random',
+		'api': 'api',
+	}
+	## Variables that wait on the network and can be resolved concurrently
+	io_variables = {'uptime', 'lastplayed', 'api'}
 
+	def __init__(self, chat_string, event=None):
 		self.chat_string = chat_string
 		self.event = event
 		self._twitch_api = None
 		self._broadcaster = None
+		## Variable name -> (Future, deadline) for prefetched variables
+		self._pending = {}
 
 	def has_vars(self):
-		match = re.search(r'\{[^ ]+\}', self.chat_string)
-		if match:
-			return True
-		return False
+		return not compile_template(self.chat_string).is_static
+
+	def prefetch(self, names):
+		"""
+		Start resolving network bound variables on the variable executor so
+		a message waits on the slowest lookup instead of all of them in turn,
+		and never longer than VARIABLE_TIMEOUT
+
+		Args:
+			names (list): Variable names with args
+		"""
+		io_names = [
+			n for n in names
+			if n.split(':')[0] in self.io_variables and n not in self._pending
+		]
+		if not io_names:
+			return
+
+		## Look these up now rather than racing to do it in every worker
+		self.broadcaster
+		self.twitch_api
+
+		for name in io_names:
+			self._submit(name)
+
+	def _submit(self, name):
+		## Each lookup gets VARIABLE_TIMEOUT from when it was submitted
+		deadline = time.time() + VARIABLE_TIMEOUT
+		future = get_variable_executor().submit(self._resolve_now, name)
+		self._pending[name] = (future, deadline)
+		return future, deadline
+
+	def resolve(self, name):
+		"""
+		Get the value for one variable
+
+		Args:
+			name (string): Variable name with args, e.g. 'count:deaths'
+		"""
+		pending = self._pending.pop(name, None)
+		if pending is None and name.split(':')[0] in self.io_variables:
+			## Not prefetched, e.g. used again after being resolved. It still
+			## gets the timeout
+			pending = self._submit(name)
+			self._pending.pop(name)
+		if pending is not None:
+			future, deadline = pending
+			try:
+				return future.result(timeout=max(deadline - time.time(), 0))
+			except TimeoutError:
+				return VARIABLE_TIMEOUT_TEXT
+
+		return self._resolve_now(name)
+
+	def _resolve_now(self, name):
+		split = name.split(':')
+		key = split[0]
+		args = split[1:]
+
+		if key in self.variables:
+			return getattr(self, self.variables[key])(self.event, *args)
+		elif self.event is not None and hasattr(self.event, key):
+			return str(getattr(self.event, key))
+
+		return None
 
 	def recursive_parse(self, chat_string):
-		all_vars = re.findall(r'\{([^ ]+)\}', chat_string)
-		vars = []
-		[vars.append(x) for x in all_vars if x not in vars]
-		parsed_str = chat_string
-
-		for v in vars:
-			v_parsed = self.recursive_parse(v)
-			split = v_parsed.split(':')
-			key = split[0]
-			args = split[1:]
-
-
-			if key in self.variables:
-				res = self.variables[key](self.event, *args)
-				if res != None:
-					parsed_str = parsed_str.replace(f'{{{v_parsed}}}', res)
-			elif self.event is not None and hasattr(self.event, key):
-				parsed_str = parsed_str.replace(f'{{{v_parsed}}}', str(getattr(self.event, key)))
-
-		return parsed_str
+		return compile_template(chat_string).render(self.resolve, self.prefetch)
 
 	def parse(self):
 		return self.recursive_parse(self.chat_string)
@@ -159,45 +314,20 @@ class ChatMessageParser:
 
 		counter_name = args[0]
 
-		con, cur = get_db()
-
-		sql = "SELECT id, value FROM counters WHERE counter_name = ?"
-		cur.execute(sql, (counter_name,))
-
-		res = cur.fetchone()
-
-		count = 1
-		if not res:
-			sql = "INSERT INTO counters (counter_name, value) VALUES (?, 1)"
-			cur.execute(sql, (counter_name, ))
-			count = 1
-		else:
-			count = res['value'] + 1
-			sql = "UPDATE counters SET value = ? WHERE id = ?"
-			cur.execute(sql, (count, res['id']))
-
-		con.commit()
-		con.close()
-
-		return str(count)
+		return str(get_counter_store().increment(counter_name))
 
 	def api(self, event, *args):
 		if not args:
 			return None
 
 		url = ':'.join(args)
-		try:
-			req = requests.get(
-				url,
-				headers = {
-					'x-voltronbot-channel': self.broadcaster.user_name,
-					'user-agent': f'VoltronBot/{Version.VERSION} (+https://voltron.purkinje.live/)'
-				}
-			)
-		except requests.exceptions.ConnectionError:
-			return ""
-
-		return req.text
+		return api_fetcher.fetch(
+			url,
+			headers = {
+				'x-voltronbot-channel': self.broadcaster.user_name,
+				'user-agent': f'VoltronBot/{Version.VERSION} (+https://voltron.purkinje.live/)'
+			}
+		)
 
 	@property
 	def twitch_api(self):
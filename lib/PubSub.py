@@ -8,6 +8,7 @@ import requests
 import config
 from base.events import SubscriptionEvent, GiftSubscriptionEvent, BitsEvent, ChannelPointRedemption
 from lib.common import get_broadcaster
+from lib.http_session import get_session
 
 class PubSubThread:
 	eventsub_ws_uri = "wss://eventsub.wss.twitch.tv/ws"
@@ -268,7 +269,7 @@ class PubSubThread:
 		for event_type in events:
 			self.buffer_queue.put(('DEBUG', f"Subscribing to {events[event_type]['type']} event"))
 			try:
-				req = requests.post(
+				req = get_session().post(
 					self.subscription_uri,
 					headers = {
 						'Client-Id': self.__client_id,
@@ -278,7 +279,7 @@ class PubSubThread:
 					data = json.dumps(events[event_type]),
 				)
 
-			except requests.exceptions.ConnectionError:
+			except requests.exceptions.RequestException:
 				self.buffer_queue.put(("ERR", f"Error subscribing to {events[event_type]['type']} event"))
 				continue
 
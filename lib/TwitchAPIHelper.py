@@ -1,8 +1,432 @@
 import config
 import requests
 import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from queue import Queue, Empty
 from datetime import datetime, timezone, timedelta
 
+from lib.http_session import get_session, CONNECT_TIMEOUT, READ_TIMEOUT
+
+HELIX_URI = 'https://api.twitch.tv/helix'
+
+## Seconds to cache responses for each read-only endpoint
+HELIX_CACHE_TTLS = {
+	'users': 3600,
+	'channels': 120,
+	'streams': 30,
+	'search/categories': 3600,
+	'channel_points/custom_rewards': 60,
+	'channels/followers': 300
+}
+## Seconds to remember lookups that found nothing, e.g. unknown users
+HELIX_NEGATIVE_TTL = 60
+HELIX_CACHE_SIZE = 1024
+
+## Seconds to collect user lookups before sending them as one request
+HELIX_BATCH_WINDOW = 0.005
+## Most logins/ids Helix accepts in one /users request
+HELIX_BATCH_SIZE = 100
+## Workers for lookups that can't be batched, like follow times
+HELIX_LOOKUP_WORKERS = 8
+
+## Request priorities, lower goes first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+## Points in the bucket that only PRIORITY_HIGH requests may use
+RATE_LIMIT_RESERVE = 10
+## Below this many points requests are spread out until the bucket resets
+RATE_LIMIT_LOW_WATER = 20
+## Longest a request will wait for rate limit points
+RATE_LIMIT_MAX_WAIT = 30
+
+## Longest get_user() waits on the batcher before treating the lookup as
+## failed
+USER_LOOKUP_TIMEOUT = CONNECT_TIMEOUT + READ_TIMEOUT + RATE_LIMIT_MAX_WAIT + HELIX_BATCH_WINDOW
+
+class RateLimitGovernor:
+	"""
+	Tracks the Helix rate limit bucket for one token from the
+	Ratelimit-Limit/Remaining/Reset response headers and holds requests
+	back when it runs low.
+
+	Lower priority requests leave RATE_LIMIT_RESERVE points for
+	PRIORITY_HIGH ones and wait while higher priority requests are waiting.
+	"""
+	def __init__(self):
+		self.limit = None
+		self.remaining = None
+		## Epoch time the bucket refills
+		self.reset = None
+
+		self.throttled = 0
+		self.rejected = 0
+		self.rate_limited = 0
+
+		self._waiting = {}
+		self._next_slot = 0
+		self._cond = threading.Condition()
+
+	def acquire(self, priority=PRIORITY_NORMAL, timeout=RATE_LIMIT_MAX_WAIT):
+		"""
+		Wait until a request may be sent
+
+		Returns:
+			True if the request may go ahead, False if it timed out
+		"""
+		deadline = time.time() + timeout
+		waited = False
+		with self._cond:
+			self._waiting[priority] = self._waiting.get(priority, 0) + 1
+			try:
+				while True:
+					now = time.time()
+					if self.reset is not None and now >= self.reset:
+						self.remaining = self.limit
+						self.reset = None
+
+					wait_until = self._wait_until(priority, now)
+					if wait_until is None:
+						if self.remaining is not None:
+							self.remaining -= 1
+						if waited:
+							self.throttled += 1
+						return True
+
+					if now >= deadline:
+						self.rejected += 1
+						return False
+
+					waited = True
+					self._cond.wait(min(wait_until, deadline) - now)
+			finally:
+				self._waiting[priority] -= 1
+				self._cond.notify_all()
+
+	def _wait_until(self, priority, now):
+		"""
+		Get the time to wait until before trying again, or None if a
+		request at priority can go now
+		"""
+		## Something more important is waiting. Check again shortly
+		for p, count in self._waiting.items():
+			if p < priority and count:
+				return now + 0.1
+
+		if self.remaining is None:
+			return None
+
+		reserve = 0 if priority == PRIORITY_HIGH else RATE_LIMIT_RESERVE
+		if self.remaining <= reserve:
+			return self.reset if self.reset is not None else now + 1
+
+		if self.remaining <= RATE_LIMIT_LOW_WATER and self.reset is not None:
+			## Pace the last few points over the time left in the bucket
+			if now < self._next_slot:
+				return self._next_slot
+			self._next_slot = now + max(self.reset - now, 0) / self.remaining
+
+		return None
+
+	def update(self, response):
+		"""
+		Update the bucket from a Helix response
+		"""
+		headers = response.headers
+		with self._cond:
+			try:
+				if 'Ratelimit-Limit' in headers:
+					self.limit = int(headers['Ratelimit-Limit'])
+				if 'Ratelimit-Remaining' in headers:
+					self.remaining = int(headers['Ratelimit-Remaining'])
+				if 'Ratelimit-Reset' in headers:
+					self.reset = int(headers['Ratelimit-Reset'])
+			except ValueError:
+				pass
+
+			if response.status_code == 429:
+				self.rate_limited += 1
+				self.remaining = 0
+				if self.reset is None:
+					self.reset = time.time() + 1
+			self._cond.notify_all()
+
+	def state(self):
+		with self._cond:
+			return {
+				'limit': self.limit,
+				'remaining': self.remaining,
+				'reset_in': max(self.reset - time.time(), 0) if self.reset else 0,
+				'waiting': sum(self._waiting.values()),
+				'throttled': self.throttled,
+				'rejected': self.rejected,
+				'rate_limited': self.rate_limited
+			}
+
+## Account name -> RateLimitGovernor. Helix buckets are per token
+_governors = {}
+_governors_lock = threading.Lock()
+
+def get_governor(key):
+	with _governors_lock:
+		governor = _governors.get(key)
+		if governor is None:
+			governor = RateLimitGovernor()
+			_governors[key] = governor
+		return governor
+
+def get_rate_limit_states():
+	"""
+	Get the bucket state of every governor, keyed by account
+	"""
+	with _governors_lock:
+		governors = dict(_governors)
+	return {key: g.state() for key, g in governors.items()}
+
+class HelixCache:
+	"""
+	Thread safe TTL + LRU cache for Helix response data.
+
+	Concurrent lookups for the same key share one request: the first caller
+	fetches and everyone else waits for its result.
+
+	Args:
+		max_size (int): Entries kept before the least recently used is dropped
+	"""
+	def __init__(self, max_size=HELIX_CACHE_SIZE):
+		self.max_size = max_size
+
+		## key -> (expire_time, data)
+		self._entries = OrderedDict()
+		## key -> Event set when the fetch for key finishes
+		self._in_flight = {}
+		self._lock = threading.Lock()
+
+		self.hits = 0
+		self.misses = 0
+		self.negative_hits = 0
+		## Lookups that waited on another thread's request
+		self.shared = 0
+
+	def get(self, key, ttl, fetch):
+		"""
+		Get the cached data for key, calling fetch() on a miss
+
+		Args:
+			key (tuple): Cache key
+			ttl (int): Seconds to cache a non-empty result
+			fetch (function): Returns the data, or False on failure.
+				Failures are not cached
+		"""
+		while True:
+			with self._lock:
+				entry = self._entries.get(key)
+				if entry is not None:
+					if entry[0] > time.monotonic():
+						self._entries.move_to_end(key)
+						if entry[1]:
+							self.hits += 1
+						else:
+							self.negative_hits += 1
+						return entry[1]
+					del self._entries[key]
+
+				done = self._in_flight.get(key)
+				if done is None:
+					done = threading.Event()
+					self._in_flight[key] = done
+					self.misses += 1
+					break
+				self.shared += 1
+
+			## Someone else is fetching this key. If their fetch failed
+			## there will be no entry and we try ourselves
+			done.wait()
+
+		try:
+			data = fetch()
+		finally:
+			with self._lock:
+				del self._in_flight[key]
+			done.set()
+
+		if data is not False:
+			self.put(key, data, ttl if data else min(ttl, HELIX_NEGATIVE_TTL))
+		return data
+
+	def peek(self, key):
+		"""
+		Get (True, data) if key is cached and fresh, else (False, None).
+		Never fetches
+		"""
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None or entry[0] <= time.monotonic():
+				return (False, None)
+			self._entries.move_to_end(key)
+			if entry[1]:
+				self.hits += 1
+			else:
+				self.negative_hits += 1
+			return (True, entry[1])
+
+	def put(self, key, data, ttl):
+		with self._lock:
+			self._entries[key] = (time.monotonic() + ttl, data)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_size:
+				self._entries.popitem(last=False)
+
+	def invalidate(self, key=None):
+		"""
+		Drop key from the cache, or everything if key is None
+		"""
+		with self._lock:
+			if key is None:
+				self._entries.clear()
+			else:
+				self._entries.pop(key, None)
+
+	def stats(self):
+		with self._lock:
+			return {
+				'entries': len(self._entries),
+				'hits': self.hits,
+				'negative_hits': self.negative_hits,
+				'misses': self.misses,
+				'shared': self.shared
+			}
+
+## Helix data here isn't specific to the account asking for it so all
+## helpers share one cache
+helix_cache = HelixCache()
+
+def helix_cache_key(endpoint, params):
+	"""
+	Build the helix_cache key for a GET of endpoint with params. Values
+	are compared as strings so an int id from the DB and a str id from
+	Helix JSON are the same key
+	"""
+	return (endpoint, ) + tuple(sorted((name, str(value)) for name, value in params.items()))
+
+_lookup_executor = None
+_lookup_executor_lock = threading.Lock()
+
+def get_lookup_executor():
+	"""
+	Get the shared ThreadPoolExecutor used for async Helix lookups
+	"""
+	global _lookup_executor
+	with _lookup_executor_lock:
+		if _lookup_executor is None:
+			_lookup_executor = ThreadPoolExecutor(
+				max_workers = HELIX_LOOKUP_WORKERS,
+				thread_name_prefix = 'helix'
+			)
+		return _lookup_executor
+
+class UserLookupBatcher(threading.Thread):
+	"""
+	Collects user lookups for HELIX_BATCH_WINDOW seconds and sends them to
+	Helix as one /users request, then resolves each caller's Future.
+	Shared by every TwitchAPIHelper. Use get_user_batcher()
+	"""
+	def __init__(self):
+		threading.Thread.__init__(self)
+		self.daemon = True
+
+		## (field, value, Future, api) where field is 'login' or 'id' and
+		## api is the TwitchAPIHelper that asked
+		self._queue = Queue()
+
+	def lookup(self, api, field, value):
+		future = Future()
+		self._queue.put((field, value, future, api))
+		return future
+
+	def run(self):
+		while True:
+			batch = [self._queue.get()]
+			deadline = time.monotonic() + HELIX_BATCH_WINDOW
+			while len(batch) < HELIX_BATCH_SIZE * 2:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				try:
+					batch.append(self._queue.get(timeout=remaining))
+				except Empty:
+					break
+
+			## Each account's lookups go out on its own token so they count
+			## against that account's rate limit
+			groups = {}
+			for field, value, future, api in batch:
+				key = (field, api._governor())
+				if key not in groups:
+					groups[key] = (api, {})
+				groups[key][1].setdefault(value, []).append(future)
+
+			for (field, governor), (api, waiting) in groups.items():
+				values = list(waiting)
+				for i in range(0, len(values), HELIX_BATCH_SIZE):
+					chunk = values[i:i + HELIX_BATCH_SIZE]
+					try:
+						results = self._fetch(api, field, chunk)
+					except Exception:
+						results = False
+
+					for value in chunk:
+						for future in waiting[value]:
+							future.set_result(results.get(value, None) if results is not False else False)
+
+	def _fetch(self, api, field, values):
+		"""
+		Send one /users request for values and cache each user
+
+		Returns:
+			dict of value -> user data, or False if the request failed
+		"""
+		req = api._request('GET', 'users', [(field, v) for v in values])
+		if req is False:
+			return False
+		resp = json.loads(req.text)
+		if 'data' not in resp:
+			return False
+
+		found = {}
+		for user in resp['data']:
+			found[user[field]] = user
+
+		ttl = HELIX_CACHE_TTLS['users']
+		for value in values:
+			user = found.get(value, None)
+			data = [user] if user else []
+			helix_cache.put(helix_cache_key('users', {field: value}), data, ttl if data else min(ttl, HELIX_NEGATIVE_TTL))
+			## Cache under the other field too so either lookup hits
+			if user:
+				other = 'id' if field == 'login' else 'login'
+				helix_cache.put(helix_cache_key('users', {other: user[other]}), data, ttl)
+
+		return found
+
+_user_batcher = None
+_user_batcher_lock = threading.Lock()
+
+def get_user_batcher():
+	"""
+	Get the shared UserLookupBatcher, starting it on first use
+	"""
+	global _user_batcher
+	with _user_batcher_lock:
+		if _user_batcher is None:
+			_user_batcher = UserLookupBatcher()
+			_user_batcher.start()
+		return _user_batcher
+
 class TwitchAPIHelper:
 	"""
 	Helper for sending requests and parsing responses from the Twitch API
@@ -25,28 +449,92 @@ class TwitchAPIHelper:
 		if hasattr(config, 'FERNET_KEY'):
 			self.__fernet_key = config.FERNET_KEY
 
+	def _governor(self):
+		user_id = getattr(self.oauth_tokens, '_user_id', None)
+		if user_id is None:
+			user_id = id(self.oauth_tokens)
+		return get_governor(user_id)
+
+	def _request(self, method, endpoint, params=None, priority=PRIORITY_NORMAL):
+		"""
+		Send a request to Helix on the shared session, waiting on the
+		rate limit governor first. A 429 is retried once after the bucket
+		resets
+
+		Args:
+			method (string): HTTP method
+			endpoint (string): Path under /helix, e.g. 'users'
+			params (dict): Query parameters
+			priority (int): PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW
+
+		Returns:
+			The requests.Response or False if the request failed
+		"""
+		governor = self._governor()
+		for attempt in range(2):
+			if not governor.acquire(priority):
+				return False
+
+			headers = {
+				'client-id': self.__client_id,
+				'Authorization': 'Bearer {token}'.format(token=self.oauth_tokens.token(self.__fernet_key))
+			}
+			try:
+				req = get_session().request(
+					method,
+					f'{HELIX_URI}/{endpoint}',
+					headers = headers,
+					params = params
+				)
+			except requests.exceptions.RequestException:
+				return False
+
+			governor.update(req)
+			if req.status_code != 429:
+				return req
+
+		return False
+
+	def _get_data(self, endpoint, params, priority=PRIORITY_NORMAL):
+		"""
+		GET a read-only endpoint through helix_cache
+
+		Returns:
+			The response's data list, or False if the request failed
+		"""
+		def fetch():
+			req = self._request('GET', endpoint, params, priority)
+			if req is False:
+				return False
+			try:
+				resp = json.loads(req.text)
+			except ValueError:
+				return False
+			if 'data' not in resp:
+				## Errors other than a missing user shouldn't be cached
+				if req.status_code != 400:
+					return False
+				return []
+			return resp['data']
+
+		key = helix_cache_key(endpoint, params)
+		return helix_cache.get(key, HELIX_CACHE_TTLS[endpoint], fetch)
+
 	def set_stream_title(self, broadcaster_id, title):
 		"""
 		Sets the stream title for the bearer of self.oauth_tokens
 		"""
 		if not title:
 			return False
-		try:
-			req = requests.patch(
-				'https://api.twitch.tv/helix/channels',
-				headers = {
-					'client-id': self.__client_id,
-					'Authorization': 'Bearer {token}'.format(token=self.oauth_tokens.token(self.__fernet_key))
-				},
-				params = {
-					'broadcaster_id': broadcaster_id,
-					'title': title
-				}
-			)
-		except requests.exceptions.ConnectionError:
+		req = self._request('PATCH', 'channels', {
+			'broadcaster_id': broadcaster_id,
+			'title': title
+		}, PRIORITY_HIGH)
+		if req is False:
 			return False
 
 		if req.status_code == 204:
+			helix_cache.invalidate(helix_cache_key('channels', {'broadcaster_id': broadcaster_id}))
 			return self.get_channel(broadcaster_id)
 		return False
 
@@ -57,21 +545,14 @@ class TwitchAPIHelper:
 		if not game_id:
 			return game_id
 
-		try:
-			req = requests.patch(
-				'https://api.twitch.tv/helix/channels',
-				headers = {
-					'client-id': self.__client_id,
-					'Authorization': 'Bearer {token}'.format(token=self.oauth_tokens.token(self.__fernet_key))
-				},
-				params = {
-					'broadcaster_id': broadcaster_id,
-					'game_id': game_id
-				}
-			)
-		except requests.exceptions.ConnectionError:
+		req = self._request('PATCH', 'channels', {
+			'broadcaster_id': broadcaster_id,
+			'game_id': game_id
+		}, PRIORITY_HIGH)
+		if req is False:
 			return False
 
+		helix_cache.invalidate(helix_cache_key('channels', {'broadcaster_id': broadcaster_id}))
 		return self.get_channel(broadcaster_id)
 
 
@@ -79,24 +560,15 @@ class TwitchAPIHelper:
 		"""
 		The the game ID for use on twitch from game_name
 		"""
-		try:
-			req = requests.get(
-				'https://api.twitch.tv/helix/search/categories',
-				headers = {
-					'client-id': self.__client_id,
-					'Authorization': 'Bearer {token}'.format(token=self.oauth_tokens.token(self.__fernet_key))
-				},
-				params = {
-					'query': game_name,
-					'first': 1
-				}
-			)
-		except requests.exceptions.ConnectionError:
+		data = self._get_data('search/categories', {
+			'query': game_name.lower(),
+			'first': 1
+		})
+		if data is False:
 			return False
 
-		resp = json.loads(req.text)
-		if 'data' in resp and len(resp['data']) > 0:
-			return int(resp['data'][0]['id'])
+		if len(data) > 0:
+			return int(data[0]['id'])
 		else:
 			return None
 
@@ -104,96 +576,99 @@ class TwitchAPIHelper:
 		"""
 		Get Twitch user information for the holder of self.oauth_tokens
 		"""
-		try:
-			req = requests.get(
-				'https://api.twitch.tv/helix/users',
-				headers = {
-					'client-id': self.__client_id,
-					'Authorization': 'Bearer {token}'.format(token=self.oauth_tokens.token(self.__fernet_key))
-				},
-			)
-		except requests.exceptions.ConnectionError:
+		req = self._request('GET', 'users')
+		if req is False:
 			return False
 		resp = json.loads(req.text)
 		return resp
 
 	def get_user(self, login):
+		"""
+		Look up a user by login. Lookups made close together from any
+		thread are sent to Twitch as a single request
+
+		Returns:
+			The user data, None if the user doesn't exist or False if the
+			request failed
+		"""
+		return self._wait_user(self.get_user_async(login))
+
+	def get_user_by_id(self, user_id):
+		"""
+		Same as get_user but looks the user up by Twitch user id
+		"""
+		return self._wait_user(self.get_user_by_id_async(user_id))
+
+	def _wait_user(self, future, timeout=USER_LOOKUP_TIMEOUT):
 		try:
-			req = requests.get(
-				'https://api.twitch.tv/helix/users',
-				headers = {
-					'client-id': self.__client_id,
-					'Authorization': 'Bearer {token}'.format(token=self.oauth_tokens.token(self.__fernet_key))
-				},
-				params = {'login': login}
-			)
-		except requests.exceptions.ConnectionError:
+			return future.result(timeout=timeout)
+		except TimeoutError:
 			return False
 
-		resp = json.loads(req.text)
+	def _lookup_user(self, field, value):
+		found, data = helix_cache.peek(helix_cache_key('users', {field: value}))
+		if found:
+			future = Future()
+			future.set_result(data[0] if data else None)
+			return future
 
-		data = resp.get('data', None)
-		if not data or len(data) < 1:
-			return None
+		return get_user_batcher().lookup(self, field, value)
 
-		return data[0]
+	def get_user_async(self, login):
+		"""
+		Look up a user without blocking. Lookups made close together are
+		sent to Twitch as a single request
+
+		Returns:
+			Future resolving to the user data, None if the user doesn't
+			exist or False if the request failed
+		"""
+		return self._lookup_user('login', login.lower())
+
+	def get_user_by_id_async(self, user_id):
+		"""
+		Same as get_user_async but looks the user up by Twitch user id
+		"""
+		return self._lookup_user('id', str(user_id))
+
+	def get_users(self, logins):
+		"""
+		Look up many users using as few requests as possible
+
+		Returns:
+			dict of login -> user data, None or False as in get_user_async
+		"""
+		futures = {login: self.get_user_async(login) for login in logins}
+		deadline = time.time() + USER_LOOKUP_TIMEOUT
+		return {
+			login: self._wait_user(future, max(deadline - time.time(), 0))
+			for login, future in futures.items()
+		}
 
 	def get_rewards(self, broadcaster_id):
-		try:
-			req = requests.get(
-				'https://api.twitch.tv/helix/channel_points/custom_rewards',
-				headers = {
-					'client-id': self.__client_id,
-					'Authorization': 'Bearer {}'.format(self.oauth_tokens.token(self.__fernet_key))
-				},
-				params = { 'broadcaster_id': broadcaster_id }
-			)
-		except requests.exceptions.ConnectionError:
+		data = self._get_data('channel_points/custom_rewards', { 'broadcaster_id': broadcaster_id })
+		if data is False:
 			return False
 
-		resp = json.loads(req.text)
-		data = resp.get('data', None)
-
 		return data
 
-	def get_stream(self, broadcaster_id):
-		try:
-			req = requests.get(
-				'https://api.twitch.tv/helix/streams',
-				headers = {
-					'client-id': self.__client_id,
-					'Authorization': 'Bearer {}'.format(self.oauth_tokens.token(self.__fernet_key))
-				},
-				params = { 'user_id': broadcaster_id }
-			)
-		except requests.exceptions.ConnectionError:
+	def get_stream(self, broadcaster_id, priority=PRIORITY_NORMAL):
+		data = self._get_data('streams', { 'user_id': broadcaster_id }, priority)
+		if data is False:
 			return False
-		resp = json.loads(req.text)
-		data = resp.get('data', None)
 		if not data or len(data) < 1:
 			return None
 
 		return data[0]
 
 	def get_follow_time(self, broadcaster_id, user_id):
-		try:
-			req = requests.get(
-				'https://api.twitch.tv/helix/channels/followers',
-				headers = {
-					'client-id': self.__client_id,
-					'Authorization': 'Bearer {}'.format(self.oauth_tokens.token(self.__fernet_key))
-				},
-				params = {
-					'user_id' : user_id,
-					'broadcaster_id': broadcaster_id
-				}
-			)
-		except requests.exceptions.ConnectionError:
+		data = self._get_data('channels/followers', {
+			'user_id' : user_id,
+			'broadcaster_id': broadcaster_id
+		})
+		if data is False:
 			return False
 
-		resp = json.loads(req.text)
-		data = resp.get('data', None)
-
 		if not data or len(data) < 1:
 			return None
 
@@ -204,21 +679,22 @@ class TwitchAPIHelper:
 
 		return secs
 
+	def get_follow_time_async(self, broadcaster_id, user_id):
+		"""
+		Run get_follow_time on the lookup pool. Helix only takes one user
+		per follower request so these can't be batched, but they no longer
+		block the caller or wait on each other
+
+		Returns:
+			Future resolving to the get_follow_time result
+		"""
+		return get_lookup_executor().submit(self.get_follow_time, broadcaster_id, user_id)
+
 	def get_channel(self, broadcaster_id):
-		try:
-			req = requests.get(
-				'https://api.twitch.tv/helix/channels',
-				headers = {
-					'client-id': self.__client_id,
-					'Authorization': 'Bearer {token}'.format(token=self.oauth_tokens.token(self.__fernet_key))
-				},
-				params = {'broadcaster_id': broadcaster_id}
-			)
-		except requests.exceptions.ConnectionError:
+		data = self._get_data('channels', {'broadcaster_id': broadcaster_id})
+		if data is False:
 			return False
 
-		resp = json.loads(req.text)
-		data = resp.get('data', None)
 		if not data or len(data) < 1:
 			return None
 
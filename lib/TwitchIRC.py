@@ -1,11 +1,15 @@
 import socket
 import sys
 import time
-import re
 import signal
 import requests
 import json
 import threading
+import queue
+import itertools
+import asyncio
+import concurrent.futures
+from collections import deque
 
 from lib.common import get_broadcaster
 from base.events import ChatCommandEvent, ChatMessageEvent, HostEvent, RaidEvent
@@ -13,6 +17,151 @@ from base.events import ChatCommandEvent, ChatMessageEvent, HostEvent, RaidEvent
 import config
 from Version import VERSION
 
+## Size of a single socket read
+RECV_CHUNK_SIZE = 4096
+## Twitch caps IRC lines well below this. Anything larger without a line
+## ending is garbage and is discarded to keep the buffer bounded
+MAX_LINE_LENGTH = 16384
+
+## Translate table stripping ASCII control characters from chat messages
+CONTROL_CHAR_TABLE = dict.fromkeys(range(1, 32))
+
+## IRCv3 tag value escapes
+TAG_ESCAPES = {
+	':': ';',
+	's': ' ',
+	'\\': '\\',
+	'r': '\r',
+	'n': '\n',
+}
+
+## Priorities for queued chat messages. Lower values are sent first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+## Twitch PRIVMSG limits as (messages, seconds)
+## https://dev.twitch.tv/docs/irc/#rate-limits
+RATE_LIMIT_USER = (20, 30)
+RATE_LIMIT_MODERATOR = (100, 30)
+## Seconds added to the window so network jitter can't push one message
+## too many into Twitch's window
+RATE_LIMIT_MARGIN = 0.5
+
+## Maximum number of chat messages waiting to be sent per connection
+SEND_QUEUE_SIZE = 100
+
+## Async transport timings in seconds. A PING is only sent after
+## PING_INTERVAL seconds without any traffic
+PING_INTERVAL = 400
+PONG_TIMEOUT = 10
+RECONNECT_BACKOFF_BASE = 1
+RECONNECT_BACKOFF_MAX = 120
+
+class IRCMessage:
+	"""
+	A single parsed IRC line
+
+	Args:
+		tags (dict): IRCv3 message tags, or None if the line had no tags
+		prefix (string): Message prefix without the leading colon, or None
+		command (string): IRC command or numeric (PRIVMSG, PING, 001...)
+		params (list): Command parameters. The trailing parameter is last
+	"""
+	__slots__ = ('tags', 'prefix', 'command', 'params')
+
+	def __init__(self, tags, prefix, command, params):
+		self.tags = tags
+		self.prefix = prefix
+		self.command = command
+		self.params = params
+
+	@property
+	def nick(self):
+		if not self.prefix:
+			return None
+		return self.prefix.partition('!')[0]
+
+	@property
+	def channel(self):
+		if not self.params or not self.params[0].startswith('#'):
+			return None
+		return self.params[0][1:]
+
+	@property
+	def trailing(self):
+		if not self.params:
+			return ''
+		return self.params[-1]
+
+	def __repr__(self):
+		return f'IRCMessage({self.command!r}, prefix={self.prefix!r}, params={self.params!r})'
+
+def _unescape_tag(value):
+	out = []
+	chars = iter(value)
+	for char in chars:
+		if char == '\\':
+			escaped = next(chars, '')
+			out.append(TAG_ESCAPES.get(escaped, escaped))
+		else:
+			out.append(char)
+	return ''.join(out)
+
+def parse_irc_message(line):
+	"""
+	Tokenize an IRC line into tags, prefix, command and params in one pass
+
+	Args:
+		line (string): A single IRC line without the trailing CRLF
+
+	Returns:
+		IRCMessage, or None if the line is empty or malformed
+	"""
+	tags = None
+	prefix = None
+	pos = 0
+
+	if line.startswith('@'):
+		pos = line.find(' ')
+		if pos == -1:
+			return None
+		tags = {}
+		for tag in line[1:pos].split(';'):
+			key, _, value = tag.partition('=')
+			if '\\' in value:
+				value = _unescape_tag(value)
+			tags[key] = value
+		pos += 1
+
+	if line.startswith(':', pos):
+		end = line.find(' ', pos)
+		if end == -1:
+			return None
+		prefix = line[pos + 1:end]
+		pos = end + 1
+
+	## A second prefix means there is no command
+	if line.startswith(':', pos):
+		return None
+
+	trailing_pos = line.find(' :', pos)
+	if trailing_pos == -1:
+		middle = line[pos:]
+		trailing = None
+	else:
+		middle = line[pos:trailing_pos]
+		trailing = line[trailing_pos + 2:]
+
+	params = middle.split()
+	if not params:
+		return None
+	command = params.pop(0).upper()
+	if trailing is not None:
+		params.append(trailing)
+
+	return IRCMessage(tags, prefix, command, params)
+
 class IRCBase:
 	"""
 	The main class for the Twitch ChatBot.
@@ -47,6 +196,13 @@ class IRCBase:
 		self.irc.settimeout(1)
 		#self.connect()
 
+		## Receive buffers. recv_into() writes into a reusable chunk and any
+		## partial line (or partial UTF-8 character) is held in _recv_buffer
+		## until the rest of it arrives
+		self._recv_chunk = bytearray(RECV_CHUNK_SIZE)
+		self._recv_view = memoryview(self._recv_chunk)
+		self._recv_buffer = bytearray()
+
 		## Last ping and pong times. Set these to 0 so a ping will be
 		## sent immediately after connecting
 		self._last_ping = 0
@@ -55,8 +211,29 @@ class IRCBase:
 		self.channel_map = {}
 		#self.join_channels()
 
+		## IRC command -> handler. Lines with any other command are ignored
+		self._command_handlers = {
+			'PING': self._handle_ping,
+			'PONG': self._handle_pong,
+			'PRIVMSG': self._handle_privmsg,
+			'USERNOTICE': self._handle_usernotice,
+			'USERSTATE': self._handle_userstate,
+		}
+
+		## Serializes writes to the socket between the writer thread and
+		## connection management (PONG, JOIN, etc)
+		self._send_lock = threading.Lock()
+
+		## Outbound chat messages are paced by a dedicated writer thread
+		## Broadcasters get the moderator limit from the start. Other
+		## accounts are upgraded when Twitch tells us they are mods
+		self.writer = self._create_writer(is_moderator=(user.id == broadcaster.id))
+
 		#self._ts_print("Voltron bot is fully operational!")
 
+	def _create_writer(self, is_moderator):
+		return IRCWriterThread(self, is_moderator)
+
 	def message_received(self, display_name, user_id, is_vip, is_mod, is_broadcaster, message):
 		"""
 		Called whenever a PRIVMSG is received in twitch chat and successfully parsed
@@ -93,9 +270,9 @@ class IRCBase:
 			self.connect()
 			return
 
-		self.irc.send("PASS oauth:{oauth}\r\n".format(oauth=self.user.oauth_tokens.token(self.__fernet_key)).encode())
-		self.irc.send("NICK {nick}\r\n".format(nick=self.user.user_name).encode())
-		self.irc.send("CAP REQ :twitch.tv/tags twitch.tv/commands\r\n".encode())
+		self._send_raw("PASS oauth:{oauth}".format(oauth=self._oauth_token()))
+		self._send_raw("NICK {nick}".format(nick=self.user.user_name))
+		self._send_raw("CAP REQ :twitch.tv/tags twitch.tv/commands")
 
 		## Update the socket time as we just connected
 		self.socket_time = time.time()
@@ -110,6 +287,12 @@ class IRCBase:
 		self.reconnect_attempts = 0
 		self._ts_print("Connected!", ts=False)
 
+	def _oauth_token(self):
+		"""
+		Get the decrypted OAuth token for this account
+		"""
+		return self.user.oauth_tokens.token(self.__fernet_key)
+
 	def reconnect(self):
 		"""
 		Terminates the current socket connection to the Twitch IRC servers and calls connect()
@@ -121,6 +304,8 @@ class IRCBase:
 
 		self.irc = socket.socket()
 		self.irc.settimeout(1)
+		## Anything left over belongs to the old connection
+		self._recv_buffer.clear()
 
 		self.connect()
 		self.join_channels()
@@ -131,7 +316,7 @@ class IRCBase:
 		Joins the Twitch IRC channel of the broadcaster
 		"""
 		self._ts_print("Joining channel #{}...".format(self.broadcaster.user_name), newline=False)
-		self.irc.send("JOIN #{channel}\r\n".format(channel=self.broadcaster.user_name).encode())
+		self._send_raw("JOIN #{channel}".format(channel=self.broadcaster.user_name))
 		self.channel_map[self.broadcaster.user_name] = int(self.broadcaster.twitch_user_id)
 		self._ts_print('Joined!', ts=False)
 
@@ -144,13 +329,14 @@ class IRCBase:
 	def listen(self):
 		"""
 		Main loop. Listens for messages on the connected socket.
-		Calls _handle_response() when a message is received
+		Calls _handle_response() once for every complete line received
 		"""
 		while self.keep_listening:
 			try:
-				resp = self.irc.recv(2040)
-				if resp:
-					self._handle_response(resp.decode())
+				received = self.irc.recv_into(self._recv_chunk)
+				if received:
+					for line in self._read_lines(received):
+						self._handle_response(line)
 				else:
 					## Empty response means the connection is probably dead
 					## call reconnect() just to be sure
@@ -167,160 +353,185 @@ class IRCBase:
 					if not self.reconnecting:
 						self.reconnect()
 
-	def send_message(self, message, action=False):
+	def _read_lines(self, received):
+		"""
+		Add freshly received bytes to the receive buffer and return every
+		complete line in it. Incomplete data is kept for the next read.
+
+		Args:
+			received (int): Number of bytes written to self._recv_chunk
+		"""
+		buf = self._recv_buffer
+		buf += self._recv_view[:received]
+
+		lines = []
+		start = 0
+		while True:
+			end = buf.find(b'\r\n', start)
+			if end == -1:
+				break
+			if end > start:
+				## Lines are only decoded once complete so multi-byte
+				## characters can never be split
+				lines.append(buf[start:end].decode('utf-8', errors='replace'))
+			start = end + 2
+
+		## Drop everything we dispatched in a single operation
+		if start:
+			del buf[:start]
+
+		if len(buf) > MAX_LINE_LENGTH:
+			self._ts_print('Discarding oversized IRC line')
+			buf.clear()
+
+		return lines
+
+	def send_message(self, message, action=False, priority=PRIORITY_NORMAL):
 		"""
-		Sends a message in chat
+		Queues a message to be sent in chat. Messages are paced by the
+		writer thread so this never blocks the caller
 
 		Args:
 			message (string): The message to be sent
-			channel (string): The channel to send the message
 			action (bool): If True the message will be sent as an ACTION (/me)
+			priority (int): Lower values are sent first
 		"""
 
 		## Format message appropaitely if we are sending as an ACTION
 		if action:
 			message = '\001ACTION {message} \001'.format(message=message)
-		self.irc.send(f"PRIVMSG #{self.broadcaster.user_name} :{message}\r\n".encode())
+		self.writer.put(f"PRIVMSG #{self.broadcaster.user_name} :{message}", priority)
 
-	def _handle_response(self, resp):
-		## If Twitch pinged, respond with a pong and record a successful exchange
-		if re.search(r"^PING", resp):
-			#self._ts_print("PING RECV")
-			self._last_ping = time.time()
-			self._pong()
-			return True
+	def _send_raw(self, line):
+		"""
+		Write a single line to the socket immediately, bypassing the send queue.
+		Used for connection management (PASS, NICK, JOIN, PING, PONG)
 
-		## If we got a pong, log the time and move on
-		if re.search(r"^(:tmi\.twitch\.tv )?PONG", resp):
-			#self._ts_print("PONG RECV")
-			self._last_pong = time.time()
-			# Use default socket timeout since we know connection is alive
-			self.irc.settimeout(config.DEFAULT_SOCKET_TIMEOUT)
-			return True
-
-		## CHECK AND PARSE CHANNEL MESSAGES
-		privmsg_regex = (r'^@([^ ]+) :([^ ]+) PRIVMSG #([^ ]+) :([^\r\n]*)')
-		match = re.search(privmsg_regex, resp)
-		if match:
-			## Data containing badges, emote sets, etc
-			twitch_shit = match.group(1)
-			user_info = match.group(2)
-			channel = match.group(3)
-			message = match.group(4)
-
-			broadcaster_id = self.channel_map[channel]
-
-			## Parse the display_name out of twitch_shit
-			display_match = re.search(
-				r'display-name=([^; ]*)',
-				twitch_shit
-			)
-			display_name = display_match.group(1) if display_match else "Unknown"
+		Args:
+			line (string): IRC line without the trailing CRLF
+		"""
+		with self._send_lock:
+			self.irc.sendall(f"{line}\r\n".encode())
 
-			## Parse Twitch user ID out of twitch_shit
-			id_match = re.search(
-				r'user-id=([0-9]+)',
-				twitch_shit
-			)
-			user_id = id_match.group(1) if id_match else False
+	def _handle_response(self, resp):
+		"""
+		Parse a single IRC line and dispatch it on its command
 
-			## Determine if the sender was a mod
-			mod_match = re.search(
-				r'user-type=mod',
-				twitch_shit
-			)
-			is_mod = True if mod_match else False
+		Args:
+			resp (string): One complete line received from Twitch
+		"""
+		msg = parse_irc_message(resp)
+		if msg is None:
+			return False
 
-			is_vip = False
-			badge_match = re.search(
-				r'badges=([^;]+)',
-				twitch_shit
-			)
-			if badge_match:
-				badge_info = badge_match.group(1)
-				vip_match = re.search(
-					r'vip/\d+',
-					badge_info
-				)
-				if vip_match:
-					is_vip = True
-
-			## See if the sender is the same as the logged in broadcaster
-			is_broadcaster = int(broadcaster_id) == int(user_id)
-			if is_broadcaster:
-				is_mod = True
-
-			## See if the broadcaster or a mod sent !ping to check the status
-			## of the bot
-			test_match = re.search(r'^!ping', message)
-			if test_match and (is_broadcaster or is_mod):
-				t_str = self._format_seconds(time.time() - self.start_time)
-				s_str = self._format_seconds(time.time() - self.socket_time)
-				msg = f"VoltronBot {VERSION} has been alive for {t_str}"
-				self.send_message(msg, action=True)
-
-			## Remove bullshit ASCI characters that will piss off the database
-			escapes = ''.join([chr(char) for char in range(1, 32)])
-			table = {}
-			for char in range(1, 32):
-				table[chr(char)] = None
-			m = message.translate(table)
-
-			## Call message_received with all of the data that we parseed out
-			## out of the message
-			self.message_received(
-				display_name,
-				user_id,
-				is_vip,
-				is_mod,
-				is_broadcaster,
-				m
-			)
-			#return True
-
-		## Check for hosts
-		host_regex = r'^:[^ ]+ PRIVMSG [^ ]+ :([^ ]+) is now hosting you'
-		match = re.search(host_regex, resp)
-		if match:
-			display_name = match.group(1)
-			self.handle_host(display_name)
-			return True
-
-		usernotice_regex = (r'^@([^ ]+) :([^ ]+) USERNOTICE #([^ ]+)')
-		match = re.search(usernotice_regex, resp)
-		if match:
-			twitch_shit = match.group(1)
-			user_info = match.group(2)
-			channel = match.group(3)
-
-			if re.search(r'msg-id=raid', twitch_shit):
-				## Parse Twitch user ID out of twitch_shit
-				id_match = re.search(
-					r'user-id=(\d+)',
-					twitch_shit
-				)
-				user_id = int(id_match.group(1)) if id_match else False
-
-				display_name = "Unknown"
-				display_match = re.search(
-					r'display-name=([^; ]*)',
-					twitch_shit
-				)
-
-				if display_match:
-					display_name = display_match.group(1)
-
-				viewer_count_match = re.search('msg-param-viewerCount=(\d+)', twitch_shit)
-				viewer_count = 0
-				if viewer_count_match:
-					viewer_count = int(viewer_count_match.group(1))
-
-				self.handle_raid(display_name, user_id, viewer_count)
-				return True
+		handler = self._command_handlers.get(msg.command)
+		if handler:
+			return handler(msg)
 
 		## Otherwise log messages to a text file for now
 		#self._log(resp)
 
+	def _handle_ping(self, msg):
+		## If Twitch pinged, respond with a pong and record a successful exchange
+		#self._ts_print("PING RECV")
+		self._last_ping = time.time()
+		self._pong()
+		return True
+
+	def _handle_pong(self, msg):
+		## If we got a pong, log the time and move on
+		#self._ts_print("PONG RECV")
+		self._last_pong = time.time()
+		# Use default socket timeout since we know connection is alive
+		self.irc.settimeout(config.DEFAULT_SOCKET_TIMEOUT)
+		return True
+
+	def _handle_privmsg(self, msg):
+		message = msg.trailing
+
+		## Untagged PRIVMSGs come from the server itself. Check for hosts
+		if msg.tags is None:
+			display_name, _, rest = message.partition(' ')
+			if rest.startswith('is now hosting you'):
+				self.handle_host(display_name)
+				return True
+			return False
+
+		## Data containing badges, emote sets, etc
+		tags = msg.tags
+		broadcaster_id = self.channel_map[msg.channel]
+
+		display_name = tags.get('display-name', 'Unknown')
+		user_id = tags.get('user-id') or False
+
+		## Determine if the sender was a mod
+		is_mod = tags.get('user-type') == 'mod'
+
+		is_vip = False
+		for badge in tags.get('badges', '').split(','):
+			if badge.startswith('vip/'):
+				is_vip = True
+				break
+
+		## See if the sender is the same as the logged in broadcaster
+		is_broadcaster = int(broadcaster_id) == int(user_id)
+		if is_broadcaster:
+			is_mod = True
+
+		## See if the broadcaster or a mod sent !ping to check the status
+		## of the bot
+		if message.startswith('!ping') and (is_broadcaster or is_mod):
+			t_str = self._format_seconds(time.time() - self.start_time)
+			s_str = self._format_seconds(time.time() - self.socket_time)
+			reply = f"VoltronBot {VERSION} has been alive for {t_str}"
+			## Skip ahead of queued chat so the reply shows the bot is alive
+			self.send_message(reply, action=True, priority=PRIORITY_HIGH)
+
+		## Remove bullshit ASCI characters that will piss off the database
+		m = message.translate(CONTROL_CHAR_TABLE)
+
+		## Call message_received with all of the data that we parseed out
+		## out of the message
+		self.message_received(
+			display_name,
+			user_id,
+			is_vip,
+			is_mod,
+			is_broadcaster,
+			m
+		)
+		return True
+
+	def _handle_userstate(self, msg):
+		## Sent after joining and after each message we send. Use it to
+		## pick the correct rate limit for this account
+		tags = msg.tags
+		if not tags:
+			return False
+
+		is_moderator = tags.get('mod') == '1'
+		for badge in tags.get('badges', '').split(','):
+			if badge.startswith('broadcaster/'):
+				is_moderator = True
+				break
+		self.writer.set_moderator(is_moderator)
+		return True
+
+	def _handle_usernotice(self, msg):
+		tags = msg.tags
+		if not tags or tags.get('msg-id') != 'raid':
+			return False
+
+		user_id = tags.get('user-id', '')
+		user_id = int(user_id) if user_id.isdigit() else False
+		display_name = tags.get('display-name', 'Unknown')
+
+		viewer_count = tags.get('msg-param-viewerCount', '')
+		viewer_count = int(viewer_count) if viewer_count.isdigit() else 0
+
+		self.handle_raid(display_name, user_id, viewer_count)
+		return True
+
 	def handle_host(self, display_name):
 		pass
 
@@ -365,7 +576,7 @@ class IRCBase:
 		"""
 		Send PONG to Twitch
 		"""
-		self.irc.send("PONG :tmi.twitch.tv\r\n".encode())
+		self._send_raw("PONG :tmi.twitch.tv")
 		self._last_pong = time.time()
 		## Use default socket timeout since we know connection is alive
 		self.irc.settimeout(config.DEFAULT_SOCKET_TIMEOUT)
@@ -377,7 +588,7 @@ class IRCBase:
 		"""
 		## Theoretically we should never have to do this
 		## But twitch be twitchy
-		self.irc.send("PING :tmi.twitch.tv\r\n".encode())
+		self._send_raw("PING :tmi.twitch.tv")
 		#self._ts_print("PING SEND")
 		self._last_ping = time.time()
 
@@ -414,6 +625,9 @@ class IRCBase:
 		"""
 		self._ts_print("Shutting Down...", newline=False)
 		self.keep_listening = False
+		if self.writer.is_alive():
+			self.writer.stop()
+			self.writer.join()
 		self.irc.shutdown(socket.SHUT_RDWR)
 		self.irc.close()
 		self._ts_print("done", ts=False)
@@ -435,27 +649,364 @@ class IRCBase:
 
 		return formatted.strip()
 
-class BotIRC(threading.Thread, IRCBase):
-	def __init__(self, buffer_queue, user, broadcaster):
+class SlidingWindowLimiter:
+	"""
+	Allows at most limit sends in any period seconds. Send times are kept
+	so no window of that length can ever go over the limit, unlike a token
+	bucket which allows a full burst plus whatever refills behind it
+
+	Args:
+		limit (int): Maximum sends per window
+		period (float): Window length in seconds
+	"""
+	def __init__(self, limit, period):
+		self.limit = limit
+		self.period = period
+		self.sent = deque()
+
+	def set_rate(self, limit, period):
+		self.limit = limit
+		self.period = period
+
+	def consume(self):
+		"""
+		Record a send if one is allowed now
+
+		Returns:
+			float: 0 if the send was recorded, otherwise seconds until one is allowed
+		"""
+		now = time.monotonic()
+		while self.sent and self.sent[0] <= now - self.period:
+			self.sent.popleft()
+		if len(self.sent) < self.limit:
+			self.sent.append(now)
+			return 0
+		## Oldest sends that have to age out before there's room
+		return self.sent[len(self.sent) - self.limit] + self.period - now
+
+class IRCWriterBase:
+	"""
+	Owns all chat writes for a single IRC connection. Messages are queued
+	by priority, identical back-to-back messages are coalesced, and sends
+	are paced with a sliding window so the account stays under the Twitch limit
+
+	Args:
+		irc (IRCBase): The connection this writer sends on
+		is_moderator (bool): Use the moderator rate limit
+	"""
+	def __init__(self, irc, is_moderator=False):
+		self.irc = irc
+		self.is_moderator = is_moderator
+		self.limiter = SlidingWindowLimiter(*self._rate_limit())
+
+		self._counter = itertools.count()
+		self._last_queued = None
+		self._lock = threading.Lock()
+
+	def _rate_limit(self):
+		limit, period = RATE_LIMIT_MODERATOR if self.is_moderator else RATE_LIMIT_USER
+		return limit, period + RATE_LIMIT_MARGIN
+
+	def set_moderator(self, is_moderator):
+		if is_moderator == self.is_moderator:
+			return
+		self.is_moderator = is_moderator
+		self.limiter.set_rate(*self._rate_limit())
+
+	def put(self, line, priority=PRIORITY_NORMAL):
+		"""
+		Queue a line to be sent. Never blocks
+
+		Returns:
+			bool: False if the line was coalesced or dropped
+		"""
+		with self._lock:
+			## Drop exact duplicates of the message still waiting to be sent
+			if line == self._last_queued:
+				return False
+			try:
+				self._enqueue((priority, next(self._counter), line))
+			except queue.Full:
+				self.irc._ts_print('Send queue full. Dropping message')
+				return False
+			self._last_queued = line
+		return True
+
+	def _enqueue(self, item):
+		## Inherit and override. Raise queue.Full if there's no room
+		pass
+
+	def _dequeued(self, line):
+		with self._lock:
+			if line == self._last_queued:
+				self._last_queued = None
+
+class IRCWriterThread(IRCWriterBase, threading.Thread):
+	"""
+	Writer for the threaded connections. Lines are written from this thread
+	"""
+	def __init__(self, irc, is_moderator=False):
 		threading.Thread.__init__(self)
-		IRCBase.__init__(self, buffer_queue, user, broadcaster)
+		IRCWriterBase.__init__(self, irc, is_moderator)
+		self.daemon = True
+
+		self.queue = queue.PriorityQueue(maxsize=SEND_QUEUE_SIZE)
+		self._keep_sending = True
+
+	def _enqueue(self, item):
+		self.queue.put_nowait(item)
+
+	def stop(self):
+		self._keep_sending = False
+		## Wake the thread up. If the queue is full it isn't waiting anyway
+		try:
+			self.queue.put_nowait((-1, -1, None))
+		except queue.Full:
+			pass
 
 	def run(self):
-		self.connect()
-		self.join_channels()
-		self.listen()
+		while self._keep_sending:
+			priority, count, line = self.queue.get()
+			if line is None:
+				break
 
-class BroadcasterIRC(threading.Thread, IRCBase):
-	def __init__(self, event_queue, buffer_queue, user, broadcaster):
-		threading.Thread.__init__(self)
+			self._dequeued(line)
+
+			## Wait for room in the window. Sleep in short steps so shutdown
+			## isn't held up
+			wait = self.limiter.consume()
+			while wait and self._keep_sending:
+				time.sleep(min(wait, 1))
+				wait = self.limiter.consume()
+
+			## Hold messages while the connection is being re-established
+			while self.irc.reconnecting and self._keep_sending:
+				time.sleep(0.5)
+
+			if not self._keep_sending:
+				break
+
+			try:
+				self.irc._send_raw(line)
+			except (socket.error, OSError) as e:
+				self.irc._ts_print(f'Failed to send message: {e}')
+
+class AsyncIRCWriter(IRCWriterBase):
+	"""
+	Writer for AsyncIRC. Runs as a task on the connection's event loop so
+	every write happens on the loop. Messages queued while disconnected wait
+	for the connection to come back
+
+	Args:
+		irc (AsyncIRC): The connection this writer sends on
+		is_moderator (bool): Use the moderator rate limit
+	"""
+	def __init__(self, irc, is_moderator=False):
+		IRCWriterBase.__init__(self, irc, is_moderator)
+		self.loop = irc.loop
+		## Only touched from the loop. _size tracks it for other threads
+		self.queue = asyncio.PriorityQueue()
+		self._size = 0
+		self._future = None
+
+	def _enqueue(self, item):
+		if self._size >= SEND_QUEUE_SIZE:
+			raise queue.Full
+		self._size += 1
+		self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+	def start(self):
+		self._future = asyncio.run_coroutine_threadsafe(self._run(), self.loop)
+
+	def stop(self):
+		if self._future:
+			self._future.cancel()
+
+	def is_alive(self):
+		return self._future is not None and not self._future.done()
+
+	async def _run(self):
+		while True:
+			priority, count, line = await self.queue.get()
+			with self._lock:
+				self._size -= 1
+			self._dequeued(line)
+
+			## Nothing can change between the last check and the write
+			## since both happen on the loop
+			while True:
+				await self.irc.connected.wait()
+				wait = self.limiter.consume()
+				if not wait:
+					break
+				await asyncio.sleep(wait)
+
+			self.irc._write(f"{line}\r\n".encode())
+
+class AsyncIRC(IRCBase):
+	"""
+	IRCBase running as a coroutine on a shared asyncio event loop instead
+	of in its own thread. Exposes the same start()/join()/is_alive()
+	interface as the threaded classes.
+
+	Args:
+		loop (asyncio.AbstractEventLoop): Running event loop to schedule on
+	"""
+	def __init__(self, buffer_queue, user, broadcaster, loop):
+		## Needed by the writer IRCBase creates
+		self.loop = loop
 		IRCBase.__init__(self, buffer_queue, user, broadcaster)
-		self.event_queue = event_queue
+		## The blocking socket created by IRCBase is never used
+		self.irc.close()
+		self.irc = None
+
+		self._future = None
+		self._reader = None
+		self._stream_writer = None
+		## Set while logged in. Chat messages wait on it
+		self.connected = asyncio.Event()
+
+	def _create_writer(self, is_moderator):
+		## Chat messages are written from the loop too
+		return AsyncIRCWriter(self, is_moderator)
+
+	def start(self):
+		self.writer.start()
+		self._future = asyncio.run_coroutine_threadsafe(self._run(), self.loop)
+
+	def join(self, timeout=None):
+		if not self._future:
+			return
+		try:
+			self._future.result(timeout)
+		except (concurrent.futures.CancelledError, concurrent.futures.TimeoutError):
+			pass
+
+	def is_alive(self):
+		return self._future is not None and not self._future.done()
+
+	async def _run(self):
+		"""
+		Connect, listen, and reconnect with exponential backoff until disconnect() is called
+		"""
+		attempts = 0
+		while self.keep_listening:
+			try:
+				await self._open()
+				attempts = 0
+				self.reconnecting = False
+				await self._read_lines_async()
+			except (OSError, EOFError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+				self._ts_print(f"Connection lost: {e}")
+			except Exception as e:
+				## A handler or the token refresh failed. Start over on a
+				## fresh connection rather than silently stopping
+				self._ts_print(f"IRC error: {type(e).__name__}: {e}")
+			finally:
+				self._close_stream()
+
+			if not self.keep_listening:
+				break
+
+			self.reconnecting = True
+			attempts += 1
+			delay = min(RECONNECT_BACKOFF_BASE * 2 ** (attempts - 1), RECONNECT_BACKOFF_MAX)
+			self._ts_print(f"Reconnecting in {delay} seconds (Attempt {attempts})")
+			await asyncio.sleep(delay)
+
+	async def _open(self):
+		self._ts_print("Connecting...", newline=False)
+		self._reader, self._stream_writer = await asyncio.open_connection(
+			'irc.chat.twitch.tv',
+			6667,
+			limit=MAX_LINE_LENGTH
+		)
+
+		## token() may hit the network, keep it off the loop
+		token = await self.loop.run_in_executor(None, self._oauth_token)
+		self._send_raw(f"PASS oauth:{token}")
+		self._send_raw(f"NICK {self.user.user_name}")
+		self._send_raw("CAP REQ :twitch.tv/tags twitch.tv/commands")
+
+		self.socket_time = time.time()
+		self._last_ping = 0
+		self._last_pong = 0
+		self._ts_print("Connected!", ts=False)
 
-	def run(self):
-		self.connect()
 		self.join_channels()
-		self.listen()
+		self.connected.set()
 
+	async def _read_lines_async(self):
+		reader = self._reader
+		while self.keep_listening:
+			try:
+				line = await asyncio.wait_for(reader.readuntil(b'\r\n'), PING_INTERVAL)
+			except asyncio.TimeoutError:
+				## Nothing received for a while. Make sure Twitch is still there
+				self._ping()
+				try:
+					line = await asyncio.wait_for(reader.readuntil(b'\r\n'), PONG_TIMEOUT)
+				except asyncio.TimeoutError:
+					raise EOFError("Ping timed out")
+
+			self._handle_response(line[:-2].decode('utf-8', errors='replace'))
+
+	def _send_raw(self, line):
+		## StreamWriter is not thread safe. Always write from the loop
+		data = f"{line}\r\n".encode()
+		if self._on_loop():
+			self._write(data)
+		else:
+			self.loop.call_soon_threadsafe(self._write, data)
+
+	def _on_loop(self):
+		try:
+			return asyncio.get_running_loop() is self.loop
+		except RuntimeError:
+			return False
+
+	def _write(self, data):
+		if self._stream_writer is not None and not self._stream_writer.is_closing():
+			self._stream_writer.write(data)
+		else:
+			## Chat messages wait for the connection in the writer so only
+			## connection management lines end up here. They're meaningless
+			## on the next connection
+			command = data.split(b' ', 1)[0].decode(errors='replace')
+			self._ts_print(f"Not connected. Dropped {command}")
+
+	def _close_stream(self):
+		self.connected.clear()
+		if self._stream_writer is not None:
+			self._stream_writer.close()
+		self._stream_writer = None
+		self._reader = None
+
+	def _handle_pong(self, msg):
+		self._last_pong = time.time()
+		return True
+
+	def _pong(self):
+		self._send_raw("PONG :tmi.twitch.tv")
+		self._last_pong = time.time()
+
+	def reconnect(self):
+		## Closing the stream ends the read loop and _run() reconnects
+		self.loop.call_soon_threadsafe(self._close_stream)
+
+	def disconnect(self):
+		self._ts_print("Shutting Down...", newline=False)
+		self.keep_listening = False
+		self.writer.stop()
+		if self._future:
+			self._future.cancel()
+		self._ts_print("done", ts=False)
+
+class BroadcasterEvents:
+	"""
+	Mixin for the broadcaster connection. Turns chat, hosts and raids into
+	events on the event queue
+	"""
 	def handle_host(self, display_name):
 		event = HostEvent(display_name)
 		self.event_queue.put(event)
@@ -465,10 +1016,9 @@ class BroadcasterIRC(threading.Thread, IRCBase):
 		self.event_queue.put(event)
 
 	def message_received(self, display_name, user_id, is_vip, is_mod, is_broadcaster, message):
-		match = re.search(r'^!([^ ]+)(.*)', message)
-		if match:
-			command = match.group(1)
-			args = match.group(2).strip()
+		if len(message) > 1 and message[0] == '!' and message[1] != ' ':
+			command, _, args = message[1:].partition(' ')
+			args = args.strip()
 			event = ChatCommandEvent(
 				command,
 				args,
@@ -489,3 +1039,34 @@ class BroadcasterIRC(threading.Thread, IRCBase):
 		)
 		self.event_queue.put(message_event)
 		#self._ts_print("{name}: {msg}".format(name=display_name, msg=message))
+
+class BotIRC(threading.Thread, IRCBase):
+	def __init__(self, buffer_queue, user, broadcaster):
+		threading.Thread.__init__(self)
+		IRCBase.__init__(self, buffer_queue, user, broadcaster)
+
+	def run(self):
+		self.writer.start()
+		self.connect()
+		self.join_channels()
+		self.listen()
+
+class BroadcasterIRC(BroadcasterEvents, threading.Thread, IRCBase):
+	def __init__(self, event_queue, buffer_queue, user, broadcaster):
+		threading.Thread.__init__(self)
+		IRCBase.__init__(self, buffer_queue, user, broadcaster)
+		self.event_queue = event_queue
+
+	def run(self):
+		self.writer.start()
+		self.connect()
+		self.join_channels()
+		self.listen()
+
+class AsyncBotIRC(AsyncIRC):
+	pass
+
+class AsyncBroadcasterIRC(BroadcasterEvents, AsyncIRC):
+	def __init__(self, event_queue, buffer_queue, user, broadcaster, loop):
+		AsyncIRC.__init__(self, buffer_queue, user, broadcaster, loop)
+		self.event_queue = event_queue
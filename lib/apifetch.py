@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from lib.http_session import TimeoutSession
+
+## Seconds to wait for a connection / for a response from an {api} URL
+API_CONNECT_TIMEOUT = 3
+API_READ_TIMEOUT = 5
+## Most bytes of a response that are read. Chat messages are short anyway
+API_MAX_BYTES = 65536
+## URLs whose last response is remembered
+API_CACHE_SIZE = 256
+
+class ApiFetcher:
+	"""
+	Fetches URLs for the {api:...} chat variable.
+
+	Each URL can have a TTL during which its last response is reused
+	without a request. URLs default to a TTL of 0 since many return
+	something different every time, like a random quote. Once the TTL is
+	up, responses with an ETag or Last-Modified header are revalidated
+	with a conditional request. If a request fails the last good response
+	is used.
+	"""
+	def __init__(self):
+		## url -> seconds to reuse the last response
+		self._ttls = {}
+		## url -> dict with body, etag, last_modified, fetched
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+		self.hits = 0
+		self.revalidated = 0
+		self.misses = 0
+		self.errors = 0
+
+		## Separate from the Twitch session: user URLs shouldn't be retried
+		## since that would stretch the hard timeout
+		self.session = TimeoutSession()
+		adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=0)
+		self.session.mount('https://', adapter)
+		self.session.mount('http://', adapter)
+
+	def set_ttl(self, url, ttl):
+		with self._lock:
+			if ttl:
+				self._ttls[url] = ttl
+			else:
+				self._ttls.pop(url, None)
+
+	def set_ttls(self, ttls):
+		with self._lock:
+			self._ttls = dict(ttls)
+
+	def get_ttls(self):
+		with self._lock:
+			return dict(self._ttls)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def fetch(self, url, headers=None):
+		"""
+		Get the body of url as text. Returns an empty string if the request
+		fails and there's no earlier response to fall back on
+
+		Args:
+			url (string): URL to fetch
+			headers (dict): Extra request headers
+		"""
+		headers = dict(headers or {})
+		with self._lock:
+			entry = self._entries.get(url)
+			if entry is not None:
+				self._entries.move_to_end(url)
+				if time.monotonic() - entry['fetched'] < self._ttls.get(url, 0):
+					self.hits += 1
+					return entry['body']
+				if entry['etag']:
+					headers['If-None-Match'] = entry['etag']
+				if entry['last_modified']:
+					headers['If-Modified-Since'] = entry['last_modified']
+
+		try:
+			req = self.session.get(
+				url,
+				headers = headers,
+				timeout = (API_CONNECT_TIMEOUT, API_READ_TIMEOUT),
+				stream = True
+			)
+			try:
+				if req.status_code == 304 and entry is not None:
+					body = entry['body']
+				else:
+					body = self._read_body(req)
+			finally:
+				req.close()
+		except requests.exceptions.RequestException:
+			with self._lock:
+				self.errors += 1
+			if entry is not None:
+				return entry['body']
+			return ""
+
+		with self._lock:
+			if req.status_code == 304 and entry is not None:
+				self.revalidated += 1
+				entry['fetched'] = time.monotonic()
+				return body
+
+			self.misses += 1
+			if req.status_code == 200:
+				self._entries[url] = {
+					'body': body,
+					'etag': req.headers.get('ETag'),
+					'last_modified': req.headers.get('Last-Modified'),
+					'fetched': time.monotonic()
+				}
+				self._entries.move_to_end(url)
+				while len(self._entries) > API_CACHE_SIZE:
+					self._entries.popitem(last=False)
+
+		return body
+
+	def _read_body(self, req):
+		"""
+		Read at most API_MAX_BYTES of the response and decode it
+		"""
+		content = bytearray()
+		for chunk in req.iter_content(8192):
+			content += chunk
+			if len(content) >= API_MAX_BYTES:
+				del content[API_MAX_BYTES:]
+				break
+
+		return content.decode(req.encoding or 'utf-8', errors='replace')
+
+	def stats(self):
+		with self._lock:
+			return {
+				'entries': len(self._entries),
+				'hits': self.hits,
+				'revalidated': self.revalidated,
+				'misses': self.misses,
+				'errors': self.errors
+			}
+
+## Shared by every ChatMessageParser
+api_fetcher = ApiFetcher()
@@ -0,0 +1,126 @@
+import os
+import threading
+from collections import OrderedDict
+
+import audio2numpy
+
+import config
+from lib.audiodsp import to_float32, conform_audio, normalize_loudness
+
+## Default memory for decoded audio in megabytes
+DEFAULT_AUDIO_CACHE_SIZE_MB = 128
+
+class AudioCache:
+	"""
+	LRU cache of decoded audio so popular sounds aren't decoded every time
+	they play. Buffers are stored as float32 keyed by path and modification
+	time, and the cache is bounded by the memory the buffers use rather
+	than their number. Buffers can be converted to an output device's
+	format when they are decoded so nothing has to be converted when they
+	play. Volume is applied by the mixer so one buffer serves every volume.
+
+	Args:
+		max_bytes (int): Memory to use for decoded audio
+	"""
+	def __init__(self, max_bytes=None):
+		if max_bytes is None:
+			size_mb = DEFAULT_AUDIO_CACHE_SIZE_MB
+			if hasattr(config, 'AUDIO_CACHE_SIZE_MB'):
+				size_mb = config.AUDIO_CACHE_SIZE_MB
+			max_bytes = size_mb * 1024 * 1024
+		self.max_bytes = max_bytes
+
+		self.normalize = False
+		if hasattr(config, 'AUDIO_NORMALIZE_LOUDNESS'):
+			self.normalize = config.AUDIO_NORMALIZE_LOUDNESS
+
+		## (path, mtime, samplerate, channels) -> (data, fs)
+		self._entries = OrderedDict()
+		self._bytes = 0
+		self._lock = threading.Lock()
+
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, path, samplerate=None, channels=None):
+		"""
+		Get (data, sample rate) for path, decoding it on a miss
+
+		Args:
+			path (string): Audio file
+			samplerate (int): Convert to this sample rate if set
+			channels (int): Convert to this many channels if set
+
+		Raises:
+			AudioFormatError if the file can't be decoded
+			OSError if the file can't be read
+		"""
+		key = (path, os.path.getmtime(path), samplerate, channels)
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return entry
+			self.misses += 1
+
+		data, fs = audio2numpy.open_audio(path)
+		if samplerate is not None and channels is not None:
+			data = conform_audio(data, fs, samplerate, channels)
+			fs = samplerate
+		else:
+			data = to_float32(data)
+		if self.normalize:
+			if not data.flags.writeable:
+				data = data.copy()
+			normalize_loudness(data)
+
+		entry = (data, fs)
+		self._store(key, entry)
+		return entry
+
+	def prewarm(self, path, samplerate=None, channels=None):
+		"""
+		Decode path into the cache ahead of time. Errors are ignored since
+		they'll be reported when the sound is played
+		"""
+		try:
+			self.get(path, samplerate, channels)
+		except Exception:
+			pass
+
+	def _store(self, key, entry):
+		size = entry[0].nbytes
+		if size > self.max_bytes:
+			return
+
+		with self._lock:
+			if key in self._entries:
+				return
+			## Older versions of this file won't be asked for again
+			for old_key in [k for k in self._entries if k[0] == key[0] and k[1] != key[1]]:
+				self._bytes -= self._entries.pop(old_key)[0].nbytes
+
+			self._entries[key] = entry
+			self._bytes += size
+			while self._bytes > self.max_bytes:
+				old_key, old_entry = self._entries.popitem(last=False)
+				self._bytes -= old_entry[0].nbytes
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._bytes = 0
+
+	def stats(self):
+		with self._lock:
+			return {
+				'entries': len(self._entries),
+				'bytes': self._bytes,
+				'max_bytes': self.max_bytes,
+				'hits': self.hits,
+				'misses': self.misses
+			}
+
+## Shared by the media thread and the admin UI
+audio_cache = AudioCache()
@@ -0,0 +1,81 @@
+from math import sqrt
+
+import numpy
+
+## Loudness sounds are normalized to when AUDIO_NORMALIZE_LOUDNESS is on
+DEFAULT_TARGET_DBFS = -20
+
+def _volume_curve(volume):
+	factor = volume / 100
+	return pow(2, (sqrt(sqrt(sqrt(factor))) * 192 - 192)/6)
+
+## Amplitude multiplier for each volume from 0 to 100%
+GAIN_TABLE = tuple(_volume_curve(v) for v in range(101))
+
+def volume_gain(volume):
+	"""
+	Get the amplitude multiplier for a volume in %. Volumes that aren't
+	ints play at full volume
+	"""
+	if type(volume) != int:
+		return 1.0
+	if 0 <= volume <= 100:
+		return GAIN_TABLE[volume]
+	return _volume_curve(volume)
+
+def to_float32(data):
+	"""
+	Convert decoded audio to float32 in the range -1 to 1. Integer PCM is
+	scaled by its type's range rather than just cast
+	"""
+	data = numpy.asarray(data)
+	if data.dtype.kind == 'i':
+		scale = numpy.float32(1 / -numpy.iinfo(data.dtype).min)
+		return data.astype(numpy.float32) * scale
+	if data.dtype.kind == 'u':
+		info = numpy.iinfo(data.dtype)
+		mid = (info.max + 1) / 2
+		return (data.astype(numpy.float32) - numpy.float32(mid)) * numpy.float32(1 / mid)
+	return data.astype(numpy.float32, copy=False)
+
+def conform_audio(data, fs, samplerate, channels):
+	"""
+	Convert decoded audio to a float32 frames x channels array at
+	samplerate so it can be mixed straight into an output stream
+	"""
+	data = to_float32(data)
+	if data.ndim == 1:
+		data = data[:, None]
+
+	if data.shape[1] != channels:
+		if channels == 1:
+			data = data.mean(axis=1, keepdims=True)
+		else:
+			## Duplicate mono to every channel or drop the extra channels
+			data = numpy.resize(data[:, :channels].T, (channels, len(data))).T
+
+	if fs != samplerate and len(data):
+		## Linear interpolation is plenty for alert sounds
+		frames = int(round(len(data) * samplerate / fs))
+		src = numpy.arange(len(data), dtype=numpy.float64)
+		dest = numpy.linspace(0, len(data) - 1, frames)
+		data = numpy.stack([numpy.interp(dest, src, data[:, c]) for c in range(channels)], axis=1)
+
+	return numpy.ascontiguousarray(data, dtype=numpy.float32)
+
+def normalize_loudness(data, target_dbfs=DEFAULT_TARGET_DBFS):
+	"""
+	Scale float32 audio in place so its RMS level is target_dbfs, without
+	letting peaks clip
+	"""
+	if not data.size:
+		return data
+
+	rms = float(numpy.sqrt(numpy.mean(numpy.square(data, dtype=numpy.float64))))
+	peak = float(numpy.max(numpy.abs(data)))
+	if rms == 0 or peak == 0:
+		return data
+
+	gain = min(pow(10, target_dbfs / 20) / rms, 1 / peak)
+	data *= numpy.float32(gain)
+	return data
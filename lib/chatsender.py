@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from lib.ChatMessageParser import ChatMessageParser
+from lib.TwitchIRC import PRIORITY_NORMAL
+
+## Threads rendering templated messages
+DEFAULT_SEND_WORKERS = 4
+## Messages waiting per account before the overload policy kicks in
+DEFAULT_SEND_QUEUE_LIMIT = 50
+## 'drop_oldest' or 'drop_newest'
+DEFAULT_SEND_OVERLOAD_POLICY = 'drop_oldest'
+
+class _SendJob:
+	__slots__ = ('message', 'event', 'parser', 'twitch_id', 'priority', 'queued', 'result', 'done', 'dropped')
+
+	def __init__(self, message, event, parser, twitch_id, priority):
+		self.message = message
+		self.event = event
+		self.parser = parser
+		self.twitch_id = twitch_id
+		self.priority = priority
+		self.queued = time.monotonic()
+		self.result = None
+		self.done = False
+		self.dropped = False
+
+class ChatSendQueue:
+	"""
+	Renders templated chat messages on a bounded pool of threads and sends
+	them in the order they were queued.
+
+	Messages for the same account render concurrently but are delivered in
+	order. When too many are waiting the overload policy drops either the
+	oldest or the newest message, and a message identical to one already
+	waiting is merged into it.
+
+	Args:
+		voltron (VoltronBot): Bot used to send the rendered messages
+		buffer_queue (Queue): Queue for UI output
+	"""
+	def __init__(self, voltron, buffer_queue):
+		self.voltron = voltron
+		self.buffer_queue = buffer_queue
+
+		workers = DEFAULT_SEND_WORKERS
+		if hasattr(config, 'CHAT_SEND_WORKERS'):
+			workers = config.CHAT_SEND_WORKERS
+		self.queue_limit = DEFAULT_SEND_QUEUE_LIMIT
+		if hasattr(config, 'CHAT_SEND_QUEUE_LIMIT'):
+			self.queue_limit = config.CHAT_SEND_QUEUE_LIMIT
+		self.overload_policy = DEFAULT_SEND_OVERLOAD_POLICY
+		if hasattr(config, 'CHAT_SEND_OVERLOAD_POLICY'):
+			self.overload_policy = config.CHAT_SEND_OVERLOAD_POLICY
+
+		self._executor = ThreadPoolExecutor(
+			max_workers = workers,
+			thread_name_prefix = 'chatsend'
+		)
+		## twitch_id -> deque of _SendJob in the order they were queued
+		self._channels = {}
+		self._lock = threading.Lock()
+
+		self.sent = 0
+		self.dropped = 0
+		self.merged = 0
+		self.failed = 0
+		self._wait_total = 0
+		self.max_wait = 0
+		self._rendered = 0
+
+	def send(self, message, twitch_id=None, event=None, priority=PRIORITY_NORMAL):
+		"""
+		Queue message to be rendered and sent. Never blocks on rendering
+
+		Args:
+			message (string): Message, possibly with {variables}
+			twitch_id (int): Account to send as. Default account if None
+			event (Event): Event used to fill in variables
+			priority (int): Priority on the IRC send queue. Lower values are
+				sent first
+		"""
+		parser = ChatMessageParser(message, event)
+		if not parser.has_vars():
+			parser = None
+
+		job = _SendJob(message, event, parser, twitch_id, priority)
+		with self._lock:
+			pending = self._channels.setdefault(twitch_id, deque())
+
+			for other in pending:
+				if not other.dropped and other.message == message and other.event is event:
+					self.merged += 1
+					return
+
+			waiting = [j for j in pending if not j.dropped]
+			if len(waiting) >= self.queue_limit:
+				self.dropped += 1
+				if self.overload_policy == 'drop_newest':
+					return
+				waiting[0].dropped = True
+
+			pending.append(job)
+
+			if parser is None:
+				job.result = message
+				job.done = True
+
+		if parser is not None:
+			try:
+				self._executor.submit(self._render, job)
+				return
+			except RuntimeError as e:
+				## Don't leave the job blocking the messages queued after it
+				job.done = True
+				with self._lock:
+					self.failed += 1
+				self.buffer_queue.put(('ERR', f'Failed to build chat message: {e}'))
+
+		self._deliver(twitch_id)
+
+	def _render(self, job):
+		wait = time.monotonic() - job.queued
+		with self._lock:
+			self._wait_total += wait
+			self._rendered += 1
+			if wait > self.max_wait:
+				self.max_wait = wait
+
+		if not job.dropped:
+			try:
+				job.result = job.parser.parse()
+			except Exception as e:
+				with self._lock:
+					self.failed += 1
+				self.buffer_queue.put(('ERR', f'Failed to build chat message: {e}'))
+
+		job.done = True
+		self._deliver(job.twitch_id)
+
+	def _deliver(self, twitch_id):
+		## Sending only queues the message on the IRC writer so it's fine to
+		## hold the lock, and holding it keeps delivery in order
+		with self._lock:
+			pending = self._channels[twitch_id]
+			while pending and (pending[0].done or pending[0].dropped):
+				job = pending.popleft()
+				if job.dropped or job.result is None:
+					continue
+				try:
+					self.voltron.send_chat_message(job.result, job.twitch_id, job.priority)
+					self.sent += 1
+				except Exception as e:
+					self.failed += 1
+					self.buffer_queue.put(('ERR', f'Failed to send chat message: {e}'))
+
+	def stats(self):
+		with self._lock:
+			avg_wait = self._wait_total / self._rendered if self._rendered else 0
+			return {
+				'queued': sum(len(p) for p in self._channels.values()),
+				'sent': self.sent,
+				'dropped': self.dropped,
+				'merged': self.merged,
+				'failed': self.failed,
+				'avg_wait': avg_wait,
+				'max_wait': self.max_wait
+			}
+
+	def shutdown(self):
+		self._executor.shutdown(wait=False)
@@ -1,5 +1,7 @@
 import config
 import sqlite3
+import threading
+import weakref
 
 from datetime import datetime, timedelta
 from cryptography.fernet import Fernet
@@ -10,6 +12,7 @@ import requests
 import json
 
 from lib.TwitchAPIHelper import TwitchAPIHelper
+from lib.http_session import get_session
 
 def debug(message):
 	"""
@@ -42,55 +45,157 @@ def get_module_data_directory(module = None):
 
 	return data_dir
 
-def get_db():
+class PooledConnection(sqlite3.Connection):
 	"""
-	Get a connection and cursor to the SQLite database and return in a tuple
+	SQLite connection that is cached per thread and reused by get_db().
+	close() only discards uncommitted changes so existing callers that
+	commit and close after every query keep working
 	"""
-	con = sqlite3.connect(config.DB)
+	def close(self):
+		if self.in_transaction:
+			self.rollback()
+
+	def close_connection(self):
+		sqlite3.Connection.close(self)
+
+## Each thread gets its own connection since sqlite3 connections
+## can't be shared between threads
+_db_local = threading.local()
+_wal_enabled = False
+_wal_lock = threading.Lock()
+
+def _connect():
+	global _wal_enabled
+
+	con = sqlite3.connect(
+		config.DB,
+		timeout = 10,
+		cached_statements = 256,
+		factory = PooledConnection
+	)
 	con.row_factory = _dict_factory
+
+	## WAL lets readers and a writer work at the same time instead of
+	## failing with 'database is locked'. The mode is stored in the DB file
+	## so it only has to be set once
+	with _wal_lock:
+		if not _wal_enabled:
+			con.execute('PRAGMA journal_mode=WAL')
+			_wal_enabled = True
+	## Safe with WAL and avoids an fsync on every commit
+	con.execute('PRAGMA synchronous=NORMAL')
+
+	return con
+
+def get_db():
+	"""
+	Get a connection and cursor to the SQLite database and return in a tuple.
+	The connection is reused by every call from the same thread
+	"""
+	con = getattr(_db_local, 'con', None)
+	if con is None:
+		con = _connect()
+		_db_local.con = con
 	cur = con.cursor()
 
 	return (con, cur)
 
-def get_broadcaster():
+def close_db():
 	"""
-	Get a User object for the broadcaster, if one exists
+	Close the current thread's cached connection, if any
 	"""
-	con, cur = get_db()
+	con = getattr(_db_local, 'con', None)
+	if con is not None:
+		con.close_connection()
+		_db_local.con = None
+
+## Process wide cache of User objects. Sharing one User (and so one
+## OauthTokens) per account means token validation state is shared and
+## hot paths don't rebuild users from the DB
+_user_cache = {}
+## twitch_user_id (as a string) -> oauth.id
+_twitch_id_cache = {}
+## 'broadcaster' / 'default' -> oauth.id, or None if there isn't one
+_role_cache = {}
+_user_cache_lock = threading.RLock()
+
+def get_user(user_id):
+	"""
+	Get the shared User object for oauth.id user_id
 
-	sql = "SELECT id FROM oauth WHERE is_broadcaster = 1"
-	cur.execute(sql)
-	res = cur.fetchone()
+	Args:
+		user_id (int): id in the oauth table in the database
+	"""
+	with _user_cache_lock:
+		user = _user_cache.get(user_id)
+		if user is None:
+			user = User(user_id)
+			_user_cache[user_id] = user
+			_twitch_id_cache[str(user.twitch_user_id)] = user_id
+		return user
+
+def invalidate_user_cache(user_id=None):
+	"""
+	Drop cached users so they are reloaded from the DB on next use
 
-	con.commit()
-	con.close()
+	Args:
+		user_id (int): Only drop this user. Drop everything if None
+	"""
+	with _user_cache_lock:
+		_role_cache.clear()
+		if user_id is None:
+			_user_cache.clear()
+			_twitch_id_cache.clear()
+			return
+
+		user = _user_cache.pop(user_id, None)
+		if user is not None:
+			_twitch_id_cache.pop(str(user.twitch_user_id), None)
+
+def _get_role_user_id(role, sql):
+	with _user_cache_lock:
+		if role not in _role_cache:
+			con, cur = get_db()
+
+			cur.execute(sql)
+			res = cur.fetchone()
+
+			con.commit()
+			con.close()
+
+			_role_cache[role] = res['id'] if res else None
+		return _role_cache[role]
 
-	if not res:
+def get_broadcaster():
+	"""
+	Get a User object for the broadcaster, if one exists
+	"""
+	user_id = _get_role_user_id('broadcaster', "SELECT id FROM oauth WHERE is_broadcaster = 1")
+
+	if user_id is None:
 		debug("No broadcaster exists")
 		return None
 
-	return User(res['id'])
+	return get_user(user_id)
 
 def get_default_user():
 	"""
 	Get a User object for the default account, if one exists
 	"""
-	con, cur = get_db()
-
-	sql = "SELECT id FROM oauth WHERE is_default = 1"
-	cur.execute(sql)
-	res = cur.fetchone()
+	user_id = _get_role_user_id('default', "SELECT id FROM oauth WHERE is_default = 1")
 
-	con.commit()
-	con.close()
-
-	if not res:
+	if user_id is None:
 		debug("No default exists")
 		return get_broadcaster()
 
-	return User(res['id'])
+	return get_user(user_id)
 
 def get_user_by_twitch_id(twitch_id):
+	with _user_cache_lock:
+		user_id = _twitch_id_cache.get(str(twitch_id))
+	if user_id is not None:
+		return get_user(user_id)
+
 	con, cur = get_db()
 
 	sql = "SELECT id FROM oauth WHERE twitch_user_id = ?"
@@ -101,7 +206,7 @@ def get_user_by_twitch_id(twitch_id):
 	con.close()
 
 	if res:
-		return User(res['id'])
+		return get_user(res['id'])
 	else:
 		return None
 
@@ -116,17 +221,81 @@ def get_all_acccounts():
 	cur.execute(sql)
 	res = cur.fetchall()
 
-	for r in res:
-		users.append(User(r['id']))
-
 	con.commit()
 	con.close()
 
+	for r in res:
+		users.append(get_user(r['id']))
+
 	return users
 
+## How often the refresher checks tokens when nothing wakes it
+TOKEN_CHECK_INTERVAL = 60
+## Validate tokens with Twitch this often
+TOKEN_VALIDATE_INTERVAL = 600 # 10 minutes
+## Refresh tokens this long before they expire
+TOKEN_REFRESH_MARGIN = 1800 # 30 minutes
+## Wait this long before trying again after a failed validate/refresh
+TOKEN_RETRY_INTERVAL = 30
+
+class TokenRefresher(threading.Thread):
+	"""
+	Background thread that validates and refreshes OauthTokens before they
+	expire so OauthTokens.token() never waits on Twitch
+	"""
+	def __init__(self):
+		threading.Thread.__init__(self)
+		self.daemon = True
+
+		self._tokens = weakref.WeakSet()
+		self._lock = threading.Lock()
+		self._wakeup = threading.Event()
+
+	def add(self, oauth_tokens):
+		with self._lock:
+			self._tokens.add(oauth_tokens)
+		self._wakeup.set()
+
+	def poke(self):
+		"""
+		Check all tokens now instead of waiting for the next interval
+		"""
+		self._wakeup.set()
+
+	def run(self):
+		while True:
+			self._wakeup.wait(TOKEN_CHECK_INTERVAL)
+			self._wakeup.clear()
+
+			with self._lock:
+				tokens = list(self._tokens)
+			for oauth_tokens in tokens:
+				try:
+					oauth_tokens.maintain()
+				except Exception as e:
+					debug(f'Token refresh failed: {e}')
+
+_token_refresher = None
+_token_refresher_lock = threading.Lock()
+
+def get_token_refresher():
+	"""
+	Get the shared TokenRefresher, starting it on first use
+	"""
+	global _token_refresher
+	with _token_refresher_lock:
+		if _token_refresher is None:
+			_token_refresher = TokenRefresher()
+			_token_refresher.start()
+		return _token_refresher
+
 class OauthTokens:
 	"""
 	Class to store, manage, and refresh OAuth tokens
+
+	The access token is decrypted once and kept in memory. Validation and
+	refreshing happen on the TokenRefresher thread, and concurrent refreshes
+	share a single request to Twitch.
 	"""
 	def __init__(self, oauth_token, refresh_token, expire_time, user_id = None):
 		## PRODUCTION ##
@@ -149,16 +318,74 @@ class OauthTokens:
 		self._last_validation_time = 0
 		self._user_id = user_id
 
-	def token(self, fernet_key):
-		if (time.time() - self._last_validation_time) > 600: # 10 minutes
-			self.validate_auth(fernet_key)
+		self._fernet_key = None
+		## Decrypted access token, set on first use
+		self._plain_token = None
+
+		## Single flight state for validate/refresh
+		self._state_lock = threading.Lock()
+		self._maintain_done = None
+		self._last_attempt_time = 0
+
+	def _needs_maintenance(self):
+		if (time.time() - self._last_attempt_time) < TOKEN_RETRY_INTERVAL:
+			return False
+
+		if (time.time() - self._last_validation_time) > TOKEN_VALIDATE_INTERVAL:
+			return True
 
 		tte = (self._expire_time - datetime.now()).total_seconds()
-		if tte < 1800: # 30 minutes
-			self.refresh_auth(fernet_key)
+		return tte < TOKEN_REFRESH_MARGIN
 
-		cipher = Fernet(fernet_key)
-		return cipher.decrypt(self._oauth_token).decode()
+	def token(self, fernet_key):
+		if self._plain_token is None or fernet_key != self._fernet_key:
+			cipher = Fernet(fernet_key)
+			self._plain_token = cipher.decrypt(self._oauth_token).decode()
+			self._fernet_key = fernet_key
+			get_token_refresher().add(self)
+
+		if self._expire_time <= datetime.now():
+			## Already expired so the old token is useless. Wait for a refresh
+			self.maintain()
+		elif self._needs_maintenance():
+			get_token_refresher().poke()
+
+		return self._plain_token
+
+	def maintain(self, timeout=30):
+		"""
+		Validate and refresh the token if needed. If another thread is
+		already doing this, wait for it instead of sending another request
+
+		Args:
+			timeout (int): Seconds to wait on a refresh in another thread
+		"""
+		if self._fernet_key is None:
+			return
+
+		with self._state_lock:
+			done = self._maintain_done
+			leader = done is None
+			if leader:
+				done = threading.Event()
+				self._maintain_done = done
+
+		if not leader:
+			done.wait(timeout)
+			return
+
+		self._last_attempt_time = time.time()
+		try:
+			if (time.time() - self._last_validation_time) > TOKEN_VALIDATE_INTERVAL:
+				self.validate_auth(self._fernet_key)
+
+			tte = (self._expire_time - datetime.now()).total_seconds()
+			if tte < TOKEN_REFRESH_MARGIN:
+				self.refresh_auth(self._fernet_key)
+		finally:
+			with self._state_lock:
+				self._maintain_done = None
+			done.set()
 
 	def validate_auth(self, fernet_key):
 		cipher = Fernet(fernet_key)
@@ -167,11 +394,11 @@ class OauthTokens:
 			"Authorization" : "OAuth {access_token}".format(access_token=token)
 		}
 		try:
-			req = requests.get(
+			req = get_session().get(
 				'https://id.twitch.tv/oauth2/validate',
 				headers = headers
 			)
-		except requests.exceptions.ConnectionError:
+		except requests.exceptions.RequestException:
 			return False
 		resp = json.loads(req.text)
 		if (
@@ -197,11 +424,11 @@ class OauthTokens:
 			'scope': config.SCOPES
 		}
 		try:
-			req = requests.post(
+			req = get_session().post(
 				'https://id.twitch.tv/oauth2/token',
 				data=body
 			)
-		except requests.exceptions.ConnectionError:
+		except requests.exceptions.RequestException:
 			return False
 
 		token_data = json.loads(req.text)
@@ -215,6 +442,8 @@ class OauthTokens:
 			encrypt_refresh = cipher.encrypt(token_data['refresh_token'].encode())
 			self._oauth_token = encrypt_token
 			self._refresh_token = encrypt_refresh
+			if fernet_key == self._fernet_key:
+				self._plain_token = token_data['access_token']
 
 			if self._user_id:
 				con, cur = get_db()
@@ -228,6 +457,13 @@ class OauthTokens:
 
 				con.commit()
 				con.close()
+
+				## If a different object holds the cached copy of this user
+				## its tokens are now stale
+				with _user_cache_lock:
+					cached = _user_cache.get(self._user_id)
+					if cached is not None and cached.oauth_tokens is not self:
+						invalidate_user_cache(self._user_id)
 			self._last_validation_time = time.time()
 			return True
 
@@ -292,6 +528,8 @@ class User:
 			res['token_expire_time'],
 			user_id = self.id
 		)
+		if getattr(self, 'twitch_api', None):
+			self.twitch_api.oauth_tokens = self.oauth_tokens
 
 	def make_broadcaster(self):
 		con, cur = get_db()
@@ -302,6 +540,9 @@ class User:
 		con.commit()
 		con.close()
 
+		## is_broadcaster changed on every cached user
+		invalidate_user_cache()
+
 	def make_default(self):
 		con, cur = get_db()
 
@@ -311,6 +552,8 @@ class User:
 		con.commit()
 		con.close()
 
+		invalidate_user_cache()
+
 	def delete(self):
 		con, cur = get_db()
 
@@ -319,6 +562,8 @@ class User:
 		con.commit()
 		con.close()
 
+		invalidate_user_cache(self.id)
+
 ## Dict factory used for creating dictionaries from SQLite query results
 def _dict_factory(cursor, row):
 	d = {}
@@ -0,0 +1,149 @@
+import threading
+
+import config
+from lib.common import get_db, debug
+
+## Seconds between background writes of changed counters
+DEFAULT_COUNTER_FLUSH_INTERVAL = 1
+
+class CounterStore(threading.Thread):
+	"""
+	In-memory counters with write-behind persistence.
+
+	All counters are loaded once. Reads and increments happen in memory
+	under a lock so concurrent increments are never lost, and changed
+	counters are upserted to the DB every flush_interval seconds.
+	"""
+	def __init__(self):
+		threading.Thread.__init__(self)
+		self.daemon = True
+
+		self.flush_interval = DEFAULT_COUNTER_FLUSH_INTERVAL
+		if hasattr(config, 'COUNTER_FLUSH_INTERVAL'):
+			self.flush_interval = config.COUNTER_FLUSH_INTERVAL
+
+		## counter_name -> value
+		self._values = None
+		## Names changed since the last flush
+		self._dirty = set()
+
+		self._lock = threading.Lock()
+		self._flush_lock = threading.Lock()
+		self._wakeup = threading.Event()
+		self._keep_running = True
+
+	def _load(self):
+		## Must be called with self._lock held
+		if self._values is not None:
+			return
+
+		con, cur = get_db()
+
+		cur.execute("SELECT counter_name, value FROM counters")
+		res = cur.fetchall()
+
+		con.commit()
+		con.close()
+
+		self._values = {r['counter_name']: r['value'] for r in res}
+
+	def increment(self, counter_name, amount=1):
+		"""
+		Add amount to counter_name, creating it if needed, and return the
+		new value
+		"""
+		with self._lock:
+			self._load()
+			value = self._values.get(counter_name, 0) + amount
+			self._values[counter_name] = value
+			self._dirty.add(counter_name)
+			return value
+
+	def get(self, counter_name):
+		"""
+		Get the value of counter_name or None if it doesn't exist
+		"""
+		with self._lock:
+			self._load()
+			return self._values.get(counter_name, None)
+
+	def get_all(self):
+		"""
+		Get all counters as a list of dicts with counter_name and value
+		"""
+		with self._lock:
+			self._load()
+			return [
+				{'counter_name': name, 'value': value}
+				for name, value in self._values.items()
+			]
+
+	def set(self, counter_name, value):
+		"""
+		Set the value of an existing counter
+		"""
+		with self._lock:
+			self._load()
+			if counter_name not in self._values:
+				return
+			self._values[counter_name] = value
+			self._dirty.add(counter_name)
+
+	def flush(self):
+		"""
+		Write changed counters to the DB now
+		"""
+		with self._flush_lock:
+			with self._lock:
+				if not self._dirty:
+					return
+				rows = [(name, self._values[name]) for name in self._dirty]
+				self._dirty = set()
+
+			try:
+				con, cur = get_db()
+
+				sql = "INSERT INTO counters (counter_name, value) VALUES (?, ?) \
+					ON CONFLICT(counter_name) DO UPDATE SET value = excluded.value"
+				cur.executemany(sql, rows)
+
+				con.commit()
+				con.close()
+			except:
+				## Try these again next time
+				with self._lock:
+					self._dirty.update(name for name, value in rows)
+				raise
+
+	def run(self):
+		while self._keep_running:
+			self._wakeup.wait(self.flush_interval)
+			self._wakeup.clear()
+			try:
+				self.flush()
+			except Exception as e:
+				debug(f'Failed to save counters: {e}')
+
+	def stop(self):
+		"""
+		Stop the writer thread and write anything still pending
+		"""
+		self._keep_running = False
+		self._wakeup.set()
+		if self.is_alive():
+			self.join()
+		self.flush()
+
+_counter_store = None
+_counter_store_lock = threading.Lock()
+
+def get_counter_store():
+	"""
+	Get the shared CounterStore, starting it on first use
+	"""
+	global _counter_store
+	with _counter_store_lock:
+		if _counter_store is None:
+			_counter_store = CounterStore()
+			_counter_store.start()
+		return _counter_store
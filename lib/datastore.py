@@ -0,0 +1,136 @@
+import threading
+import json
+
+import config
+from lib.common import get_db
+
+## Seconds between background flushes of module data
+DEFAULT_FLUSH_INTERVAL = 5
+
+class ModuleDataStore(threading.Thread):
+	"""
+	Write-behind store for module data.
+
+	save() only marks the module dirty. This thread serializes and writes
+	dirty modules every flush_interval seconds so JSON encoding and disk
+	I/O stay off the event loop. Repeated saves between flushes are
+	coalesced into a single write and unchanged data is never rewritten.
+
+	Args:
+		buffer_queue (Queue): Queue for UI output
+	"""
+	def __init__(self, buffer_queue):
+		threading.Thread.__init__(self)
+		self.daemon = True
+
+		self.buffer_queue = buffer_queue
+		self.flush_interval = DEFAULT_FLUSH_INTERVAL
+		if hasattr(config, 'MODULE_DATA_FLUSH_INTERVAL'):
+			self.flush_interval = config.MODULE_DATA_FLUSH_INTERVAL
+
+		## module_name -> data waiting to be written
+		self._dirty = {}
+		## module_name -> last JSON string written to the DB
+		self._written = {}
+
+		self._lock = threading.Lock()
+		## Only one flush may write at a time
+		self._flush_lock = threading.Lock()
+		self._wakeup = threading.Event()
+		self._keep_running = True
+
+	def save(self, module_name, data):
+		"""
+		Mark data as the latest state for module_name. Never blocks on I/O
+		"""
+		## Shallow copy so keys added or removed after this call don't
+		## change the dict while the writer is serializing it
+		if isinstance(data, dict):
+			data = dict(data)
+		with self._lock:
+			self._dirty[module_name] = data
+
+	def load(self, module_name):
+		"""
+		Get the saved data for module_name. Pending writes for the module are
+		flushed first so the result is never stale
+		"""
+		self.flush(module_name)
+
+		con, cur = get_db()
+
+		sql = "SELECT data FROM module_data WHERE module_name = ?"
+		cur.execute(sql, (module_name, ))
+		res = cur.fetchone()
+
+		con.commit()
+		con.close()
+
+		if res:
+			self._written[module_name] = res['data']
+			return json.loads(res['data'])
+		else:
+			return {}
+
+	def flush(self, module_name=None):
+		"""
+		Write pending data to the DB now
+
+		Args:
+			module_name (string): Only flush this module. Flush all if None
+		"""
+		with self._flush_lock:
+			with self._lock:
+				if module_name is None:
+					pending = self._dirty
+					self._dirty = {}
+				elif module_name in self._dirty:
+					pending = {module_name: self._dirty.pop(module_name)}
+				else:
+					return
+
+			rows = []
+			for name, data in pending.items():
+				try:
+					data_str = json.dumps(data)
+				except RuntimeError:
+					## A nested dict changed while it was being serialized.
+					## Keep it dirty and try again on the next flush
+					with self._lock:
+						self._dirty.setdefault(name, data)
+					continue
+
+				if self._written.get(name) != data_str:
+					rows.append((name, data_str))
+
+			if not rows:
+				return
+
+			con, cur = get_db()
+
+			sql = "REPLACE INTO module_data (module_name, data) VALUES (?, ?)"
+			cur.executemany(sql, rows)
+
+			con.commit()
+			con.close()
+
+			for name, data_str in rows:
+				self._written[name] = data_str
+
+	def run(self):
+		while self._keep_running:
+			self._wakeup.wait(self.flush_interval)
+			self._wakeup.clear()
+			try:
+				self.flush()
+			except Exception as e:
+				self.buffer_queue.put(('ERR', f'Failed to save module data: {e}'))
+
+	def stop(self):
+		"""
+		Stop the writer thread and write anything still pending
+		"""
+		self._keep_running = False
+		self._wakeup.set()
+		self.join()
+		self.flush()
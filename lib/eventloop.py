@@ -2,19 +2,20 @@ import threading
 import os
 import sys
 import time
+import heapq
+import itertools
 from importlib import import_module
 from queue import Queue
-from math import sqrt
 
-import sounddevice
-import audio2numpy
 from audio2numpy.exceptions import AudioFormatError
-import numpy
 
-from base.events import Event, TimerEvent, StreamStatusEvent, EVT_CHATCOMMAND
+from base.events import Event, TimerEvent, StreamStatusEvent, ScheduledEvent, EVT_CHATCOMMAND, EVT_TIMER, EVT_SCHEDULED
 from lib.common import get_db, get_broadcaster, get_module_directory
-from lib.TwitchAPIHelper import TwitchAPIHelper
+from lib.TwitchAPIHelper import TwitchAPIHelper, PRIORITY_LOW
 import config
+from lib.audiocache import audio_cache
+from lib.audiodsp import volume_gain
+from lib.mixer import Mixer, POLICY_STACK
 
 sys.path.append(config.APP_DIRECTORY)
 
@@ -35,8 +36,7 @@ class BroadcastStatusThread(threading.Thread):
 			if (time.time() - self.last_check > 30) and (time.time() - self.last_changed > 180):
 				broadcaster = get_broadcaster()
 				if broadcaster:
-					api = TwitchAPIHelper(broadcaster.oauth_tokens)
-					stream = api.get_stream(broadcaster.twitch_user_id)
+					stream = broadcaster.twitch_api.get_stream(broadcaster.twitch_user_id, PRIORITY_LOW)
 					if stream:
 						if not self.broadcast_id or self.last_check == 0:
 							self.event_queue.put(StreamStatusEvent(
@@ -66,21 +66,87 @@ class BroadcastStatusThread(threading.Thread):
 	def stop(self):
 		self._keep_listening = False
 
-class TimerEventThread(threading.Thread):
+class ScheduledJob:
+	"""
+	A callback scheduled to run on the event loop thread
+
+	Args:
+		due (float): time.time() timestamp when the job should run
+		callback (func): Function to call
+		args (tuple): Arguments passed to callback
+		interval (float): If set, the job repeats every interval seconds
+	"""
+	__slots__ = ('due', 'callback', 'args', 'interval', 'cancelled')
+
+	def __init__(self, due, callback, args=(), interval=None):
+		self.due = due
+		self.callback = callback
+		self.args = args
+		self.interval = interval
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+class SchedulerThread(threading.Thread):
+	"""
+	Holds scheduled jobs in a heap and sleeps until the next one is due.
+	Due jobs are posted to the event queue as ScheduledEvents so callbacks
+	always run on the event loop thread. Nothing wakes up while idle.
+	"""
 	def __init__(self, event_queue):
 		threading.Thread.__init__(self)
+		self.daemon = True
 
 		self.event_queue = event_queue
+		self._heap = []
+		self._counter = itertools.count()
+		self._condition = threading.Condition()
 		self._keep_listening = True
 
+	def schedule(self, job):
+		with self._condition:
+			heapq.heappush(self._heap, (job.due, next(self._counter), job))
+			## Only wake the thread if this job is now the next one due
+			if self._heap[0][2] is job:
+				self._condition.notify()
+		return job
+
 	def run(self):
-		while self._keep_listening:
-			time.sleep(1)
+		with self._condition:
+			while self._keep_listening:
+				## Drop cancelled jobs sitting at the front
+				while self._heap and self._heap[0][2].cancelled:
+					heapq.heappop(self._heap)
+
+				if not self._heap:
+					self._condition.wait()
+					continue
+
+				due, count, job = self._heap[0]
+				wait = due - time.time()
+				if wait > 0:
+					self._condition.wait(wait)
+					continue
 
-			self.event_queue.put(TimerEvent())
+				heapq.heappop(self._heap)
+				self.event_queue.put(ScheduledEvent(job))
+
+				if job.interval:
+					## Skip runs we missed rather than firing them all at once
+					now = time.time()
+					job.due += job.interval
+					if job.due <= now:
+						job.due = now + job.interval
+					heapq.heappush(self._heap, (job.due, next(self._counter), job))
 
 	def stop(self):
-		self._keep_listening = False
+		with self._condition:
+			self._keep_listening = False
+			self._condition.notify()
+
+## Audio files bigger than this are decoded while they play
+DEFAULT_AUDIO_STREAM_THRESHOLD_MB = 2
 
 class MediaThread(threading.Thread):
 	def __init__(self, media_queue, buffer_queue):
@@ -90,39 +156,92 @@ class MediaThread(threading.Thread):
 		self.buffer_queue = buffer_queue
 		self._keep_listening = True
 
+		## Sounds are mixed so they can overlap instead of playing in turn
+		self.mixer = Mixer(buffer_queue)
+
+		## Files bigger than this many bytes are streamed
+		self.stream_threshold = DEFAULT_AUDIO_STREAM_THRESHOLD_MB * 1024 * 1024
+		if hasattr(config, 'AUDIO_STREAM_THRESHOLD_MB'):
+			self.stream_threshold = config.AUDIO_STREAM_THRESHOLD_MB * 1024 * 1024
+		self._can_stream = True
+
 	def run(self):
 		while self._keep_listening:
 			media = self.media_queue.get()
 
 			if media == 'SHUTDOWN':
 				self._keep_listening = False
+				self.mixer.close()
 				break
 
 			if len(media) < 2:
 				continue
 
-			if media[0] == 'audio':
-				kwargs = {}
-				if len(media) >= 3:
-					kwargs = media[2]
-				device = kwargs.get('device', None)
-				volume = kwargs.get('volume', 100)
-
-				try:
-					data, fs = audio2numpy.open_audio(media[1])
-				except AudioFormatError:
-					self.buffer_queue.put(('ERR', 'Invalid File Format:'))
-					self.buffer_queue.put(('ERR', media[1]))
-					self.buffer_queue.put(('ERR', 'Accepted file formats: .wav .mp3'))
-					continue
+			kwargs = {}
+			if len(media) >= 3:
+				kwargs = media[2]
+			volume = kwargs.get('volume', 100)
+			device = kwargs.get('device', None)
+
+			try:
+				device_mixer = self.mixer.get_device(device)
+			except Exception as e:
+				self.buffer_queue.put(('ERR', f'Unable to open audio device {device}: {e}'))
+				continue
 
-				if volume != 100 and type(volume) == int:
-					factor = volume / 100
-					multiplier = pow(2, (sqrt(sqrt(sqrt(factor))) * 192 - 192)/6)
-					numpy.multiply(data, multiplier, out=data, casting='unsafe')
+			if media[0] == 'prewarm':
+				if not self._should_stream(media[1]):
+					audio_cache.prewarm(media[1], device_mixer.samplerate, device_mixer.channels)
+
+			elif media[0] == 'audio':
+				key = kwargs.get('key', media[1])
+				policy = kwargs.get('policy', POLICY_STACK)
+
+				played = None
+				if self._should_stream(media[1]):
+					played = self._stream(device_mixer, media[1], volume, key, policy)
+
+				if played is None:
+					try:
+						data, fs = audio_cache.get(media[1], device_mixer.samplerate, device_mixer.channels)
+					except AudioFormatError:
+						self.buffer_queue.put(('ERR', 'Invalid File Format:'))
+						self.buffer_queue.put(('ERR', media[1]))
+						self.buffer_queue.put(('ERR', 'Accepted file formats: .wav .mp3'))
+						continue
+					except OSError:
+						self.buffer_queue.put(('ERR', f'{media[1]} does not exist'))
+						continue
 
-				sounddevice.play(data, fs, device=device)
-				sounddevice.wait()
+					played = device_mixer.play(data, key=key, policy=policy, gain=volume_gain(volume))
+
+				if not played:
+					self.buffer_queue.put(('DEBUG', f'Too many sounds playing. Skipped {media[1]}'))
+
+	def _should_stream(self, path):
+		"""
+		Long files are decoded while they play instead of all at once
+		"""
+		if not self._can_stream:
+			return False
+		try:
+			return os.path.getsize(path) > self.stream_threshold
+		except OSError:
+			return False
+
+	def _stream(self, device_mixer, path, volume, key, policy):
+		"""
+		Play path with a StreamingVoice
+
+		Returns:
+			Whether it played, or None if streaming isn't available
+		"""
+		try:
+			return device_mixer.stream(path, key=key, policy=policy, gain=volume_gain(volume))
+		except OSError:
+			self._can_stream = False
+			self.buffer_queue.put(('ERR', 'ffmpeg not found. Long sounds will be decoded before playing'))
+			return None
 
 class EventLoop(threading.Thread):
 	def __init__(self, voltron, buffer_queue, event_queue):
@@ -151,9 +270,23 @@ class EventLoop(threading.Thread):
 			'RAID': [],
 		}
 
+		## CHATCOMMAND listeners that only care about specific commands
+		## callback -> set of command names. Listeners registered without
+		## a command set receive every command
+		self._command_filters = {}
+		## command -> listeners interested in it, in registration order
+		self._command_dispatch = {}
+		self._wildcard_command_listeners = []
+
 		self._keep_listening = True
 
+		## Jobs can be scheduled before the thread starts
+		self.scheduler = SchedulerThread(self.event_queue)
+		self._timer_job = None
+
 	def run(self):
+		self.scheduler.start()
+
 		core_mods = next(os.walk('./CoreModules'))[1]
 		for mod in core_mods:
 			if mod[0] == '_':
@@ -169,8 +302,9 @@ class EventLoop(threading.Thread):
 
 		self.update_modules()
 
-		self.timer_thread = TimerEventThread(self.event_queue)
-		self.timer_thread.start()
+		## Only generate the legacy 1 second TimerEvent if a module wants it
+		if self.registered_listeners[EVT_TIMER]:
+			self._timer_job = self.schedule_every(1, self._timer_tick)
 
 		self.media_thread = MediaThread(self.media_queue, self.buffer_queue)
 		self.media_thread.start()
@@ -228,6 +362,44 @@ class EventLoop(threading.Thread):
 		con.commit()
 		con.close()
 
+	def schedule_at(self, timestamp, callback, *args, interval=None):
+		"""
+		Run callback on the event loop thread at timestamp
+
+		Args:
+			timestamp (float): time.time() based time to run the callback
+			callback (func): Function to call
+			interval (float): If set, repeat every interval seconds after that
+
+		Returns:
+			ScheduledJob: Pass to cancel() to stop the job
+		"""
+		return self.scheduler.schedule(ScheduledJob(timestamp, callback, args, interval))
+
+	def schedule_after(self, delay, callback, *args, interval=None):
+		"""
+		Run callback on the event loop thread after delay seconds
+		"""
+		return self.schedule_at(time.time() + delay, callback, *args, interval=interval)
+
+	def schedule_every(self, interval, callback, *args):
+		"""
+		Run callback on the event loop thread every interval seconds
+		"""
+		return self.schedule_after(interval, callback, *args, interval=interval)
+
+	def cancel(self, job):
+		"""
+		Cancel a job returned by one of the schedule methods
+		"""
+		if job is not None:
+			job.cancel()
+
+	def _timer_tick(self):
+		event = TimerEvent()
+		for callback in self.registered_listeners[EVT_TIMER]:
+			callback(event)
+
 	def get_all_commands(self, twitch_id, is_mod=False, is_broadcaster=False):
 		commands = {}
 		for mod in self.modules:
@@ -238,8 +410,67 @@ class EventLoop(threading.Thread):
 		return commands
 
 	def register_event(self, event_type, callback, event_params):
-		if event_type in self.registered_listeners:
-			self.registered_listeners[event_type].append(callback)
+		"""
+		Register callback to be called for events of event_type
+
+		Args:
+			event_type (string): One of the EVT_* event types
+			callback (func): Called with the event. Return True if handled
+			event_params (dict): Optional. For EVT_CHATCOMMAND, 'commands' is
+				a set of command names the callback handles. It will then only
+				be called for those commands
+		"""
+		if event_type not in self.registered_listeners:
+			return
+
+		self.registered_listeners[event_type].append(callback)
+		if event_type == EVT_CHATCOMMAND:
+			commands = None
+			if event_params and event_params.get('commands') is not None:
+				commands = event_params['commands']
+			self.update_command_filter(callback, commands)
+
+	def update_command_filter(self, callback, commands):
+		"""
+		Change the set of commands a CHATCOMMAND listener is called for.
+		Modules call this whenever they add or remove commands
+
+		Args:
+			callback (func): A callback previously passed to register_event
+			commands (iterable): Command names, or None to receive every command
+		"""
+		if commands is not None:
+			commands = frozenset(c.lower() for c in commands)
+		self._command_filters[callback] = commands
+		self._rebuild_command_dispatch()
+
+	def _rebuild_command_dispatch(self):
+		## Precompute the listener list for every known command so dispatch
+		## is a single dict lookup. Registration order is preserved
+		listeners = self.registered_listeners[EVT_CHATCOMMAND]
+		filters = self._command_filters
+
+		wildcard = [cb for cb in listeners if filters.get(cb) is None]
+		all_commands = set()
+		for commands in filters.values():
+			if commands:
+				all_commands.update(commands)
+
+		dispatch = {}
+		for command in all_commands:
+			dispatch[command] = [
+				cb for cb in listeners
+				if filters.get(cb) is None or command in filters[cb]
+			]
+
+		## Swap in whole objects so the event loop never sees a partial update
+		self._wildcard_command_listeners = wildcard
+		self._command_dispatch = dispatch
+
+	def _get_listeners(self, event):
+		if event.type == EVT_CHATCOMMAND:
+			return self._command_dispatch.get(event.command, self._wildcard_command_listeners)
+		return self.registered_listeners.get(event.type, [])
 
 	def listen(self):
 		while self._keep_listening:
@@ -250,13 +481,16 @@ class EventLoop(threading.Thread):
 					module.shutdown()
 				break
 			elif isinstance(event, Event):
+				if event.type == EVT_SCHEDULED:
+					event.run()
+					continue
 				if event.type == EVT_CHATCOMMAND and self.permission_module:
 					if not self.permission_module.has_command_permission(event):
 						continue
 				if event.type == EVT_CHATCOMMAND and self.cooldown_module:
 					if self.cooldown_module.event_on_cooldown(event):
 						continue
-				callbacks = self.registered_listeners.get(event.type, [])
+				callbacks = self._get_listeners(event)
 				handled = False
 				for callback in callbacks:
 					if callback(event):
@@ -265,8 +499,8 @@ class EventLoop(threading.Thread):
 				if event.type == EVT_CHATCOMMAND and self.cooldown_module and handled:
 					self.cooldown_module.update_runtimes(event)
 				#self.buffer_queue.put(('INFO', event.type))
-		self.timer_thread.stop()
-		self.timer_thread.join()
+		self.scheduler.stop()
+		self.scheduler.join()
 
 		self.media_queue.put('SHUTDOWN')
 		#self.media_thread.stop()
@@ -0,0 +1,65 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+## Seconds to wait for a connection / for a response
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+
+## Connections kept open per host
+POOL_MAXSIZE = 16
+
+## Retry on server errors with exponential backoff. 429s are left to
+## TwitchAPIHelper's rate limit governor, which knows when the bucket resets.
+## POST is left out since a retried token refresh or subscription could
+## be applied twice
+RETRY_STATUSES = (500, 502, 503, 504)
+RETRY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PATCH', 'PUT', 'DELETE'])
+
+class TimeoutSession(requests.Session):
+	"""
+	requests.Session that applies a default timeout to every request
+	"""
+	def request(self, method, url, **kwargs):
+		kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+		return requests.Session.request(self, method, url, **kwargs)
+
+_session = None
+_session_lock = threading.Lock()
+
+def _make_session():
+	retry = Retry(
+		total = 3,
+		connect = 3,
+		read = 2,
+		status = 3,
+		backoff_factor = 0.5,
+		status_forcelist = RETRY_STATUSES,
+		allowed_methods = RETRY_METHODS,
+		raise_on_status = False
+	)
+	adapter = HTTPAdapter(
+		pool_connections = 4,
+		pool_maxsize = POOL_MAXSIZE,
+		max_retries = retry
+	)
+
+	session = TimeoutSession()
+	session.mount('https://', adapter)
+	session.mount('http://', adapter)
+
+	return session
+
+def get_session():
+	"""
+	Get the shared requests.Session. Reusing it keeps connections to Twitch
+	alive between requests instead of doing a new TCP and TLS handshake
+	every time
+	"""
+	global _session
+	with _session_lock:
+		if _session is None:
+			_session = _make_session()
+		return _session
@@ -0,0 +1,356 @@
+import threading
+import subprocess
+import tempfile
+
+import numpy
+import sounddevice
+
+import config
+
+## Frames per output callback. Sounds start within one block of being played
+DEFAULT_AUDIO_BLOCK_SIZE = 512
+## Sounds allowed to play at once on a device
+DEFAULT_AUDIO_MAX_VOICES = 8
+## What to do when a device is already playing the most sounds it may:
+## 'drop_oldest' stops the oldest sound, 'drop_new' skips the new one
+DEFAULT_AUDIO_OVERFLOW = 'drop_oldest'
+
+## Play policies
+POLICY_STACK = 'stack'
+POLICY_REPLACE = 'replace'
+
+## Seconds of decoded audio a StreamingVoice buffers ahead
+STREAM_BUFFER_SECONDS = 2
+## Longest to wait for the first decoded audio before starting a stream
+STREAM_START_TIMEOUT = 0.5
+
+class Voice:
+	"""
+	One sound playing on a DeviceMixer
+
+	Args:
+		data (numpy.ndarray): float32 frames x channels
+		key (string): Voices with the same key can replace each other
+		gain (float): Multiplier applied while mixing
+	"""
+	__slots__ = ('data', 'key', 'gain', 'position')
+
+	def __init__(self, data, key=None, gain=1.0):
+		self.data = data
+		self.key = key
+		self.gain = gain
+		self.position = 0
+
+	def read(self, frames):
+		"""
+		Get up to frames frames to mix next
+		"""
+		chunk = self.data[self.position:self.position + frames]
+		self.position += len(chunk)
+		return chunk
+
+	@property
+	def finished(self):
+		return self.position >= len(self.data)
+
+	def close(self):
+		pass
+
+class StreamingVoice:
+	"""
+	A voice decoded while it plays, for long files that would take too
+	long to decode up front or use too much memory. ffmpeg decodes into a
+	ring buffer a few seconds ahead of playback, so memory use doesn't
+	depend on the length of the file.
+
+	Args:
+		path (string): Audio file
+		samplerate (int): Output sample rate
+		channels (int): Output channels
+		key (string): Voices with the same key can replace each other
+		gain (float): Multiplier applied while mixing
+		buffer_queue (Queue): Queue for UI output. Decode errors go here
+
+	Raises:
+		OSError if ffmpeg can't be started
+	"""
+	def __init__(self, path, samplerate, channels, key=None, gain=1.0, buffer_queue=None):
+		self.path = path
+		self.buffer_queue = buffer_queue
+		self.key = key
+		self.gain = gain
+		self.channels = channels
+
+		capacity = int(samplerate * STREAM_BUFFER_SECONDS)
+		self._ring = numpy.zeros((capacity, channels), dtype=numpy.float32)
+		## Chunks handed to the mixer are copied here so the decoder can't
+		## overwrite them
+		self._out = numpy.zeros((capacity, channels), dtype=numpy.float32)
+		self._read_pos = 0
+		self._available = 0
+		self._done = False
+		self._closed = False
+		self._cond = threading.Condition()
+
+		## Errors go to a file rather than a pipe so a noisy decode can't
+		## fill the pipe and stall ffmpeg
+		self._errors = tempfile.TemporaryFile()
+		try:
+			self._process = subprocess.Popen(
+				[
+					'ffmpeg', '-v', 'error', '-i', path,
+					'-f', 'f32le', '-acodec', 'pcm_f32le',
+					'-ac', str(channels), '-ar', str(samplerate), '-'
+				],
+				stdin = subprocess.DEVNULL,
+				stdout = subprocess.PIPE,
+				stderr = self._errors,
+				creationflags = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+			)
+		except:
+			self._errors.close()
+			raise
+
+		self._decoder = threading.Thread(target=self._decode)
+		self._decoder.daemon = True
+		self._decoder.start()
+
+	def _decode(self):
+		capacity = len(self._ring)
+		frame_bytes = 4 * self.channels
+		pending = b''
+		try:
+			while True:
+				raw = self._process.stdout.read(frame_bytes * 4096)
+				if not raw:
+					break
+				raw = pending + raw
+				usable = len(raw) - len(raw) % frame_bytes
+				pending = raw[usable:]
+				frames = numpy.frombuffer(raw[:usable], dtype=numpy.float32).reshape(-1, self.channels)
+
+				while len(frames):
+					with self._cond:
+						while self._available == capacity and not self._closed:
+							self._cond.wait()
+						if self._closed:
+							return
+
+						write_pos = (self._read_pos + self._available) % capacity
+						count = min(len(frames), capacity - self._available, capacity - write_pos)
+						self._ring[write_pos:write_pos + count] = frames[:count]
+						self._available += count
+						self._cond.notify_all()
+					frames = frames[count:]
+		finally:
+			with self._cond:
+				self._done = True
+				self._cond.notify_all()
+			self._process.stdout.close()
+			self._process.wait()
+			self._report_errors()
+
+	def _report_errors(self):
+		## A file that exists but can't be decoded just ends early, so tell
+		## the user why it was silent. Nothing to report if we stopped it
+		try:
+			if self._process.returncode == 0 or self._closed or self.buffer_queue is None:
+				return
+			self._errors.seek(0)
+			lines = self._errors.read().decode('utf-8', 'replace').strip().splitlines()
+			reason = lines[-1] if lines else f'ffmpeg exited with code {self._process.returncode}'
+			self.buffer_queue.put(('ERR', f'Unable to play {self.path}: {reason}'))
+		finally:
+			self._errors.close()
+
+	def wait_ready(self, timeout=STREAM_START_TIMEOUT):
+		"""
+		Wait until some audio has been decoded or decoding has finished
+		"""
+		with self._cond:
+			self._cond.wait_for(lambda: self._available or self._done, timeout)
+
+	def read(self, frames):
+		capacity = len(self._ring)
+		with self._cond:
+			count = min(frames, self._available)
+			first = min(count, capacity - self._read_pos)
+			self._out[:first] = self._ring[self._read_pos:self._read_pos + first]
+			self._out[first:count] = self._ring[:count - first]
+			self._read_pos = (self._read_pos + count) % capacity
+			self._available -= count
+			self._cond.notify_all()
+		## Running short before the end only means decoding fell behind.
+		## The missing part of the block is silent
+		return self._out[:count]
+
+	@property
+	def finished(self):
+		return self._done and not self._available
+
+	def close(self):
+		with self._cond:
+			self._closed = True
+			self._cond.notify_all()
+		if self._process.poll() is None:
+			self._process.kill()
+
+class DeviceMixer:
+	"""
+	Mixes any number of sounds into a single sounddevice.OutputStream so
+	sounds play as soon as they're triggered instead of waiting for the
+	previous one to finish
+
+	Args:
+		device (int/string): sounddevice output device. None for default
+		buffer_queue (Queue): Queue for UI output
+	"""
+	def __init__(self, device, buffer_queue):
+		self.device = device
+		self.buffer_queue = buffer_queue
+
+		self.block_size = DEFAULT_AUDIO_BLOCK_SIZE
+		if hasattr(config, 'AUDIO_BLOCK_SIZE'):
+			self.block_size = config.AUDIO_BLOCK_SIZE
+		self.max_voices = DEFAULT_AUDIO_MAX_VOICES
+		if hasattr(config, 'AUDIO_MAX_VOICES'):
+			self.max_voices = config.AUDIO_MAX_VOICES
+		self.overflow = DEFAULT_AUDIO_OVERFLOW
+		if hasattr(config, 'AUDIO_OVERFLOW'):
+			self.overflow = config.AUDIO_OVERFLOW
+
+		info = sounddevice.query_devices(device, 'output')
+		self.samplerate = int(info['default_samplerate'])
+		self.channels = min(2, info['max_output_channels'])
+
+		self._voices = []
+		self._lock = threading.Lock()
+		## Gain is applied into this so mixing doesn't allocate
+		self._scratch = numpy.zeros((self.block_size, self.channels), dtype=numpy.float32)
+
+		self._stream = sounddevice.OutputStream(
+			samplerate = self.samplerate,
+			blocksize = self.block_size,
+			channels = self.channels,
+			dtype = 'float32',
+			device = device,
+			latency = 'low',
+			callback = self._callback
+		)
+		self._stream.start()
+
+	def play(self, data, key=None, policy=POLICY_STACK, gain=1.0):
+		"""
+		Start playing data
+
+		Args:
+			data (numpy.ndarray): float32 frames x channels at this mixer's
+				sample rate and channel count
+			key (string): Identifies the sound for the replace policy
+			policy (string): POLICY_STACK plays over anything already
+				playing, POLICY_REPLACE stops voices with the same key first
+			gain (float): Multiplier applied while mixing
+		"""
+		return self.play_voice(Voice(data, key, gain), policy)
+
+	def stream(self, path, key=None, policy=POLICY_STACK, gain=1.0):
+		"""
+		Start playing path while it is decoded. See StreamingVoice
+
+		Raises:
+			OSError if ffmpeg can't be started
+		"""
+		voice = StreamingVoice(path, self.samplerate, self.channels, key, gain, self.buffer_queue)
+		voice.wait_ready()
+		return self.play_voice(voice, policy)
+
+	def play_voice(self, voice, policy=POLICY_STACK):
+		removed = []
+		with self._lock:
+			if policy == POLICY_REPLACE and voice.key is not None:
+				removed = [v for v in self._voices if v.key == voice.key]
+				self._voices = [v for v in self._voices if v.key != voice.key]
+
+			if len(self._voices) >= self.max_voices:
+				if self.overflow != 'drop_oldest':
+					removed.append(voice)
+					voice = None
+				else:
+					drop = len(self._voices) - self.max_voices + 1
+					removed += self._voices[:drop]
+					self._voices = self._voices[drop:]
+
+			if voice is not None:
+				self._voices.append(voice)
+
+		for v in removed:
+			v.close()
+		return voice is not None
+
+	def stop_all(self):
+		with self._lock:
+			removed = self._voices
+			self._voices = []
+		for v in removed:
+			v.close()
+
+	def _callback(self, outdata, frames, time, status):
+		outdata.fill(0)
+		with self._lock:
+			voices = list(self._voices)
+
+		if len(self._scratch) < frames:
+			self._scratch = numpy.zeros((frames, self.channels), dtype=numpy.float32)
+
+		finished = []
+		for voice in voices:
+			chunk = voice.read(frames)
+			count = len(chunk)
+			if voice.gain == 1.0:
+				outdata[:count] += chunk
+			else:
+				scratch = self._scratch[:count]
+				numpy.multiply(chunk, voice.gain, out=scratch)
+				outdata[:count] += scratch
+			if voice.finished:
+				finished.append(voice)
+
+		numpy.clip(outdata, -1.0, 1.0, out=outdata)
+
+		if finished:
+			with self._lock:
+				self._voices = [v for v in self._voices if v not in finished]
+			for voice in finished:
+				voice.close()
+
+	def close(self):
+		self.stop_all()
+		self._stream.stop()
+		self._stream.close()
+
+class Mixer:
+	"""
+	Keeps one DeviceMixer per output device
+
+	Args:
+		buffer_queue (Queue): Queue for UI output
+	"""
+	def __init__(self, buffer_queue):
+		self.buffer_queue = buffer_queue
+		self._devices = {}
+
+	def get_device(self, device):
+		"""
+		Get the DeviceMixer for device, opening its stream on first use
+		"""
+		if device not in self._devices:
+			self._devices[device] = DeviceMixer(device, self.buffer_queue)
+		return self._devices[device]
+
+	def close(self):
+		for device_mixer in self._devices.values():
+			try:
+				device_mixer.close()
+			except Exception:
+				pass
+		self._devices = {}
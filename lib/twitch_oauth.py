@@ -8,7 +8,7 @@ import json
 from datetime import datetime, timedelta
 from cryptography.fernet import Fernet
 
-from lib.common import debug, OauthTokens, get_db, User, get_user_by_twitch_id
+from lib.common import debug, OauthTokens, get_db, User, get_user, get_user_by_twitch_id, invalidate_user_cache
 from lib.TwitchAPIHelper import TwitchAPIHelper
 import config
 
@@ -196,8 +196,11 @@ def save_oauth(oauth_token, refresh_token, expires_in, is_broadcaster):
 			existing.id
 		))
 		con.commit()
-		new_user = existing
-		new_user.refresh()
+		## Update anything already holding this user, then drop the cache
+		## since the broadcaster/default flags may have moved
+		existing.refresh()
+		invalidate_user_cache()
+		new_user = get_user(existing.id)
 	else:
 		sql = "INSERT INTO oauth \
 			(user_name, login_time, display_name, twitch_user_id, oauth_token, refresh_token, token_expire_time, is_broadcaster, is_default) \
@@ -215,7 +218,8 @@ def save_oauth(oauth_token, refresh_token, expires_in, is_broadcaster):
 			)
 		)
 		con.commit()
-		new_user = User(cur.lastrowid)
+		invalidate_user_cache()
+		new_user = get_user(cur.lastrowid)
 	con.close()
 
 	return new_user